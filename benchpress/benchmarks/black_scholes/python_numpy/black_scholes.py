@@ -57,7 +57,7 @@ def price(S, I, flag='c', X=65.0, dT=(1.0/365.0), r=0.08, v=0.3, visualize=False
         T += dT
         if visualize:   #NB: this is only for experiments
             np.visualize(P, "3d", 0, 0.0, 10)
-        util.Benchmark().flush()
+        util.flush()
 
     return Ps
 
@@ -73,6 +73,8 @@ def main():
     if B.dumpinput:
         B.dump_arrays("black_scholes", {'input': S})
 
+    # Each iteration prices N samples using about 67 FLOPs each (log and exp count as one) and reads S once
+    B.work(flops=67 * N * I, nbytes=N * I * np.dtype(B.dtype).itemsize, elements=N * I)
     B.start()
     R = price(S, I, visualize=B.visualize)  # Run the model
     B.stop()
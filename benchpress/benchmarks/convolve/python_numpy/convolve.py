@@ -15,6 +15,10 @@ def main():
     image = B.random_array((image_size**ndims,)).reshape([image_size]*ndims)
     image_filter = B.random_array((filter_size**ndims,)).reshape([filter_size]*ndims)
 
+    # Each iteration reads the image and the filter and writes the full convolution once
+    B.work(flops=2 * image_size**ndims * filter_size**ndims * I,
+           nbytes=(image_size**ndims + filter_size**ndims + (image_size + filter_size - 1)**ndims) * I * image.itemsize,
+           elements=image_size**ndims * I)
     B.start()
     for _ in range(I):
         R = bh.convolve_scipy(image, image_filter)
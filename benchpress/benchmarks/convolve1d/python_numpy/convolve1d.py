@@ -15,6 +15,10 @@ def main():
     image = B.random_array((image_size,))
     image_filter = B.random_array((filter_size,))
 
+    # Each iteration reads the image and the filter and writes the full convolution once
+    B.work(flops=2 * image_size * filter_size * I,
+           nbytes=2 * (image_size + filter_size) * I * image.itemsize,
+           elements=image_size * I)
     B.start()
     for _ in range(I):
         R = np.convolve(image, image_filter)
@@ -11,6 +11,9 @@ def main():
     B = util.Benchmark()
     num_beans, height = B.size
 
+    # Each bean bounces `height` times using 3 FLOPs per bounce and a random number written and read once
+    B.work(flops=3 * num_beans * height, nbytes=2 * num_beans * height * np.dtype(B.dtype).itemsize,
+           elements=num_beans * height)
     B.start()
     R = bean(B, num_beans, height)
     B.stop()
@@ -22,40 +22,62 @@ def world_zeros(height, width, B):
     state = np.zeros((height+2, width+2), dtype=B.dtype)
     return state
 
-def play(state, iterations, version=1, visualize=False):
-
-    cells = state[1:-1,1:-1]
-    ul = state[0:-2, 0:-2]
-    um = state[0:-2, 1:-1]
-    ur = state[0:-2, 2:  ]
-    ml = state[1:-1, 0:-2]
-    mr = state[1:-1, 2:  ]
-    ll = state[2:  , 0:-2]
-    lm = state[2:  , 1:-1]
-    lr = state[2:  , 2:  ]
-
-    def update():
-        """
-        This is the first implementation of the game rules.
-        """
-        neighbors = ul + um + ur + ml + mr + ll + lm + lr       # count neighbors
-        live = neighbors * cells                                # extract live cells neighbors
-        stay = (live >= SURVIVE_LOW) & (live <= SURVIVE_HIGH)   # find cells the stay alive
-        dead = neighbors * (cells == 0)                         # extract dead cell neighbors
-        spawn = dead == SPAWN                                   # find cells that spaw new life
-
-        cells[:] = stay | spawn                                 # save result for next iteration
-
-    def update_optimized():
-        """
-        This is an optimized implementation of the game rules.
-        """
-        neighbors = ul + um + ur + ml + mr + ll + lm + lr       # Count neighbors
-
-        c1 = (neighbors == SURVIVE_LOW)                         # Life conditions
-        c2 = (neighbors == SPAWN)
-
-        cells[:] = cells * c1 + c2                              # Update
+def neighborhood(state, start, stop):
+    """Return the cells of the rows `start:stop` of the world `state` and their eight neighbors"""
+    rows  = slice(start + 1, stop + 1)
+    above = slice(start, stop)
+    below = slice(start + 2, stop + 2)
+
+    cells = state[rows, 1:-1]
+    ul = state[above, 0:-2]
+    um = state[above, 1:-1]
+    ur = state[above, 2:  ]
+    ml = state[rows, 0:-2]
+    mr = state[rows, 2:  ]
+    ll = state[below, 0:-2]
+    lm = state[below, 1:-1]
+    lr = state[below, 2:  ]
+    return (cells, ul, um, ur, ml, mr, ll, lm, lr)
+
+def update(cells, ul, um, ur, ml, mr, ll, lm, lr):
+    """
+    This is the first implementation of the game rules, which returns the new cells.
+    """
+    neighbors = ul + um + ur + ml + mr + ll + lm + lr       # count neighbors
+    live = neighbors * cells                                # extract live cells neighbors
+    stay = (live >= SURVIVE_LOW) & (live <= SURVIVE_HIGH)   # find cells the stay alive
+    dead = neighbors * (cells == 0)                         # extract dead cell neighbors
+    spawn = dead == SPAWN                                   # find cells that spaw new life
+
+    return stay | spawn                                     # the result for next iteration
+
+def update_optimized(cells, ul, um, ur, ml, mr, ll, lm, lr):
+    """
+    This is an optimized implementation of the game rules, which returns the new cells.
+    """
+    neighbors = ul + um + ur + ml + mr + ll + lm + lr       # Count neighbors
+
+    c1 = (neighbors == SURVIVE_LOW)                         # Life conditions
+    c2 = (neighbors == SPAWN)
+
+    return cells * c1 + c2                                  # Update
+
+def step(state, update_func, rows_per_tile=None):
+    """
+    Play one round using `update_func`, `rows_per_tile` rows at a time when set (see `util.tiled_stencil()`).
+    """
+    def tile(start, stop):
+        views = neighborhood(state, start, stop)
+        new_cells = update_func(*views)
+
+        def write():
+            views[0][:] = new_cells                         # save result for next iteration
+        return write
+
+    height = state.shape[0] - 2
+    util.tiled_stencil(tile, height, rows_per_tile or height)
+
+def play(state, iterations, version=1, visualize=False, rows_per_tile=None):
 
     if version == 1:                # Select the update function
         update_func = update
@@ -65,14 +87,14 @@ def play(state, iterations, version=1, visualize=False):
     for i in range(iterations):    # Run the game
         if visualize:
             util.plot_surface(state, "3d", 16, 1, 0)
-        update_func()
-        util.Benchmark().flush()
+        step(state, update_func, rows_per_tile)
+        util.flush()
 
     return state
 
 def main():
 
-    B = util.Benchmark()
+    B = util.Benchmark(util.add_tiling_arguments)
     (H, W, I, V) = B.size
 
     if V not in [1, 2]:
@@ -88,8 +110,22 @@ def main():
     else:
         S = world(H, W, B)
 
+    # Each iteration updates H*W cells using 15 (version 1) or 11 (version 2) operations, reads the state once,
+    # and writes the cells once
+    B.work(flops=(15 if V == 1 else 11) * H * W * I, nbytes=2 * H * W * I * np.dtype(B.dtype).itemsize,
+           elements=H * W * I)
+    rows_per_tile = None
+    if B.args.tiled:
+        # The cells, their neighbors, and about five temporaries of each tile should stay in the cache
+        rows_per_tile = B.args.tile_rows or util.tile_rows((W + 2) * np.dtype(B.dtype).itemsize, 12)
+        trial = S.copy()
+        update_func = update if V == 1 else update_optimized
+        gain = util.bandwidth_gain(lambda: step(trial, update_func), lambda: step(trial, update_func, rows_per_tile))
+        B.metric("tile_rows", rows_per_tile)
+        B.metric("tiled_bandwidth_gain", round(gain, 3))
+
     B.start()
-    R = play(S, I, V, B.visualize)
+    R = play(S, I, V, B.visualize, rows_per_tile)
     B.stop()
 
     B.pprint()
@@ -16,10 +16,11 @@ def main():
     if B.dumpinput:
         B.dump_arrays("gauss", {'input':S})
 
+    B.work(flops=2 * N**3 // 3, nbytes=2 * N * N * S.itemsize, elements=N * N)
     B.start()
     R = la.gauss(S)
 
-    if util.Benchmark().bohrium:
+    if B.bohrium:
         R.copy2numpy()
 
     B.stop()
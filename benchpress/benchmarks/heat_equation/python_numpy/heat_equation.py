@@ -1,6 +1,9 @@
 from __future__ import print_function
 from benchpress import util
+import os
+import threading
 import numpy as np
+import multiprocessing
 
 
 def init_grid(height, width, dtype=np.float32):
@@ -12,16 +15,40 @@ def init_grid(height, width, dtype=np.float32):
     return grid
 
 
-def jacobi(B, grid, epsilon=0.005, max_iterations=None, visualize=False):
+def update(grid, start, stop):
+    """Return the rows `start:stop` of the interior of `grid` and their new values"""
+    center = grid[start + 1:stop + 1, 1:-1]
+    north = grid[start:stop, 1:-1]
+    east = grid[start + 1:stop + 1, 2:]
+    west = grid[start + 1:stop + 1, 0:-2]
+    south = grid[start + 2:stop + 2, 1:-1]
+    return (center, 0.2 * (center + north + east + west + south))
+
+
+def jacobi_step(grid, rows_per_tile=None):
+    """Execute one iteration on `grid` and return the delta
+
+    When `rows_per_tile` is set, the grid is updated `rows_per_tile` rows at a time (see `util.tiled_stencil()`),
+    which computes the same grid but sums the delta tile by tile.
+    """
+    height = grid.shape[0] - 2
+    deltas = []
+
+    def tile(start, stop):
+        (center, work) = update(grid, start, stop)
+        deltas.append(np.sum(np.absolute(work - center)))
+
+        def write():
+            center[:] = work
+        return write
+
+    util.tiled_stencil(tile, height, rows_per_tile or height)
+    return sum(deltas)
+
+
+def jacobi(B, grid, epsilon=0.005, max_iterations=None, rows_per_tile=None, visualize=False):
     def loop_body(grid):
-        center = grid[1:-1, 1:-1]
-        north = grid[0:-2, 1:-1]
-        east = grid[1:-1, 2:]
-        west = grid[1:-1, 0:-2]
-        south = grid[2:, 1:-1]
-        work = 0.2 * (center + north + east + west + south)
-        delta = np.sum(np.absolute(work - center))
-        center[:] = work
+        delta = jacobi_step(grid, rows_per_tile)
 
         if visualize:
             util.plot_surface(grid, "2d", 0, 200, -200)
@@ -31,8 +58,199 @@ def jacobi(B, grid, epsilon=0.005, max_iterations=None, visualize=False):
     return grid
 
 
+def jacobi_inplace(B, grid, epsilon=0.005, max_iterations=None, delta_interval=1, visualize=False):
+    """Allocation-free variant of `jacobi()` that computes the same grid
+
+    The iterations alternate between two preallocated buffers (ping-pong) using `out=` ufunc calls thus no
+    grid-sized array is allocated within the loop. The delta is only computed every `delta_interval` iterations,
+    which might run up to `delta_interval - 1` iterations more than `jacobi()`.
+
+    NB: the loop body swaps the buffers in Python, which `bohrium.do_while()` doesn't repeat, thus Bohrium
+    requires `--no-do_while`.
+    """
+    if B.bohrium and not B.args.no_do_while:
+        raise Exception("--inplace requires --no-do_while with Bohrium.")
+    grids = [grid, grid.copy()]  # The boundary of both buffers stays fixed
+    diff = np.empty_like(grid[1:-1, 1:-1])
+    iteration = [0]
+
+    def loop_body():
+        (src, dst) = grids
+        work = dst[1:-1, 1:-1]
+        np.add(src[1:-1, 1:-1], src[0:-2, 1:-1], out=work)  # center + north
+        np.add(work, src[1:-1, 2:], out=work)  # + east
+        np.add(work, src[1:-1, 0:-2], out=work)  # + west
+        np.add(work, src[2:, 1:-1], out=work)  # + south
+        np.multiply(work, 0.2, out=work)
+        grids.reverse()
+        iteration[0] += 1
+
+        if visualize:
+            util.plot_surface(dst, "2d", 0, 200, -200)
+        if iteration[0] % delta_interval != 0:
+            return True
+        np.subtract(work, src[1:-1, 1:-1], out=diff)
+        np.absolute(diff, out=diff)
+        return np.sum(diff) > epsilon
+
+    B.do_while(loop_body, max_iterations)
+    return grids[0]
+
+
+# The number of seconds `jacobi_parallel()` waits for the worker processes to start and to exit
+WORKER_TIMEOUT = 60
+
+
+def strip_layout(shape, dtype, nstrips):
+    """Return the interior rows `(start, stop)` and the byte offset of each of the `nstrips` row strips of a grid
+    of `shape`, and the total size of the strips. Each strip has a halo row above and below its interior rows."""
+    height = shape[0] - 2
+    bounds = [height * i // nstrips for i in range(nstrips + 1)]
+    ret = []
+    offset = 0
+    for (start, stop) in zip(bounds[:-1], bounds[1:]):
+        ret.append((start, stop, offset))
+        offset += (stop - start + 2) * shape[1] * np.dtype(dtype).itemsize
+    return (ret, offset)
+
+
+def strip_views(buf, shape, dtype, layout):
+    """Return the strips of `layout` (see `strip_layout()`) in the shared buffer `buf`, the delta of each strip,
+    and the iteration count, which follow the strips"""
+    (strips, size) = layout
+    views = [np.ndarray((stop - start + 2, shape[1]), dtype=dtype, buffer=buf, offset=offset)
+             for (start, stop, offset) in strips]
+    deltas = np.ndarray((len(strips),), dtype=np.float64, buffer=buf, offset=size)
+    iterations = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=size + deltas.nbytes)
+    return (views, deltas, iterations)
+
+
+def strip_worker(rank, shm_name, shape, dtype, layout, epsilon, max_iterations, rows_per_tile, step_barrier,
+                 run_barrier, done):
+    """Execute the Jacobi iterations of strip number `rank`, see `jacobi_parallel()`"""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        (strips, deltas, iterations) = strip_views(shm.buf, shape, dtype, layout)
+        strip = strips[rank]
+        above = strips[rank - 1] if rank > 0 else None
+        below = strips[rank + 1] if rank + 1 < len(strips) else None
+        run_barrier.wait()  # Ready
+        run_barrier.wait()  # Go
+        i = 0
+        while max_iterations is None or i < max_iterations:
+            deltas[rank] = jacobi_step(strip, rows_per_tile)
+            step_barrier.wait()  # All strips are updated thus the halo rows of the neighbors are free to write
+            if above is not None:
+                above[-1] = strip[1]
+            if below is not None:
+                below[0] = strip[-2]
+            delta = deltas.sum()
+            step_barrier.wait()  # All halo rows are exchanged and all deltas are read
+            if not delta > epsilon:
+                break
+            i += 1
+        if rank == 0:
+            iterations[0] = i
+        del strips, strip, above, below, deltas, iterations  # Release the buffer before closing it
+        done.release()
+    except threading.BrokenBarrierError:  # Another process, or jacobi_parallel(), failed
+        pass
+    except BaseException:
+        step_barrier.abort()
+        run_barrier.abort()
+        raise
+    finally:
+        shm.close()
+
+
+def jacobi_parallel(B, grid, nprocs, epsilon=0.005, max_iterations=None, rows_per_tile=None):
+    """Parallel variant of `jacobi()` that executes the iterations using `nprocs` processes
+
+    The grid is split into row strips in shared memory, one for each process. After each iteration, the processes
+    copy their first and last rows to the halo rows of the neighboring strips and add up the deltas of the strips,
+    synchronized by barriers. The grid is the same as the grid of `jacobi()`, but the delta is summed strip by
+    strip. The iterations are timed by `B.start()` and `B.stop()`, which excludes the start-up of the processes.
+
+    When a process fails, the barriers are aborted thus the other processes exit, and an exception is raised.
+
+    Returns the grid and the number of iterations.
+    """
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        raise Exception("--processes requires Python 3.8 or newer.")
+    shape = grid.shape
+    if nprocs > shape[0] - 2:
+        raise Exception("--processes cannot exceed the height of the grid.")
+    layout = strip_layout(shape, grid.dtype, nprocs)
+    step_barrier = multiprocessing.Barrier(nprocs)
+    run_barrier = multiprocessing.Barrier(nprocs + 1)
+    done = multiprocessing.Semaphore(0)
+    shm = shared_memory.SharedMemory(create=True, size=layout[1] + nprocs * 8 + 8)
+    procs = []
+    try:
+        (strips, deltas, iterations) = strip_views(shm.buf, shape, grid.dtype, layout)
+        for strip, (start, stop, _) in zip(strips, layout[0]):
+            strip[...] = grid[start:stop + 2]
+        for rank in range(nprocs):
+            procs.append(multiprocessing.Process(target=strip_worker, args=(
+                rank, shm.name, shape, grid.dtype, layout, epsilon, max_iterations, rows_per_tile,
+                step_barrier, run_barrier, done)))
+            procs[-1].start()
+        run_barrier.wait(WORKER_TIMEOUT)  # The processes are ready
+        B.start()
+        run_barrier.wait(WORKER_TIMEOUT)
+        # The run has no time limit thus the processes are checked while waiting for them to finish
+        for _ in procs:
+            while not done.acquire(timeout=1.0):
+                failed = [proc.exitcode for proc in procs if proc.exitcode not in (None, 0)]
+                if len(failed) > 0:
+                    raise Exception("a worker process of --processes failed with exit code %d." % failed[0])
+        B.stop()
+        for strip, (start, stop, _) in zip(strips, layout[0]):
+            grid[start + 1:stop + 1] = strip[1:-1]
+        ret = int(iterations[0])
+    except BaseException:
+        step_barrier.abort()
+        run_barrier.abort()
+        raise
+    finally:
+        strips = deltas = iterations = strip = None  # Release the buffer before closing it
+        for proc in procs:
+            proc.join(WORKER_TIMEOUT)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        shm.close()
+        shm.unlink()
+    return (grid, ret)
+
+
+def add_arguments(group):
+    util.add_tiling_arguments(group)
+    util.output_neutral(group.add_argument('--inplace',
+                                           action='store_true',
+                                           help="Use the allocation-free Jacobi loop, which alternates between two "
+                                                "preallocated grids."
+                                           ))
+    group.add_argument('--delta-interval',
+                       default=1,
+                       type=int,
+                       metavar='K',
+                       help="With --inplace, compute the delta (and check convergence) every K iterations."
+                       )
+    util.output_neutral(group.add_argument('--processes',
+                                           default=None,
+                                           type=int,
+                                           metavar='N',
+                                           help="Split the grid into N row strips in shared memory and update them "
+                                                "using N processes (0 means one process per CPU)."
+                                           ))
+
+
 def main():
-    B = util.Benchmark()
+    B = util.Benchmark(add_arguments)
     H = B.size[0]
     W = B.size[1]
     I = B.size[2]
@@ -43,9 +261,40 @@ def main():
     else:
         grid = init_grid(H, W, dtype=B.dtype)
 
-    B.start()
-    grid = jacobi(B, grid, max_iterations=I, visualize=B.visualize)
-    B.stop()
+    if B.args.delta_interval < 1:
+        raise Exception("--delta-interval must be at least 1.")
+    K = B.args.delta_interval if B.args.inplace else 1
+    rows_per_tile = None
+    if B.args.tiled:
+        if B.args.inplace:
+            raise Exception("--inplace and --tiled cannot be combined.")
+        # The center, its four neighbours, and about three temporaries of each tile should stay in the cache
+        rows_per_tile = B.args.tile_rows or util.tile_rows((W + 2) * np.dtype(B.dtype).itemsize, 8)
+        trial = grid.copy()
+        gain = util.bandwidth_gain(lambda: jacobi_step(trial), lambda: jacobi_step(trial, rows_per_tile))
+        B.metric("tile_rows", rows_per_tile)
+        B.metric("tiled_bandwidth_gain", round(gain, 3))
+    # Each iteration updates H*W points using 5 FLOPs plus 3 FLOPs for the delta (every K iterations) and reads
+    # the grid and writes the points once
+    B.work(flops=5 * H * W + 3 * H * W // K, nbytes=2 * H * W * np.dtype(B.dtype).itemsize, elements=H * W,
+           per_iteration=True)
+    if B.args.processes is not None:
+        if B.args.inplace:
+            raise Exception("--inplace and --processes cannot be combined.")
+        nprocs = B.args.processes
+        if nprocs == 0:  # The CPUs this process may use, e.g. the CPUs that `bp-run --jobs` pinned it to
+            nprocs = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else multiprocessing.cpu_count()
+        B.metric("processes", nprocs)
+        # NB: jacobi_parallel() calls B.start() and B.stop() itself
+        (grid, iterations) = jacobi_parallel(B, grid, nprocs, max_iterations=I, rows_per_tile=rows_per_tile)
+        B.set_iterations(iterations)
+    else:
+        B.start()
+        if B.args.inplace:
+            grid = jacobi_inplace(B, grid, max_iterations=I, delta_interval=K, visualize=B.visualize)
+        else:
+            grid = jacobi(B, grid, max_iterations=I, rows_per_tile=rows_per_tile, visualize=B.visualize)
+        B.stop()
     B.save_data({'grid': grid})
     B.pprint()
     if B.verbose:
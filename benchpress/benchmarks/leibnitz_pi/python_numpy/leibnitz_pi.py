@@ -13,6 +13,7 @@ def main():
         N,I = B.size                            # Grab command-line arguments
     except ValueError:
         N,I = (B.size[0], 1)
+    B.work(flops=8 * N * I, nbytes=8 * N * I, elements=N * I)  # 8 FLOPs per int64 term
     B.start()                                   # Sample wall-clock start
     R = 0.0
     for _ in range(I):
@@ -15,9 +15,10 @@ def main():
     if B.dumpinput:
         B.dump_arrays("lu", {'input': a})
 
+    B.work(flops=2 * N**3 // 3, nbytes=3 * N * N * np.dtype(B.dtype).itemsize, elements=N * N)
     B.start()
     (l, u) = la.lu(a)
-    if util.Benchmark().bohrium:
+    if B.bohrium:
         l.copy2numpy()
         u.copy2numpy()
     B.stop()
@@ -69,6 +69,11 @@ def main():
         Rx, Ry, Rz = calcB(window(B_x0))
         B.flush()
     B.stop()
+    # Each iteration sums the n*n modes of the 3 field components at the n*n*n points using 6 FLOPs per mode and
+    # point plus about 15 FLOPs per mode and y,z point for the terms. It reads the input and writes the components
+    n = B_x0.shape[0]
+    B.work(flops=(6 * n**5 + 15 * n**4) * B.size[2], nbytes=(n * n + 3 * n**3) * B.size[2] * B_x0.itemsize,
+           elements=n**5 * B.size[2])
     B.pprint()
 
     if B.outputfn:
@@ -21,13 +21,16 @@ def solve(samples, iterations, B):
     acc=0.0
     for _ in range(iterations):
         acc += montecarlo_pi(samples, B)
-	util.Benchmark().flush()
+        util.flush()
     acc /= iterations
     return acc
 
 def main():
     B = util.Benchmark()
     samples, iterations = B.size
+    # Each sample uses 6 FLOPs and writes and reads a random x and y
+    B.work(flops=6 * samples * iterations, nbytes=4 * samples * iterations * np.dtype(B.dtype).itemsize,
+           elements=samples * iterations)
     B.start()
     R = solve(samples, iterations, B)
     B.stop()
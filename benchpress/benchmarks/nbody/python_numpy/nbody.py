@@ -11,7 +11,7 @@ All the work is done in the calc_force, move and random_galaxy functions.
 To vectorize the code these are the functions to transform.
 """
 from benchpress import util
-if util.Benchmark().bohrium:
+if util.is_bohrium():
     import bohrium as np
 else:
     import numpy as np
@@ -110,47 +110,67 @@ def random_galaxy(N, B, dtype=np.float64):
         galaxy['z'] /= 1e5
     return galaxy
 
-def move(galaxy, dt):
-    """Move the bodies
-    first find forces and change velocity and then move positions
+def accelerations(galaxy, start, stop):
+    """Return the accelerations that the bodies `start:stop` give every body component wise
+    as three (stop-start) x N arrays
     """
-    n  = len(galaxy['x'])
-    # Calculate all dictances component wise (with sign)
-    dx = galaxy['x'][np.newaxis,:].T - galaxy['x']
-    dy = galaxy['y'][np.newaxis,:].T - galaxy['y']
-    dz = galaxy['z'][np.newaxis,:].T - galaxy['z']
+    # Calculate the distances component wise (with sign)
+    dx = galaxy['x'][start:stop, np.newaxis] - galaxy['x']
+    dy = galaxy['y'][start:stop, np.newaxis] - galaxy['y']
+    dz = galaxy['z'][start:stop, np.newaxis] - galaxy['z']
 
-    # Euclidian distances (all bodys)
+    # Euclidian distances, the distance of a body to it self is on the diagonal that starts at column `start`
     r = np.sqrt(dx**2 + dy**2 + dz**2)
-    diagonal(r)[:] = 1.0
+    diagonal(r, start)[:] = 1.0
 
     # prevent collition
     mask = r < 1.0
     r = r * ~mask + 1.0 * mask
 
-    m = galaxy['m'][np.newaxis,:].T
+    m = galaxy['m'][start:stop, np.newaxis]
 
     # Calculate the acceleration component wise
-    Fx = G*m*dx/r**3
-    Fy = G*m*dy/r**3
-    Fz = G*m*dz/r**3
+    r3 = r**3
+    Fx = G*m*dx/r3
+    Fy = G*m*dy/r3
+    Fz = G*m*dz/r3
     # Set the force (acceleration) a body exerts on it self to zero
-    diagonal(Fx)[:] = 0.0
-    diagonal(Fy)[:] = 0.0
-    diagonal(Fz)[:] = 0.0
+    diagonal(Fx, start)[:] = 0.0
+    diagonal(Fy, start)[:] = 0.0
+    diagonal(Fz, start)[:] = 0.0
+    return (Fx, Fy, Fz)
+
+def move(galaxy, dt, rows_per_tile=None):
+    """Move the bodies
+    first find forces and change velocity and then move positions
 
-    galaxy['vx'] += dt*np.sum(Fx, axis=0)
-    galaxy['vy'] += dt*np.sum(Fy, axis=0)
-    galaxy['vz'] += dt*np.sum(Fz, axis=0)
+    The forces are calculated `rows_per_tile` bodies at a time (default: all of them) thus the N x N
+    arrays of the forces are never allocated. The sums of the forces of the previous bodies are added
+    to the first row of each tile, which sums the rows in the same order as a single tile.
+    """
+    n  = len(galaxy['x'])
+    if rows_per_tile is None:
+        rows_per_tile = n
+    sums = None
+    for start in range(0, n, rows_per_tile):
+        forces = accelerations(galaxy, start, min(start + rows_per_tile, n))
+        if sums is not None:
+            for F, F_sum in zip(forces, sums):
+                F[0] += F_sum
+        sums = [np.sum(F, axis=0) for F in forces]
+
+    galaxy['vx'] += dt*sums[0]
+    galaxy['vy'] += dt*sums[1]
+    galaxy['vz'] += dt*sums[2]
 
     galaxy['x'] += dt*galaxy['vx']
     galaxy['y'] += dt*galaxy['vy']
     galaxy['z'] += dt*galaxy['vz']
 
-def simulate(galaxy, timesteps, visualize=False):
+def simulate(galaxy, timesteps, visualize=False, rows_per_tile=None):
     for i in range(timesteps):
-        move(galaxy,dt)
-        util.Benchmark().flush()
+        move(galaxy, dt, rows_per_tile)
+        util.flush()
         if visualize:#NB: this is only for experiments
             T = np.zeros((3, len(galaxy['x'])), dtype=np.float32)
             T[0,:] = galaxy['x']
@@ -159,21 +179,28 @@ def simulate(galaxy, timesteps, visualize=False):
             np.visualize(T, "3d", 0, 0.0, 10)
 
 def main():
-    B = util.Benchmark()
+    B = util.Benchmark(util.add_tiling_arguments)
     N = B.size[0]
     I = B.size[1]
 
     if B.inputfn:
         galaxy = B.load_arrays(B.inputfn)
     else:
-        galaxy = random_galaxy(N, B, B.dtype)
-        util.Benchmark().flush()
+        galaxy = B.cached_input("galaxy", lambda: random_galaxy(N, B, B.dtype))
+        util.flush()
 
     if B.dumpinput:
         B.dump_arrays("nbody", galaxy)
 
+    # Each timestep computes N*N interactions using 28 FLOPs each and reads and writes the N bodies once
+    B.work(flops=28 * N * N * I, nbytes=13 * N * I * np.dtype(B.dtype).itemsize, elements=N * N * I)
+    rows_per_tile = None
+    if B.args.tiled:
+        # The distances, the forces, and about four temporaries of each tile should stay in the cache
+        rows_per_tile = B.args.tile_rows or util.tile_rows(N * np.dtype(B.dtype).itemsize, 10)
+        B.metric("tile_rows", rows_per_tile)
     B.start()
-    simulate(galaxy, I, visualize=B.visualize)
+    simulate(galaxy, I, visualize=B.visualize, rows_per_tile=rows_per_tile)
     R = galaxy['x'] + galaxy['y'] + galaxy['z']
     B.stop()
 
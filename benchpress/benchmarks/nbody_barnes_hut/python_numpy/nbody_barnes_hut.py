@@ -0,0 +1,265 @@
+from __future__ import print_function
+"""
+NBody in N*log(N) complexity using the Barnes-Hut approximation
+
+The bodies and physics are those of the nbody benchmark, but the force on a body from a group of bodies that is
+far away is approximated by the force from their total mass at their center of mass.
+
+Each timestep builds an octree stored in flat arrays:
+
+* The bodies are sorted by the Morton code of their position, which makes the bodies of every octree node
+  a contiguous range of the sorted bodies.
+* The nodes are found level by level from the common prefixes of the codes and their masses and centers of
+  mass are computed with `np.add.reduceat()` over the ranges of the nodes.
+
+The tree is then traversed for a chunk of bodies at a time using a frontier of (body, node) pairs: a node that
+is far enough away (its size divided by its distance is less than the opening angle) or is a leaf gives the
+body its force, any other node is replaced by its children.
+
+The size is N*timesteps*theta where theta is the opening angle in hundredths, e.g. 50 is 0.5. A theta of 0
+opens every node and computes the forces exactly like the direct sum, but slower.
+"""
+import os
+import sys
+from benchpress import util
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "nbody", "python_numpy"))
+from nbody import G, dt, random_galaxy
+
+# The number of bits of each coordinate in the Morton codes, which is the maximum depth of the octree
+MORTON_BITS = 21
+
+# The number of bodies that traverse the octree at once, which bounds the size of the frontier
+BODIES_PER_CHUNK = 4096
+
+
+def _spread_bits(q):
+    """Return the `MORTON_BITS` low bits of the uint64 array `q` spread out to every third bit"""
+    q = q & np.uint64(0x1fffff)
+    for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                        (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+        q = (q | (q << np.uint64(shift))) & np.uint64(mask)
+    return q
+
+
+def morton_codes(x, y, z):
+    """Return the Morton codes of the positions and the corner and side length of their bounding cube"""
+    corner = np.array([x.min(), y.min(), z.min()], dtype=np.float64)
+    side = max(x.max() - corner[0], y.max() - corner[1], z.max() - corner[2], 1.0) * (1 + 1e-9)
+    scale = (1 << MORTON_BITS) / side
+    ret = np.zeros(len(x), dtype=np.uint64)
+    for axis, pos in enumerate((x, y, z)):
+        q = np.minimum((pos - corner[axis]) * scale, (1 << MORTON_BITS) - 1).astype(np.uint64)
+        ret |= _spread_bits(q) << np.uint64(2 - axis)
+    return (ret, corner, side)
+
+
+def build_octree(codes, side, x, y, z, m):
+    """Build the octree of the bodies, which must be sorted by their Morton `codes`, in a cube of length `side`
+
+    Returns a dict of arrays indexed by node, the root is node 0 and the nodes of each level follow the nodes
+    of the previous level:
+
+    * 'start', 'stop': the range of the bodies of the node
+    * 'first_child', 'children': the range of the children of the node, leaves have no children
+    * 'size': the side length of the node
+    * 'm', 'x', 'y', 'z': the total mass and the center of mass of the bodies of the node
+
+    A node with one body is a leaf. Bodies with the same code at the maximum depth share a leaf.
+    """
+    n = len(codes)
+    weighted = (m, m * x, m * y, m * z)
+    levels = [(np.zeros(1, dtype=np.int64), np.array([n], dtype=np.int64)) +
+              tuple(np.sum(w, keepdims=True) for w in weighted)]
+    for level in range(1, MORTON_BITS + 1):
+        (parent_start, parent_stop) = levels[-1][:2]
+        split = (parent_stop - parent_start) > 1
+        if not split.any():
+            break
+        keys = codes >> np.uint64(3 * (MORTON_BITS - level))
+        start = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))).astype(np.int64)
+        stop = np.append(start[1:], n)
+        # The nodes of a level partition the bodies thus `reduceat()` sums the bodies of each node
+        sums = tuple(np.add.reduceat(w, start) for w in weighted)
+        # Only the nodes within a node of the previous level that has more than one body are part of the tree
+        parent = np.maximum(np.searchsorted(parent_start, start, side='right') - 1, 0)
+        keep = split[parent] & (parent_start[parent] <= start) & (start < parent_stop[parent])
+        levels.append((start[keep], stop[keep]) + tuple(w[keep] for w in sums))
+
+    ret = dict((key, np.concatenate([lvl[i] for lvl in levels])) for i, key in enumerate(('start', 'stop', 'm')))
+    ret['size'] = np.concatenate([np.full(len(lvl[0]), side / 2.0 ** i) for i, lvl in enumerate(levels)])
+    ret['first_child'] = np.zeros(len(ret['start']), dtype=np.int64)
+    ret['children'] = np.zeros(len(ret['start']), dtype=np.int64)
+    offset = 0
+    for (start, child_start) in zip([lvl[0] for lvl in levels[:-1]], [lvl[0] for lvl in levels[1:]]):
+        parent = np.searchsorted(start, child_start, side='right') - 1
+        children = np.bincount(parent, minlength=len(start))
+        first = np.searchsorted(parent, np.arange(len(start)))
+        ret['children'][offset:offset + len(start)] = children
+        ret['first_child'][offset:offset + len(start)] = offset + len(start) + first
+        offset += len(start)
+
+    for i, key in enumerate(('x', 'y', 'z')):
+        ret[key] = np.concatenate([lvl[3 + i] for lvl in levels]) / ret['m']
+    return ret
+
+
+def tree_accelerations(tree, x, y, z, theta):
+    """Return the accelerations of the bodies, which must be sorted like the bodies of `tree`, and the number
+    of body-node interactions
+    """
+    n = len(x)
+    ret = [np.zeros(n, dtype=x.dtype) for _ in range(3)]
+    interactions = 0
+    for chunk in range(0, n, BODIES_PER_CHUNK):
+        count = min(BODIES_PER_CHUNK, n - chunk)
+        body = np.arange(chunk, chunk + count)
+        node = np.zeros(count, dtype=np.int64)
+        while len(body) > 0:
+            dx = tree['x'][node] - x[body]
+            dy = tree['y'][node] - y[body]
+            dz = tree['z'][node] - z[body]
+            r = np.sqrt(dx**2 + dy**2 + dz**2)
+            leaf = tree['children'][node] == 0
+            # A node that contains the body is never approximated thus a body never attracts it self
+            inside = (tree['start'][node] <= body) & (body < tree['stop'][node])
+            accept = ~inside & (leaf | (tree['size'][node] < theta * r))
+            interactions += int(np.count_nonzero(accept))
+
+            # Like the nbody benchmark, prevent collitions by limiting the distance to at least one meter
+            r = np.maximum(r[accept], 1.0)
+            a = G * tree['m'][node[accept]] / r**3
+            target = body[accept] - chunk
+            for acc, d in zip(ret, (dx, dy, dz)):
+                acc[chunk:chunk + count] += np.bincount(target, weights=a * d[accept], minlength=count)
+
+            # Replace each node that is too close by its children
+            opened = ~accept & ~leaf
+            first = tree['first_child'][node[opened]]
+            children = tree['children'][node[opened]]
+            body = np.repeat(body[opened], children)
+            offsets = np.arange(len(body)) - np.repeat(np.cumsum(children) - children, children)
+            node = np.repeat(first, children) + offsets
+    return (ret, interactions)
+
+
+def accelerations(galaxy, theta):
+    """Return the accelerations of the bodies using an octree, the order of the bodies in the octree, and
+    the number of body-node interactions. The accelerations are in the order of the octree.
+    """
+    (codes, _, side) = morton_codes(galaxy['x'], galaxy['y'], galaxy['z'])
+    order = np.argsort(codes, kind='stable')
+    (x, y, z, m) = (galaxy[key][order] for key in ('x', 'y', 'z', 'm'))
+    tree = build_octree(codes[order], side, x, y, z, m)
+    (sorted_acc, interactions) = tree_accelerations(tree, x, y, z, theta)
+    return (sorted_acc, order, interactions)
+
+
+def move(galaxy, dt, theta):
+    """Move the bodies
+    first find forces using the octree and change velocity and then move positions
+
+    Returns the number of body-node interactions.
+    """
+    (sorted_acc, order, interactions) = accelerations(galaxy, theta)
+    for key, acc in zip(('vx', 'vy', 'vz'), sorted_acc):
+        galaxy[key][order] += dt*acc
+
+    galaxy['x'] += dt*galaxy['vx']
+    galaxy['y'] += dt*galaxy['vy']
+    galaxy['z'] += dt*galaxy['vz']
+    return interactions
+
+
+def direct_accelerations(galaxy, bodies, rows_per_tile=256):
+    """Return the accelerations of `bodies` (indices) using the direct sum of the nbody benchmark"""
+    ret = [np.empty(len(bodies), dtype=galaxy['x'].dtype) for _ in range(3)]
+    for start in range(0, len(bodies), rows_per_tile):
+        rows = bodies[start:start + rows_per_tile]
+        dx = galaxy['x'] - galaxy['x'][rows, np.newaxis]
+        dy = galaxy['y'] - galaxy['y'][rows, np.newaxis]
+        dz = galaxy['z'] - galaxy['z'][rows, np.newaxis]
+        # The distance of a body to it self is zero thus it exerts no force on it self
+        r = np.maximum(np.sqrt(dx**2 + dy**2 + dz**2), 1.0)
+        a = G * galaxy['m'] / r**3
+        for acc, d in zip(ret, (dx, dy, dz)):
+            acc[start:start + len(rows)] = np.sum(a * d, axis=1)
+    return ret
+
+
+def force_error(galaxy, theta, nbodies, seed=42):
+    """Return the relative RMS and maximum error of the forces of the octree compared to the direct sum
+    of `nbodies` random bodies (all bodies when `nbodies` is at least N)
+    """
+    n = len(galaxy['x'])
+    if nbodies < n:
+        bodies = np.sort(np.random.RandomState(seed).choice(n, nbodies, replace=False))
+    else:
+        bodies = np.arange(n)
+    (sorted_acc, order, _) = accelerations(galaxy, theta)
+    inverse = np.empty(n, dtype=np.int64)
+    inverse[order] = np.arange(n)
+    approx = np.array([acc[inverse[bodies]] for acc in sorted_acc], dtype=np.float64)
+    exact = np.array(direct_accelerations(galaxy, bodies), dtype=np.float64)
+    diff = np.sqrt(np.sum((approx - exact) ** 2, axis=0))
+    norm = np.sqrt(np.sum(exact ** 2, axis=0))
+    rms = np.sqrt(np.sum(diff ** 2) / max(np.sum(norm ** 2), np.finfo(np.float64).tiny))
+    worst = np.max(diff / np.maximum(norm, np.finfo(np.float64).tiny)) if len(bodies) > 0 else 0.0
+    return (float(rms), float(worst))
+
+
+def simulate(galaxy, timesteps, theta):
+    """Returns the total number of body-node interactions"""
+    ret = 0
+    for i in range(timesteps):
+        ret += move(galaxy, dt, theta)
+    return ret
+
+
+def add_arguments(group):
+    util.output_neutral(group.add_argument('--error-bodies',
+                                           default=1000,
+                                           type=int,
+                                           metavar='N',
+                                           help="Compare the forces on N random bodies to the direct sum after the "
+                                                "simulation and report the relative error as the 'force_error_rms' "
+                                                "and 'force_error_max' metrics (0 disables)."
+                                           ))
+
+
+def main():
+    B = util.Benchmark(add_arguments)
+    N = B.size[0]
+    I = B.size[1]
+    theta = B.size[2] / 100.0
+
+    if B.inputfn:
+        galaxy = B.load_arrays(B.inputfn)
+    else:
+        galaxy = B.cached_input("galaxy", lambda: random_galaxy(N, B, B.dtype))
+
+    if B.dumpinput:
+        B.dump_arrays("nbody_barnes_hut", galaxy)
+
+    B.start()
+    interactions = simulate(galaxy, I, theta)
+    R = galaxy['x'] + galaxy['y'] + galaxy['z']
+    B.stop()
+
+    # Each interaction uses about 20 FLOPs and each timestep reads and writes the N bodies a few times
+    B.work(flops=20 * interactions, nbytes=13 * N * I * np.dtype(B.dtype).itemsize, elements=interactions)
+    B.metric("theta", theta)
+    B.metric("interactions_per_body", round(interactions / float(max(N * I, 1)), 1))
+    if B.args.error_bodies > 0:
+        (rms, worst) = force_error(galaxy, theta, B.args.error_bodies)
+        B.metric("force_error_rms", rms)
+        B.metric("force_error_max", worst)
+
+    B.pprint()
+    if B.outputfn:
+        B.tofile(B.outputfn, {'res': R})
+
+
+if __name__ == "__main__":
+    main()
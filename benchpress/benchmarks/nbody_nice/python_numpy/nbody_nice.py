@@ -20,59 +20,69 @@ except ImportError:
 
 from nbody_nice_visualization import gfx_init, gfx_show
 
-def fill_diagonal(a, val):
-    d,_ = a.shape   # This only makes sense for square matrices
-    a.shape=d*d     # Flatten a without making a copy
-    a[::d+1]=val    # Assign the diagonal values
-    a.shape = (d,d) # Return a to its original shape
-
-def calc_force(a, b, dt):
+def fill_diagonal(a, val, offset=0):
+    """Assign `val` to the diagonal of `a` that starts at column `offset`, i.e. ``a[i, i+offset]``"""
+    rows,d = a.shape
+    count = min(rows, d - offset)
+    a.shape=rows*d  # Flatten a without making a copy
+    a[offset:offset+count*(d+1):d+1]=val    # Assign the diagonal values
+    a.shape = (rows,d) # Return a to its original shape
+
+def calc_force(a, b, dt, rows_per_tile=None):
     """
     Calculate forces between bodies
     F = ((G m_a m_b)/r^2)/((x_b-x_a)/r)
+
+    The forces on the bodies of `a` are calculated `rows_per_tile` bodies at a time (default: all of them)
+    thus the len(a) x len(b) arrays of the forces are never allocated.
     """
     # Ignore division by zero since we fix it explicitely by setting the diagonal in the forces arrays
     npf.seterr(divide='ignore',invalid='ignore')
 
     G = 6.673e-11
 
-    dx = b['x'] - a['x'][:,None]
-    dy = b['y'] - a['y'][:,None]
-    dz = b['z'] - a['z'][:,None]
-    pm = b['m'] * a['m'][:,None]
-
-    #
-    # For some reason then this pow(T, 0.5) is deadly to performance...
-    # sqrt(T) is equivalent math, trying it out instead.
-    #
-    # This might actually be a neat optimization:
-    # pow(T, 0.K) => k-root(T)
-    #
-    #r = ( dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-    r = np.sqrt( dx ** 2 + dy ** 2 + dz ** 2)
-
-    Fx = G * pm / r ** 2 * (dx / r)
-    Fy = G * pm / r ** 2 * (dy / r)
-    Fz = G * pm / r ** 2 * (dz / r)
-
-    # The diagonal nan numbers must be removed so that the force from a body
-    # upon itself is zero
-    if a is b:
-        fill_diagonal(Fx,0.)
-        fill_diagonal(Fy,0.)
-        fill_diagonal(Fz,0.)
-
-    a['vx'] += np.add.reduce(Fx, axis=1)/ a['m'] * dt
-    a['vy'] += np.add.reduce(Fy, axis=1)/ a['m'] * dt
-    a['vz'] += np.add.reduce(Fz, axis=1)/ a['m'] * dt
-
-def move(solarsystem, asteroids, dt):
+    n = len(a['x'])
+    if rows_per_tile is None:
+        rows_per_tile = n
+    for start in range(0, n, rows_per_tile):
+        stop = min(start + rows_per_tile, n)
+        dx = b['x'] - a['x'][start:stop,None]
+        dy = b['y'] - a['y'][start:stop,None]
+        dz = b['z'] - a['z'][start:stop,None]
+        pm = b['m'] * a['m'][start:stop,None]
+
+        #
+        # For some reason then this pow(T, 0.5) is deadly to performance...
+        # sqrt(T) is equivalent math, trying it out instead.
+        #
+        # This might actually be a neat optimization:
+        # pow(T, 0.K) => k-root(T)
+        #
+        #r = ( dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
+        r = np.sqrt( dx ** 2 + dy ** 2 + dz ** 2)
+
+        Fx = G * pm / r ** 2 * (dx / r)
+        Fy = G * pm / r ** 2 * (dy / r)
+        Fz = G * pm / r ** 2 * (dz / r)
+
+        # The diagonal nan numbers must be removed so that the force from a body
+        # upon itself is zero
+        if a is b:
+            fill_diagonal(Fx,0.,start)
+            fill_diagonal(Fy,0.,start)
+            fill_diagonal(Fz,0.,start)
+
+        a['vx'][start:stop] += np.add.reduce(Fx, axis=1)/ a['m'][start:stop] * dt
+        a['vy'][start:stop] += np.add.reduce(Fy, axis=1)/ a['m'][start:stop] * dt
+        a['vz'][start:stop] += np.add.reduce(Fz, axis=1)/ a['m'][start:stop] * dt
+
+def move(solarsystem, asteroids, dt, rows_per_tile=None):
     """
     Move the bodies
     first find forces and change velocity and then move positions
     """
-    calc_force(solarsystem, solarsystem, dt)
-    calc_force(asteroids, solarsystem, dt)
+    calc_force(solarsystem, solarsystem, dt, rows_per_tile)
+    calc_force(asteroids, solarsystem, dt, rows_per_tile)
     solarsystem['x'] += solarsystem['vx'] * dt
     solarsystem['y'] += solarsystem['vy'] * dt
     solarsystem['z'] += solarsystem['vz'] * dt
@@ -154,7 +164,7 @@ def random_system(x_max, y_max, z_max, n, b, dtype=npf.float):
     return ss, a
 
 def main():
-    B = util.Benchmark()                            # Initialize Benchpress
+    B = util.Benchmark(util.add_tiling_arguments)   # Initialize Benchpress
     nplanets, nbodies, timesteps = B.size           # Grab arguments
 
     x_max = 1e18                                    # Simulation constants
@@ -174,12 +184,22 @@ def main():
     if B.visualize:                                     # Init visuals
         plt, P3 = gfx_init(x_max, y_max, z_max)
 
+    # Each timestep computes (nplanets + nbodies) * nplanets interactions using 28 FLOPs each and reads and writes
+    # the bodies once
+    interactions = (nplanets + nbodies) * nplanets * timesteps
+    B.work(flops=28 * interactions, nbytes=13 * (nplanets + nbodies) * timesteps * np.dtype(B.dtype).itemsize,
+           elements=interactions)
+    rows_per_tile = None
+    if B.args.tiled:
+        # The distances, the forces, and about four temporaries of each tile should stay in the cache
+        rows_per_tile = B.args.tile_rows or util.tile_rows(nplanets * np.dtype(B.dtype).itemsize, 10)
+        B.metric("tile_rows", rows_per_tile)
     B.start()                                           # Timer start
     for timestep in range(0, timesteps):               # Run simulation
         if B.visualize and timestep % 10 == 0:          # With or without..
             gfx_show(plt, P3, solarsystem, asteroids)   # ..visuals
-        move(solarsystem, asteroids, dt)
-        util.Benchmark().flush()
+        move(solarsystem, asteroids, dt, rows_per_tile)
+        util.flush()
     B.stop()                                            # Timer stop
 
     B.pprint()                                          # Print results..
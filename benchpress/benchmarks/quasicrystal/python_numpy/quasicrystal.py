@@ -30,9 +30,13 @@ def main():
 
     for phase in phases:
         image[:] = np.sum(cinner * np.cos(phase) - sinner * np.sin(phase), axis=0) + k
-        util.Benchmark().flush()
+        util.flush()
 
     B.stop()
+    # Each phase combines the k waves of the N*N pixels using 4 FLOPs per wave and pixel and reads the two k*N*N
+    # wave arrays and writes the image once
+    B.work(flops=4 * k * N * N * len(phases), nbytes=(2 * k + 1) * N * N * len(phases) * image.itemsize,
+           elements=k * N * N * len(phases))
     B.pprint()
 
     if B.outputfn:
@@ -23,11 +23,12 @@ def main():
     if B.dumpinput:
         B.dump_arrays("rosenbrock", {'input': dataset})
 
+    B.work(flops=8 * N * T, nbytes=N * T * np.dtype(B.dtype).itemsize, elements=N * T)  # 8 FLOPs per element
     B.start()                                   # Sample wall-clock start
     res = 0.0
     for _ in range(0, T):                      # Do T trials of..
         res += rosen(dataset)                   # ..executing rosenbrock.
-        util.Benchmark().flush()
+        util.flush()
     res /= T
     B.stop()                                    # Sample wall-clock stop
     B.pprint()                                  # Print elapsed wall-clock etc.
@@ -41,67 +41,95 @@ def model(height, width, dtype=np.float32):
     return {"H": m, "U": np.zeros_like(m), "V": np.zeros_like(m)}
 
 
-def simulate(B, state, timesteps, visualize=False):
+def boundary(H, U, V):
+    """Apply the reflecting boundary conditions"""
+    H[:, 0] = H[:, 1];
+    U[:, 0] = U[:, 1];
+    V[:, 0] = -V[:, 1]
+    H[:, -1] = H[:, -2];
+    U[:, -1] = U[:, -2];
+    V[:, -1] = -V[:, -2]
+    H[0, :] = H[1, :];
+    U[0, :] = -U[1, :];
+    V[0, :] = V[1, :]
+    H[-1, :] = H[-2, :];
+    U[-1, :] = -U[-2, :];
+    V[-1, :] = V[-2, :]
+
+
+def update(H, U, V, dt=0.02, dx=1.0, dy=1.0):
+    """Return the decrements of the interior `[1:-1, 1:-1]` of H, U, and V after a time step"""
+
+    # First half step
+
+    # height
+    Hx = (H[1:, 1:-1] + H[:-1, 1:-1]) / 2 - dt / (2 * dx) * (U[1:, 1:-1] - U[:-1, 1:-1])
+
+    # x momentum
+    Ux = (U[1:, 1:-1] + U[:-1, 1:-1]) / 2 - \
+         dt / (2 * dx) * ((U[1:, 1:-1] ** 2 / H[1:, 1:-1] + g / 2 * H[1:, 1:-1] ** 2) -
+                          (U[:-1, 1:-1] ** 2 / H[:-1, 1:-1] + g / 2 * H[:-1, 1:-1] ** 2))
+
+    # y momentum
+    Vx = (V[1:, 1:-1] + V[:-1, 1:-1]) / 2 - \
+         dt / (2 * dx) * ((U[1:, 1:-1] * V[1:, 1:-1] / H[1:, 1:-1]) -
+                          (U[:-1, 1:-1] * V[:-1, 1:-1] / H[:-1, 1:-1]))
+
+    # height
+    Hy = (H[1:-1, 1:] + H[1:-1, :-1]) / 2 - dt / (2 * dy) * (V[1:-1, 1:] - V[1:-1, :-1])
+
+    # x momentum
+    Uy = (U[1:-1, 1:] + U[1:-1, :-1]) / 2 - \
+         dt / (2 * dy) * ((V[1:-1, 1:] * U[1:-1, 1:] / H[1:-1, 1:]) -
+                          (V[1:-1, :-1] * U[1:-1, :-1] / H[1:-1, :-1]))
+    # y momentum
+    Vy = (V[1:-1, 1:] + V[1:-1, :-1]) / 2 - \
+         dt / (2 * dy) * ((V[1:-1, 1:] ** 2 / H[1:-1, 1:] + g / 2 * H[1:-1, 1:] ** 2) -
+                          (V[1:-1, :-1] ** 2 / H[1:-1, :-1] + g / 2 * H[1:-1, :-1] ** 2))
+
+    # Second half step
+
+    # height
+    dH = (dt / dx) * (Ux[1:, :] - Ux[:-1, :]) + (dt / dy) * (Vy[:, 1:] - Vy[:, :-1])
+
+    # x momentum
+    dU = (dt / dx) * ((Ux[1:, :] ** 2 / Hx[1:, :] + g / 2 * Hx[1:, :] ** 2) -
+                      (Ux[:-1, :] ** 2 / Hx[:-1, :] + g / 2 * Hx[:-1, :] ** 2)) + \
+         (dt / dy) * ((Vy[:, 1:] * Uy[:, 1:] / Hy[:, 1:]) -
+                      (Vy[:, :-1] * Uy[:, :-1] / Hy[:, :-1]))
+    # y momentum
+    dV = (dt / dx) * ((Ux[1:, :] * Vx[1:, :] / Hx[1:, :]) -
+                      (Ux[:-1, :] * Vx[:-1, :] / Hx[:-1, :])) + \
+         (dt / dy) * ((Vy[:, 1:] ** 2 / Hy[:, 1:] + g / 2 * Hy[:, 1:] ** 2) -
+                      (Vy[:, :-1] ** 2 / Hy[:, :-1] + g / 2 * Hy[:, :-1] ** 2))
+    return (dH, dU, dV)
+
+
+def step(H, U, V, rows_per_tile=None):
+    """Execute one time step, `rows_per_tile` rows at a time when set (see `util.tiled_stencil()`)"""
+    boundary(H, U, V)
+
+    def tile(start, stop):
+        # The interior rows `start:stop` are the rows `start+1:stop+1`, which depend on the rows `start:stop+2`
+        rows = slice(start, stop + 2)
+        (dH, dU, dV) = update(H[rows], U[rows], V[rows])
+
+        def write():
+            H[start + 1:stop + 1, 1:-1] -= dH
+            U[start + 1:stop + 1, 1:-1] -= dU
+            V[start + 1:stop + 1, 1:-1] -= dV
+        return write
+
+    height = H.shape[0] - 2
+    util.tiled_stencil(tile, height, rows_per_tile or height)
+
+
+def simulate(B, state, timesteps, rows_per_tile=None, visualize=False):
 
     # FLOP count: i*(12*s + 4*s**2 + 14*s**2 + 9*s**2 + 4*s**2 + 9*s**2 + 14*s**2 + 6*s**2 + 19*s**2 + 19*s**2)
-    # where s is size and i is iterations
-    def loop_body(H, U, V, dt=0.02, dx=1.0, dy=1.0):
-        # Reflecting boundary conditions
-        H[:, 0] = H[:, 1];
-        U[:, 0] = U[:, 1];
-        V[:, 0] = -V[:, 1]
-        H[:, -1] = H[:, -2];
-        U[:, -1] = U[:, -2];
-        V[:, -1] = -V[:, -2]
-        H[0, :] = H[1, :];
-        U[0, :] = -U[1, :];
-        V[0, :] = V[1, :]
-        H[-1, :] = H[-2, :];
-        U[-1, :] = -U[-2, :];
-        V[-1, :] = V[-2, :]
-
-        # First half step
-
-        # height
-        Hx = (H[1:, 1:-1] + H[:-1, 1:-1]) / 2 - dt / (2 * dx) * (U[1:, 1:-1] - U[:-1, 1:-1])
-
-        # x momentum
-        Ux = (U[1:, 1:-1] + U[:-1, 1:-1]) / 2 - \
-             dt / (2 * dx) * ((U[1:, 1:-1] ** 2 / H[1:, 1:-1] + g / 2 * H[1:, 1:-1] ** 2) -
-                              (U[:-1, 1:-1] ** 2 / H[:-1, 1:-1] + g / 2 * H[:-1, 1:-1] ** 2))
-
-        # y momentum
-        Vx = (V[1:, 1:-1] + V[:-1, 1:-1]) / 2 - \
-             dt / (2 * dx) * ((U[1:, 1:-1] * V[1:, 1:-1] / H[1:, 1:-1]) -
-                              (U[:-1, 1:-1] * V[:-1, 1:-1] / H[:-1, 1:-1]))
-
-        # height
-        Hy = (H[1:-1, 1:] + H[1:-1, :-1]) / 2 - dt / (2 * dy) * (V[1:-1, 1:] - V[1:-1, :-1])
-
-        # x momentum
-        Uy = (U[1:-1, 1:] + U[1:-1, :-1]) / 2 - \
-             dt / (2 * dy) * ((V[1:-1, 1:] * U[1:-1, 1:] / H[1:-1, 1:]) -
-                              (V[1:-1, :-1] * U[1:-1, :-1] / H[1:-1, :-1]))
-        # y momentum
-        Vy = (V[1:-1, 1:] + V[1:-1, :-1]) / 2 - \
-             dt / (2 * dy) * ((V[1:-1, 1:] ** 2 / H[1:-1, 1:] + g / 2 * H[1:-1, 1:] ** 2) -
-                              (V[1:-1, :-1] ** 2 / H[1:-1, :-1] + g / 2 * H[1:-1, :-1] ** 2))
-
-        # Second half step
-
-        # height
-        H[1:-1, 1:-1] -= (dt / dx) * (Ux[1:, :] - Ux[:-1, :]) + (dt / dy) * (Vy[:, 1:] - Vy[:, :-1])
-
-        # x momentum
-        U[1:-1, 1:-1] -= (dt / dx) * ((Ux[1:, :] ** 2 / Hx[1:, :] + g / 2 * Hx[1:, :] ** 2) -
-                                      (Ux[:-1, :] ** 2 / Hx[:-1, :] + g / 2 * Hx[:-1, :] ** 2)) + \
-                         (dt / dy) * ((Vy[:, 1:] * Uy[:, 1:] / Hy[:, 1:]) -
-                                      (Vy[:, :-1] * Uy[:, :-1] / Hy[:, :-1]))
-        # y momentum
-        V[1:-1, 1:-1] -= (dt / dx) * ((Ux[1:, :] * Vx[1:, :] / Hx[1:, :]) -
-                                      (Ux[:-1, :] * Vx[:-1, :] / Hx[:-1, :])) + \
-                         (dt / dy) * ((Vy[:, 1:] ** 2 / Hy[:, 1:] + g / 2 * Hy[:, 1:] ** 2) -
-                                      (Vy[:, :-1] ** 2 / Hy[:, :-1] + g / 2 * Hy[:, :-1] ** 2))
+    # where s is size and i is iterations, see `main()`
+    def loop_body(H, U, V):
+        step(H, U, V, rows_per_tile)
         if visualize:
             util.plot_surface(H, "3d", 0, 0, 5.5)
 
@@ -109,17 +137,30 @@ def simulate(B, state, timesteps, visualize=False):
 
 
 def main():
-    B = util.Benchmark()
+    B = util.Benchmark(util.add_tiling_arguments)
     H = B.size[0]
     W = B.size[1]
     I = B.size[2]
 
     state = B.load_data()
     if state is None:
-        state = model(H, W, dtype=B.dtype)
+        state = B.cached_input("model", lambda: model(H, W, dtype=B.dtype))
+
+    # Each iteration reads and writes H, U, and V once, see the FLOP count of `simulate()`
+    B.work(flops=12 * W + 98 * H * W, nbytes=6 * H * W * np.dtype(B.dtype).itemsize, elements=H * W,
+           per_iteration=True)
+    rows_per_tile = None
+    if B.args.tiled:
+        # H, U, V, the six half-step arrays, and about seven temporaries of each tile should stay in the cache
+        rows_per_tile = B.args.tile_rows or util.tile_rows(W * np.dtype(B.dtype).itemsize, 16)
+        trial = {key: ary.copy() for key, ary in state.items()}
+        gain = util.bandwidth_gain(lambda: step(trial['H'], trial['U'], trial['V']),
+                                   lambda: step(trial['H'], trial['U'], trial['V'], rows_per_tile))
+        B.metric("tile_rows", rows_per_tile)
+        B.metric("tiled_bandwidth_gain", round(gain, 3))
 
     B.start()
-    simulate(B, state, I, visualize=B.visualize)
+    simulate(B, state, I, rows_per_tile, visualize=B.visualize)
     B.stop()
     B.save_data(state)
     B.pprint()
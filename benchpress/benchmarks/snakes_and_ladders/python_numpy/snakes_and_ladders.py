@@ -60,7 +60,7 @@ def main():
         p = arrays['p']
     else:
         a = np.array(np.zeros(size+1, dtype=B.dtype))
-        p = np.array(nullgame(size,   dtype=B.dtype))
+        p = np.array(B.cached_input("nullgame", lambda: nullgame(size, dtype=B.dtype)))
 
     if B.dumpinput:
         B.dump_arrays("snakes_and_ladders", {"a": a, "p": p})
@@ -68,6 +68,9 @@ def main():
     m = p   # Initial matrix is p
     pr_end = np.array(np.zeros(iterations, dtype=B.dtype))
 
+    # Each iteration multiplies two (size+1)*(size+1) matrices
+    B.work(flops=2 * (size + 1)**3 * iterations, nbytes=3 * (size + 1)**2 * iterations * p.itemsize,
+           elements=(size + 1)**2 * iterations)
     B.start()
     for k in range(iterations):
         if B.visualize:
@@ -81,7 +84,7 @@ def main():
         # Store/plot the accumulated marginal probability at the k-th iteration
         a = a + m[0]
 
-        util.Benchmark().flush()
+        util.flush()
 
         if B.visualize:
             pyplot.figure(2)
@@ -42,7 +42,7 @@ def wireworld(world, iterations):
         sim += np.array(MASK * 4, np.uint8) # conductors->4
         sim *= 2                            # Upgrade all to new state
 
-        util.Benchmark().flush()
+        util.flush()
 
     return sim
 
@@ -56,7 +56,7 @@ def main():
     if B.inputfn:
         world = B.load_array()
     else:
-        world = wireworld_init(N)
+        world = B.cached_input("world", lambda: wireworld_init(N))
 
     if B.dumpinput:
         B.dump_arrays("wireworld", {"input": world})
@@ -64,6 +64,9 @@ def main():
     B.start()
     R = wireworld(world, I)
     B.stop()
+    # Each iteration updates the cells inside the border using integer operations only, reading and writing them once
+    cells = (world.shape[0] - 2) * (world.shape[1] - 2)
+    B.work(nbytes=2 * cells * I * world.itemsize, elements=cells * I)
     B.pprint()
 
     if B.outputfn:
@@ -19,6 +19,12 @@ from heat_imr import heatcap
 
 B = util.Benchmark()
 
+# Time each phase of the simulation
+dens = B.region("dens")(dens)
+heatcap = B.region("heatcap")(heatcap)
+temp = B.region("temp")(temp)
+salt = B.region("salt")(salt)
+
 length = 1 #size of the grid unit m
 width = 1 #size of the grid unit m
 
@@ -111,5 +117,8 @@ for i in range(steps): #Forward euler
     I_export = 14.22
 
 B.stop()
+# Each step updates the N_L*N_W grid columns, reading and writing the temperature, density, mass, salinity, and
+# heat capacity of the 4 layers and the ice volume, height, and cover of each column once
+B.work(nbytes=2 * (5 * 4 + 3) * N_L * N_W * steps * T.itemsize, elements=N_L * N_W * steps)
 B.pprint()
 
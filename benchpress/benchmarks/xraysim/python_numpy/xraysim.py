@@ -65,7 +65,8 @@ def buildscene(
 
 
 
-def xraysim(sourcelist,
+def xraysim(B,
+            sourcelist,
             detectordeflist,
             scenegrid,
             scenematerials,
@@ -76,6 +77,8 @@ def xraysim(sourcelist,
             visualize=False):
     """ performs the calculations figuring out what is detected
         INPUT:
+        B:          the util.Benchmark that times the phases
+
         sourcelist: list of np.array([
                         px,py,pz,       position
                         relative_power, relative to other sources simulated
@@ -118,31 +121,35 @@ def xraysim(sourcelist,
 
         # preprocess the scene physics
         # building a map of attenuation coefficients
-        sceneattenuates =  np.zeros(scenematerials.shape)
+        with B.region("attenuation"):
+            sceneattenuates =  np.zeros(scenematerials.shape)
 
-        for material_id in materials.keys():
-            sceneattenuates += (scenematerials == material_id) \
-                    * materials[material_id].getMu(senergy)
+            for material_id in materials.keys():
+                sceneattenuates += (scenematerials == material_id) \
+                        * materials[material_id].getMu(senergy)
 
         ret = []
         for pixelpositions, pixelareavector, dshape, result in detectors:
             # do geometry
-            rayudirs, raylengths, rayinverse = raygeometry(rayorigin, pixelpositions)
-            raydst = runAABB(scenegrid, rayudirs, rayorigin, rayinverse)
-
-            #raydst is now to be correlated with material/attenuation grid
-            t = sceneattenuates[...,np.newaxis] * raydst
-            #We sums the three dimensions
-            t = np.sum(t, axis=(0, 1, 2))
-            dtectattenuates = t.reshape(detector_resolution, detector_resolution)
-            pixelintensity = ((Const.invsqr * source[power] * np.ones(raylengths.shape[0])[..., np.newaxis]) / raylengths).reshape(dshape)
-            area = np.dot( rayudirs, pixelareavector.reshape(3,1) ).reshape(dshape)
-            result += pixelintensity * area * np.exp(-dtectattenuates)
+            with B.region("ray geometry"):
+                rayudirs, raylengths, rayinverse = raygeometry(rayorigin, pixelpositions)
+            with B.region("runAABB"):
+                raydst = runAABB(scenegrid, rayudirs, rayorigin, rayinverse)
+
+            with B.region("attenuation"):
+                #raydst is now to be correlated with material/attenuation grid
+                t = sceneattenuates[...,np.newaxis] * raydst
+                #We sums the three dimensions
+                t = np.sum(t, axis=(0, 1, 2))
+                dtectattenuates = t.reshape(detector_resolution, detector_resolution)
+                pixelintensity = ((Const.invsqr * source[power] * np.ones(raylengths.shape[0])[..., np.newaxis]) / raylengths).reshape(dshape)
+                area = np.dot( rayudirs, pixelareavector.reshape(3,1) ).reshape(dshape)
+                result += pixelintensity * area * np.exp(-dtectattenuates)
             ret.append(result)
             if visualize:
                 low = np.minimum.reduce(result.flatten())
                 high = np.maximum.reduce(result.flatten())
-                if util.Benchmark().bohrium:
+                if B.bohrium:
                     low  = low.copy2numpy()
                     high = high.copy2numpy()
                 util.plot_surface(result, "2d", 0, low-0.001*low, high-0.5*high)
@@ -151,9 +158,10 @@ def xraysim(sourcelist,
     #We return only the result of the detectors
     return ret
 
-def setup(scene_res, detector_res):
+def setup(B, scene_res, detector_res):
     """Returns a scene to xray
 
+       B:            the util.Benchmark that caches the scene
        scene_res:    resolution of the scene cubic, e.g. 32 equals 32^3
        detector_res: resolution of the detectors squared, e.g. 22 equals 22^2
     """
@@ -163,8 +171,9 @@ def setup(scene_res, detector_res):
     # build a model of all materials
     materials = Material.initAll()
 
-    # build scene
-    scenegrid, scenematerials = buildscene(scenedefs, objectlist)
+    # build scene, which is slow thus cached
+    scene = B.cached_input("scene", lambda: dict(zip(("grid", "materials"), buildscene(scenedefs, objectlist))))
+    scenegrid, scenematerials = scene["grid"], scene["materials"]
 
     return (srclist, detectorlist, scenegrid, scenematerials, materials, scene_res, detector_res)
 
@@ -173,15 +182,23 @@ def main():
     scene_res = B.size[0]
     detector_res = B.size[1]
     iterations = B.size[2]
-    scene = setup(scene_res, detector_res)
+    with B.region("scene build"):
+        scene = setup(B, scene_res, detector_res)
 
     B.start()
     for _ in range(iterations):
-        detector_results = xraysim(*scene, visualize=B.visualize)
-        if util.Benchmark().bohrium:
+        detector_results = xraysim(B, *scene, visualize=B.visualize)
+        if B.bohrium:
             B.flush()
 
     B.stop()
+    # Each ray of each source and detector pair is intersected with every voxel using about 25 FLOPs (slab tests,
+    # min/max, and the distance) plus 2 FLOPs to attenuate it. Each pair reads the voxels and writes the detector
+    (sources, detectors, _, scenematerials) = scene[:4]
+    pairs = len(sources) * len(detectors) * iterations
+    rays = detector_res * detector_res
+    B.work(flops=27 * scenematerials.size * rays * pairs, nbytes=(scenematerials.size + rays) * pairs * 8,
+           elements=scenematerials.size * rays * pairs)
     B.pprint()
 
     if B.outputfn:
@@ -58,7 +58,7 @@ def create_suite(cmd_list, output_path=None):
     f.close()
 
 
-def command(cmd, label, env={}):
+def command(cmd, label, env={}, timeout=None):
     """Create a Benchpress command, which define a single benchmark execution
 
     This is a help function to create a Benchpress command, which is a Python `dict` of the parameters given.
@@ -71,12 +71,17 @@ def command(cmd, label, env={}):
         The human readable label of the command
     env : dict
         The Python dictionary of environment variables to define before execution'
+    timeout : float
+        Seconds before each run of the command is terminated, which overrules the `bp-run --timeout` argument.
         
     Returns
     -------
     command : dict
         The created Benchpress command        
     """
-    return {'cmd': cmd,
-            'label': label,
-            'env': env}
+    ret = {'cmd': cmd,
+           'label': label,
+           'env': env}
+    if timeout is not None:
+        ret['timeout'] = timeout
+    return ret
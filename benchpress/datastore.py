@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+A data store of NumPy arrays, which is a directory that contains one `.npy` file per array and a manifest.
+
+The arrays are loaded memory-mapped thus loading is near instant no matter the size of the arrays. For archival,
+the arrays can be stored compressed in chunks (`.npyz` files), which are decompressed directly into the loaded
+array one chunk at a time.
+
+The manifest (`manifest.json`) records the files, the dtype and shape of each array, and a content hash of all
+the arrays, which `save()` uses to skip rewriting a store that already contains identical arrays. Python scalars,
+such as the parameters of a benchmark state, are stored in the manifest as they are.
+
+`Cache` is a directory of stores keyed by a hash of what generated them, e.g. the benchmark inputs of a size.
+"""
+from __future__ import absolute_import
+import os
+import json
+import uuid
+import zlib
+import shutil
+import struct
+import hashlib
+import numpy as np
+
+# The name of the manifest file within a store
+MANIFEST = "manifest.json"
+
+# The version of the store format
+VERSION = 1
+
+# The number of uncompressed bytes in each compressed chunk
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# The Python types that are stored in the manifest
+_SCALAR_TYPES = (bool, int, float, str, type(None))
+try:
+    _SCALAR_TYPES += (long, unicode)  # Python 2
+except NameError:
+    pass
+
+
+def is_store(path):
+    """Return whether `path` is a data store"""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def _byte_chunks(ary, chunk_size=CHUNK_SIZE):
+    """Yield the bytes of `ary` in C order as uint8 arrays of about `chunk_size` bytes
+
+    The chunks of a C-contiguous array are views, other arrays are copied one chunk of rows at a time.
+    """
+    if ary.flags['C_CONTIGUOUS']:
+        flat = ary.reshape(-1).view(np.uint8)
+        for i in range(0, len(flat), chunk_size):
+            yield flat[i:i + chunk_size]
+    else:
+        rows = max(1, chunk_size // max(1, ary[0].nbytes))
+        for i in range(0, len(ary), rows):
+            yield np.ascontiguousarray(ary[i:i + rows]).reshape(-1).view(np.uint8)
+
+
+def prepare(arrays):
+    """Split `arrays` into a dict of NumPy arrays, a dict of Python scalars, and the set of keys that were
+    Bohrium arrays
+
+    Bohrium arrays are copied to NumPy once, which is the only copy made of any array.
+    """
+    ret = {}
+    scalars = {}
+    bhary_keys = set()
+    for key, value in arrays.items():
+        if isinstance(value, _SCALAR_TYPES):
+            scalars[key] = value
+            continue
+        if hasattr(value, "copy2numpy"):
+            value = value.copy2numpy()
+            bhary_keys.add(key)
+        value = np.asarray(value)
+        if value.dtype.hasobject:
+            raise TypeError("cannot store '%s', arrays of Python objects are not supported" % key)
+        ret[key] = value
+    return ret, scalars, bhary_keys
+
+
+def content_hash(arrays, scalars=None, bhary_keys=()):
+    """Return the SHA-256 hex digest of the keys, dtypes, shapes, and data of `arrays` and of `scalars`
+
+    Parameters
+    ----------
+    arrays : dict
+        Maps keys to NumPy arrays
+    scalars : dict
+        Maps keys to Python scalars
+    bhary_keys : set
+        The keys of the arrays that are loaded as Bohrium arrays
+
+    Returns
+    -------
+    digest : str
+        The content hash
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(scalars or {}, sort_keys=True).encode('utf-8'))
+    for key in sorted(arrays):
+        ary = arrays[key]
+        h.update(json.dumps([key, ary.dtype.str, list(ary.shape), key in bhary_keys]).encode('utf-8'))
+        for chunk in _byte_chunks(ary):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_manifest(path):
+    """Return the manifest of the data store `path`"""
+    with open(os.path.join(path, MANIFEST), "r") as f:
+        manifest = json.load(f)
+    if manifest.get('version', 0) > VERSION:
+        raise ValueError("the data store '%s' has a newer format (version %s)" % (path, manifest['version']))
+    return manifest
+
+
+def bohrium_keys(path):
+    """Return the keys of the arrays of the data store `path` that were Bohrium arrays"""
+    return [key for key, info in read_manifest(path)['arrays'].items() if info['bohrium']]
+
+
+def _write_npy(filename, ary, compress=False, chunk_size=CHUNK_SIZE):
+    """Write `ary` as a `.npy` file one chunk at a time
+
+    When `compress` is True, each chunk is zlib compressed and prefixed with its compressed length.
+    """
+    header = {'descr': np.lib.format.dtype_to_descr(ary.dtype), 'fortran_order': False, 'shape': ary.shape}
+    with open(filename, "wb") as f:
+        np.lib.format.write_array_header_1_0(f, header)
+        for chunk in _byte_chunks(ary, chunk_size):
+            if compress:
+                data = zlib.compress(chunk.tobytes())
+                f.write(struct.pack("<Q", len(data)))
+                f.write(data)
+            else:
+                chunk.tofile(f)
+
+
+def _read_compressed(filename):
+    """Read an array written by `_write_npy(compress=True)`"""
+    with open(filename, "rb") as f:
+        np.lib.format.read_magic(f)
+        (shape, fortran_order, dtype) = np.lib.format.read_array_header_1_0(f)
+        ret = np.empty(shape, dtype=dtype)
+        flat = ret.reshape(-1).view(np.uint8)
+        offset = 0
+        while offset < len(flat):
+            (length,) = struct.unpack("<Q", f.read(8))
+            data = zlib.decompress(f.read(length))
+            flat[offset:offset + len(data)] = np.frombuffer(data, dtype=np.uint8)
+            offset += len(data)
+    return ret
+
+
+def save(path, arrays, compress=False, chunk_size=CHUNK_SIZE, bhary_keys=()):
+    """Save `arrays` as the data store `path`
+
+    The store is written to a temporary directory, which then replaces `path`. When `path` already is a store
+    with identical content and compression, nothing is written. Any other existing file or directory at `path`
+    is left untouched and raises a ValueError.
+
+    Parameters
+    ----------
+    path : str
+        The directory of the data store
+    arrays : dict
+        Maps keys to arrays (NumPy or Bohrium), NumPy scalars, or Python scalars
+    compress : bool
+        Compress the arrays in chunks of `chunk_size` bytes, which cannot be memory-mapped when loaded
+    chunk_size : int
+        The number of uncompressed bytes in each compressed chunk
+    bhary_keys : iterable
+        The keys of NumPy arrays to load as Bohrium arrays, e.g. arrays that `prepare()` copied from Bohrium
+
+    Returns
+    -------
+    digest : str
+        The content hash of `arrays`
+    """
+    (arrays, scalars, bohrium) = prepare(arrays)
+    bhary_keys = bohrium.union(bhary_keys)
+    digest = content_hash(arrays, scalars, bhary_keys)
+    if is_store(path):
+        try:
+            manifest = read_manifest(path)
+            if manifest.get('hash') == digest and manifest.get('compressed') == compress:
+                return digest
+        except ValueError:  # A corrupted or newer store, which we overwrite
+            pass
+    elif os.path.lexists(path):
+        raise ValueError("cannot save to '%s', it exists and is not a data store" % path)
+
+    tmp_path = "%s.tmp-%s" % (path.rstrip(os.sep), uuid.uuid4())
+    os.makedirs(tmp_path)
+    try:
+        manifest = {'version': VERSION, 'hash': digest, 'compressed': compress, 'arrays': {}, 'scalars': scalars}
+        for i, key in enumerate(sorted(arrays)):
+            ary = arrays[key]
+            # NB: the keys might not be valid file names thus the files are numbered
+            filename = "%d.npyz" % i if compress else "%d.npy" % i
+            _write_npy(os.path.join(tmp_path, filename), ary, compress, chunk_size)
+            manifest['arrays'][key] = {
+                'file': filename,
+                'dtype': ary.dtype.str,
+                'shape': list(ary.shape),
+                'compressed': compress,
+                'bohrium': key in bhary_keys,
+            }
+        with open(os.path.join(tmp_path, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        if is_store(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return digest
+
+
+def load(path, mmap_mode='c'):
+    """Load the arrays of the data store `path`
+
+    Parameters
+    ----------
+    path : str
+        The directory of the data store
+    mmap_mode : str
+        The memory-map mode of uncompressed arrays (see `numpy.load()`) or None to read them into memory.
+        The default, 'c', is copy-on-write: the arrays are writable but changes never reach the store.
+
+    Returns
+    -------
+    arrays : dict
+        Maps keys to NumPy arrays and Python scalars
+    """
+    manifest = read_manifest(path)
+    ret = dict(manifest.get('scalars', {}))
+    for key, info in manifest['arrays'].items():
+        filename = os.path.join(path, info['file'])
+        if info['compressed']:
+            ret[key] = _read_compressed(filename)
+        elif mmap_mode is None or int(np.prod(info['shape'])) == 0:  # Empty files cannot be memory-mapped
+            ret[key] = np.load(filename, allow_pickle=False)
+        else:
+            # A plain ndarray view of the memory-map, which e.g. arithmetic doesn't turn into `np.memmap` objects
+            ret[key] = np.load(filename, mmap_mode=mmap_mode, allow_pickle=False).view(np.ndarray)
+    return ret
+
+
+def _store_size(path):
+    """Return the number of bytes in the files of the store `path`"""
+    ret = 0
+    for name in os.listdir(path):
+        try:
+            ret += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return ret
+
+
+class Cache(object):
+    """A directory of data stores, each named by the hash of a key, e.g. the generator and parameters of the arrays
+
+    When the stores take up more than `max_bytes`, the least recently used stores are evicted.
+
+    Parameters
+    ----------
+    directory : str
+        The cache directory, which is created when missing
+    max_bytes : int
+        The maximum total size of the stores
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # Created by a concurrent process
+                pass
+
+    def path(self, key):
+        """Return the store path of `key`, which is any JSON serializable object"""
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:40])
+
+    def get(self, key, mmap_mode='c'):
+        """Return the arrays of `key` (see `load()`) or None when `key` isn't cached"""
+        path = self.path(key)
+        if not is_store(path):
+            return None
+        try:
+            ret = load(path, mmap_mode)
+        except (IOError, OSError, ValueError):  # E.g. evicted by a concurrent process
+            return None
+        os.utime(path, None)  # The modification time of the store is its last use
+        return ret
+
+    def put(self, key, arrays):
+        """Cache `arrays` as `key` (see `save()`) and evict the least recently used stores"""
+        try:
+            save(self.path(key), arrays)
+        except OSError:  # A concurrent process wrote the same key
+            pass
+        self.evict()
+
+    def evict(self):
+        """Evict the least recently used stores until the cache fits within `max_bytes`"""
+        stores = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if ".tmp-" in name or not is_store(path):
+                continue
+            try:
+                size = _store_size(path)
+                stores.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+            total += size
+        for (_, size, path) in sorted(stores):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
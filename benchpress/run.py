@@ -1,10 +1,38 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import os
+import re
+import sys
 import json
 import argparse
 import uuid
-from subprocess import Popen, PIPE, check_output
+import random
+import time
+import shlex
+import getpass
+import signal
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE, CalledProcessError, check_output
+from .visualizer import util as vutil
+from . import rusage
+from . import validation
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+try:
+    from shlex import quote
+except ImportError:  # Python 2
+    from pipes import quote
+try:
+    from shutil import which as find_executable
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable
+
+# The script that executes each run and records its resource usage
+RUSAGE_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "rusage.py")
 
 
 class C:
@@ -25,8 +53,136 @@ def write2json(json_file, obj):
     os.fsync(json_file)
 
 
-def bash_job(args, cmd, nruns):
-    """Creates a bash job based on the 'cmd' dict that runs the 'cmd['cmd']' 'nruns' times"""
+def journal_path(suite_path):
+    """Returns the path to the result journal that belongs to the suite file 'suite_path'"""
+    return "%s.journal" % suite_path
+
+
+class Journal:
+    """Append-only journal of job updates, one JSON record per line.
+
+    Appending a record costs the size of the job, where rewriting the suite file costs the size of the whole suite.
+    The journal is folded back into the suite file by `compact_suite()`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+
+    def append(self, cmd_idx, job_idx, job):
+        """Record the new state of job number 'job_idx' of command number 'cmd_idx'"""
+        record = {'cmd_idx': cmd_idx, 'job_idx': job_idx, 'job': job}
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def journal_fold(suite, path):
+    """Apply the job records in the journal file 'path' to 'suite' and return the number of records applied"""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # The record was only partially written when bp-run died
+                continue
+            jobs = suite['cmd_list'][record['cmd_idx']]['jobs']
+            if record['job_idx'] == len(jobs):  # A job added by `adaptive_schedule()`
+                jobs.append(record['job'])
+            else:
+                jobs[record['job_idx']] = record['job']
+            count += 1
+    return count
+
+
+def compact_suite(suite_file, suite):
+    """Write 'suite' into 'suite_file' and remove the now redundant journal"""
+    write2json(suite_file, suite)
+    try:
+        os.remove(journal_path(suite_file.name))
+    except OSError:
+        pass
+
+
+# The warm Python process that `--python-worker` uses to execute Python commands
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "worker.py")
+
+# The hardware events `--perf-counters` count by default, see `--perf-events`
+PERF_EVENTS = "cycles,instructions,cache-references,cache-misses,LLC-loads,LLC-load-misses,branches,branch-misses"
+
+
+def output_keep_regex(args):
+    """Returns the regex of the lines beyond 'args.max_output' to keep of the output of a run
+
+    Besides the '--keep-regex' (default: the '--parse-regex'), the records of `benchpress.util` are always kept.
+    """
+    keep_regex = args.keep_regex if args.keep_regex is not None else args.parse_regex
+    return "^%s|%s" % (vutil.RECORD_PREFIX, keep_regex) if keep_regex else "^%s" % vutil.RECORD_PREFIX
+
+
+def bash_run(args, cmd, outfile):
+    """Returns the bash line that executes one run of 'cmd'
+
+    The stdout, stderr, and resource usage of the run are written to 'outfile' with the extensions
+    '.out', '.err', and '.rusage'. When 'args.perf_counters' is set, the `perf stat` counters of 'args.perf_events'
+    are written to '.perf'.
+    NB: `rusage.py` captures the output through pipes and writes it, capped to 'args.max_output' bytes, when the
+    run has finished.
+    """
+    opts = "--stdout %s.out --stderr %s.err --max-output %d " % (outfile, outfile, args.max_output)
+    opts += "--keep-regex %s " % quote(output_keep_regex(args))
+    if args.perf_counters:
+        opts += "--perf-events %s --perf-output %s.perf " % (quote(args.perf_events), outfile)
+    return '%s %s %s%s.rusage %s\n' % (sys.executable, RUSAGE_SCRIPT, opts, outfile, quote(cmd['cmd']))
+
+
+def perf_event_name(event):
+    """Return the plain name of the `perf stat` event 'event' without a PMU and modifiers
+
+    E.g. 'cycles:u' and 'cpu_core/cycles/' (the core PMU of a hybrid CPU) are both 'cycles'.
+    """
+    match = re.match(r'^[^/]+/([^/]+)/[^/]*$', event)
+    if match is not None:
+        event = match.group(1)
+    return event.split(':')[0]
+
+
+def parse_perf_stat(csv_output):
+    """Parse the CSV output of `perf stat -x,` into a dict that maps event names to counts
+
+    The event names are normalized by `perf_event_name()` and the counts of an event on several PMUs, such as
+    the performance and efficiency cores of a hybrid CPU, are summed. Events that `perf stat` could not count
+    (e.g. '<not supported>') are left out.
+    """
+    ret = {}
+    for line in csv_output.splitlines():
+        if len(line.strip()) == 0 or line.startswith('#'):
+            continue
+        fields = line.split(',')
+        if len(fields) < 3:
+            continue
+        try:
+            value = float(fields[0])
+        except ValueError:
+            continue
+        name = perf_event_name(fields[2])
+        value = ret.get(name, 0) + value
+        ret[name] = int(value) if float(value).is_integer() else value
+    return ret
+
+
+def bash_job(args, cmd, nruns, array=False):
+    """Creates a bash job based on the 'cmd' dict that runs the 'cmd['cmd']' 'nruns' times
+
+    When 'array' is True, the job is a SLURM job array of 'nruns' tasks where each task executes one run
+    and writes its output to the files of run number '$SLURM_ARRAY_TASK_ID'. Outside of SLURM, the job
+    executes all of the runs.
+    """
 
     cwd = os.path.abspath(os.getcwd())
     basename = "bh-job-%s.sh" % uuid.uuid4()
@@ -36,8 +192,13 @@ def bash_job(args, cmd, nruns):
 
     # Write Slurm parameters
     bash += "\n#SBATCH -J '%s'\n" % cmd['label']
-    bash += "#SBATCH -o /tmp/bh-slurm-%%j.out\n"
-    bash += "#SBATCH -e /tmp/bh-slurm-%%j.err\n"
+    if array:
+        bash += "#SBATCH --array=0-%d\n" % (nruns - 1)
+        bash += "#SBATCH -o /tmp/bh-slurm-%A_%a.out\n"
+        bash += "#SBATCH -e /tmp/bh-slurm-%A_%a.err\n"
+    else:
+        bash += "#SBATCH -o /tmp/bh-slurm-%j.out\n"
+        bash += "#SBATCH -e /tmp/bh-slurm-%j.err\n"
     if args.partition is not None:
         bash += "#SBATCH -p %s\n" % args.partition
     bash += "#SBATCH --nice=%d\n" % args.nice
@@ -50,39 +211,153 @@ def bash_job(args, cmd, nruns):
 
     # Execute the warm up run
     if args.warmup:
-        bash += "# Warm up run\n%s\n" % cmd['cmd']
+        bash += "# Warm up run\n%s %s /dev/null %s\n" % (sys.executable, RUSAGE_SCRIPT, quote(cmd['cmd']))
         bash += 'sync\n\n'
 
-    # Execute command 'nruns' times
-    bash += "# The runs \n"
-    for i in range(nruns):
-        # Write the command to execute
-        bash += "%s " % cmd['cmd']
-
-        # Pipe the output to file
-        outfile = "%s-%d" % (filename, i)
-        bash += '> >(tee %s.out) 2> >(tee %s.err >&2)\n' % (outfile, outfile)
-
-        # Finally, we call sync
+    if array:
+        # Execute the run of this task, or all of the runs when not executed as a SLURM job array
+        bash += "# The runs \n"
+        bash += 'for i in ${SLURM_ARRAY_TASK_ID:-%s}; do\n' % " ".join(str(i) for i in range(nruns))
+        bash += bash_run(args, cmd, "%s-${i}" % filename)
         bash += 'sync\n'
+        bash += 'done\n'
+    else:
+        # Execute command 'nruns' times
+        bash += "# The runs \n"
+        for i in range(nruns):
+            # Write the command to execute, which writes the output to file
+            bash += bash_run(args, cmd, "%s-%d" % (filename, i))
 
-    return {'status': 'pending', 'filename': filename, 'nruns': nruns, 'script': bash, 'warmup': args.warmup}
+            # Finally, we call sync
+            bash += 'sync\n'
+
+    ret = {'status': 'pending', 'filename': filename, 'nruns': nruns, 'script': bash, 'warmup': args.warmup}
+    if array:
+        ret['array'] = True
+    return ret
 
 
 def create_jobs(args, cmd):
     """Create the list of bash jobs that will execute the 'cmd'"""
 
+    if args.array:
+        return [bash_job(args, cmd, args.nruns, array=True)]
+
     # Find the number of bash jobs and the number of runs with each bash job
     njobs = 1
     nruns_per_job = args.nruns
-    if args.multi_jobs:
+    if args.multi_jobs or args.order not in (None, 'sequential'):  # Interleaving requires a job per run
         njobs = args.nruns
         nruns_per_job = 1
     return [bash_job(args, cmd, nruns_per_job) for _ in range(njobs)]
 
 
-def job_execute_locally(job, verbose=False, dirty=False):
-    """Execute the job locally"""
+def available_cpus():
+    """Return the sorted list of CPU IDs this process is allowed to run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def cpu_slots(njobs):
+    """Split the available CPUs into (at most) 'njobs' disjoint slots of equal size"""
+    cpus = available_cpus()
+    if njobs > len(cpus):
+        print ("%sOnly %d CPUs available, running %d jobs at a time%s" % (C.WARN, len(cpus), len(cpus), C.END))
+        njobs = len(cpus)
+    size = len(cpus) // njobs
+    return [cpus[i * size:(i + 1) * size] for i in range(njobs)]
+
+
+def pinned_popen_args(popen_cmd, cpus, extra_env=None, new_group=False):
+    """Returns the `Popen` command and keyword arguments that pin 'popen_cmd' to the list of CPU IDs 'cpus'
+
+    'OMP_NUM_THREADS' defaults to the number of CPUs. The environment variables in the dict 'extra_env'
+    are defined last thus they overrule the default. When 'cpus' is None, no pinning is done.
+    When 'new_group' is True, the process becomes the leader of a new process group (see `LocalProcesses`).
+    """
+    env = dict(os.environ)
+    kwargs = {}
+    setup = []  # The functions the child calls before executing 'popen_cmd'
+    if new_group:
+        setup.append(rusage.new_process_group)
+    if cpus is not None:
+        env['OMP_NUM_THREADS'] = str(len(cpus))
+        if hasattr(os, 'sched_setaffinity'):
+            setup.append(lambda: os.sched_setaffinity(0, cpus))
+        else:
+            popen_cmd = ['taskset', '-c', ','.join(str(c) for c in cpus)] + popen_cmd
+    if len(setup) > 0:
+        kwargs['preexec_fn'] = lambda: [func() for func in setup]
+    if extra_env is not None:
+        env.update((key, str(value)) for key, value in extra_env.items())
+    if cpus is not None or extra_env is not None:
+        kwargs['env'] = env
+    return popen_cmd, kwargs
+
+
+def run_env(timeout=None, echo=False):
+    """Returns the environment variables that make the job scripts terminate runs after 'timeout' seconds
+    and, when 'echo' is True, pass the output of the runs through to the stdout and stderr of the job"""
+    ret = {rusage.ECHO_ENV: '1' if echo else '0'}
+    if timeout is not None:
+        ret[rusage.TIMEOUT_ENV] = repr(float(timeout))
+    return ret
+
+
+class LocalProcesses:
+    """The bash processes of the jobs that execute locally, which are killed on Ctrl-C
+
+    Each process is the leader of its own process group (see `pinned_popen_args()`), thus the runs that the job
+    executes can be killed with it.
+    """
+
+    def __init__(self):
+        self._procs = set()
+        self._killed = False
+        self._lock = threading.Lock()
+
+    def add(self, proc):
+        """Add 'proc', which is killed right away when `kill()` has been called already"""
+        with self._lock:
+            self._procs.add(proc)
+            killed = self._killed
+        if killed:  # A thread started 'proc' while the other processes were killed
+            self.kill()
+
+    def remove(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def kill(self):
+        """Kill the process groups of all processes, now and when they are added later
+
+        The groups get SIGINT first, which makes `rusage.py` kill the process group of a run that has a timeout,
+        and SIGKILL after a grace period of at most `rusage.KILL_GRACE` seconds.
+        """
+        with self._lock:
+            procs = list(self._procs)
+            self._procs.clear()
+            self._killed = True
+        for proc in procs:
+            rusage._kill(proc.pid, signal.SIGINT)
+        deadline = time.time() + rusage.KILL_GRACE
+        while time.time() < deadline and any(proc.poll() is None for proc in procs):
+            time.sleep(0.05)
+        for proc in procs:
+            rusage._kill(proc.pid, signal.SIGKILL)
+            proc.wait()
+
+
+def job_execute_locally(job, verbose=False, dirty=False, cpus=None, timeout=None, procs=None):
+    """Execute the job locally
+
+    When 'cpus' is a list of CPU IDs, the job is pinned to those CPUs and 'OMP_NUM_THREADS' defaults to their count.
+    When 'timeout' is set, each run is terminated after 'timeout' seconds.
+    When 'verbose' is True, the output of the runs is passed through to the console while they run.
+    The bash process of the job is added to the `LocalProcesses` 'procs' while it runs.
+    """
+    procs = LocalProcesses() if procs is None else procs
     try:
         with open(job['filename'], 'w') as f:
             # First we have to write the bash script to a file
@@ -91,24 +366,27 @@ def job_execute_locally(job, verbose=False, dirty=False):
             os.fsync(f)
             # Then we execute the bash script
             try:
-                p = Popen(['bash', f.name], stdout=PIPE)
-                if verbose:
-                    while p.poll() is None:
-                        print (p.stdout.readline())
-                    print (p.stdout.read())
-                p.wait()
+                # NB: the 'env' of the command is exported by the bash script thus it overrules the default
+                (popen_cmd, popen_kwargs) = pinned_popen_args(['bash', f.name], cpus, run_env(timeout, verbose),
+                                                              new_group=True)
+                with open(os.devnull, 'w') as devnull:
+                    p = Popen(popen_cmd, stdout=None if verbose else devnull, **popen_kwargs)
+                    procs.add(p)
+                    try:
+                        p.wait()
+                    finally:
+                        procs.remove(p)
             except KeyboardInterrupt:
-                p.kill()
+                procs.add(p)
+                procs.kill()
                 if not dirty:
                     for i in range(job['nruns']):
                         base = "%s-%d" % (job['filename'], i)
-                        stdout = "%s.out" % base
-                        stderr = "%s.err" % base
-                        try:
-                            os.remove(stdout)
-                            os.remove(stderr)
-                        except OSError:
-                            pass
+                        for ext in ('out', 'err', 'rusage', 'perf'):
+                            try:
+                                os.remove("%s.%s" % (base, ext))
+                            except OSError:
+                                pass
                 raise KeyboardInterrupt()
     finally:
         try:
@@ -118,8 +396,108 @@ def job_execute_locally(job, verbose=False, dirty=False):
             pass
 
 
-def job_execute_slurm(job, dirty=False, partition=None):
-    """Execute the job through SLURM"""
+def worker_argv(cmd):
+    """Returns the argv of the Python command 'cmd' as a list (interpreter first) or None
+
+    A Python command, such as 'python heat_equation.py --size=100*100*10', executes a Python script without
+    using any bash features. Only Python commands can be executed by a `PythonWorker`.
+    """
+    if any(c in cmd['cmd'] for c in '|&;<>()$`\\\n'):
+        return None
+    if any('$' in str(value) for value in cmd.get('env', {}).values()):
+        return None
+    try:
+        argv = shlex.split(cmd['cmd'])
+    except ValueError:
+        return None
+    if len(argv) < 2 or not os.path.basename(argv[0]).startswith('python') or not argv[1].endswith('.py'):
+        return None
+    return argv
+
+
+class PythonWorker:
+    """A warm Python process that executes the runs of Python commands (see `worker.py`)"""
+
+    def __init__(self, interpreter, cpus=None, cmd_env=None):
+        (popen_cmd, popen_kwargs) = pinned_popen_args([interpreter, WORKER_SCRIPT], cpus, cmd_env)
+        self._proc = Popen(popen_cmd, stdin=PIPE, stdout=PIPE, universal_newlines=True, **popen_kwargs)
+
+    def alive(self):
+        return self._proc.poll() is None
+
+    def execute(self, argv, outfile, timeout=None, max_output=rusage.MAX_OUTPUT, keep_regex=None):
+        """Execute the Python script 'argv[0]' and return its exit code or None when the worker died
+
+        The stdout, stderr, and resource usage of the run are written to 'outfile' with the extensions
+        '.out', '.err', and '.rusage'. Like in `bash_run()`, only 'max_output' bytes of each output plus the lines
+        that match 'keep_regex' are kept. When 'outfile' is None, the output is discarded.
+        When 'timeout' is set, the run is terminated after 'timeout' seconds.
+        """
+        try:
+            request = {'argv': argv, 'outfile': outfile, 'timeout': timeout, 'max_output': max_output,
+                       'keep_regex': keep_regex}
+            self._proc.stdin.write(json.dumps(request) + "\n")
+            self._proc.stdin.flush()
+            reply = self._proc.stdout.readline()
+        except IOError:
+            return None
+        if len(reply) == 0:
+            return None
+        return json.loads(reply)['exit_code']
+
+    def close(self):
+        try:
+            self._proc.stdin.close()
+        except IOError:
+            pass
+        self._proc.wait()
+
+
+class PythonWorkers:
+    """The set of warm Python workers, one for each interpreter, environment, and set of CPUs"""
+
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def get(self, interpreter, cpus=None, cmd_env=None):
+        """Returns a live worker that executes 'interpreter' pinned to 'cpus' with the environment 'cmd_env'"""
+        key = (interpreter, tuple(cpus or ()), tuple(sorted((cmd_env or {}).items())))
+        with self._lock:
+            worker = self._workers.get(key)
+            if worker is None or not worker.alive():
+                worker = PythonWorker(interpreter, cpus, cmd_env)
+                self._workers[key] = worker
+            return worker
+
+    def close(self):
+        with self._lock:
+            for worker in self._workers.values():
+                worker.close()
+            self._workers = {}
+
+
+def job_execute_worker(job, cmd, workers, cpus=None, timeout=None, max_output=rusage.MAX_OUTPUT, keep_regex=None):
+    """Execute the job of the Python command 'cmd' using a warm worker from 'workers' (see `worker_argv()`)
+
+    The output of each run is capped like in `bash_run()` (see `PythonWorker.execute()`).
+    """
+    argv = worker_argv(cmd)
+    worker = workers.get(argv[0], cpus, cmd.get('env', {}))
+    if job['warmup']:
+        worker.execute(argv[1:], None, timeout)
+    for i in range(job['nruns']):
+        outfile = "%s-%d" % (job['filename'], i)
+        if worker.execute(argv[1:], outfile, timeout, max_output, keep_regex) is None:
+            print ("%sThe Python worker died, restarting it%s" % (C.WARN, C.END))
+            worker = workers.get(argv[0], cpus, cmd.get('env', {}))
+
+
+def job_execute_slurm(job, dirty=False, partition=None, timeout=None):
+    """Execute the job through SLURM
+
+    When 'timeout' is set, each run is terminated after 'timeout' seconds.
+    """
     try:
         with open(job['filename'], 'w') as f:
             # First we have to write the bash script to a file
@@ -131,7 +509,9 @@ def job_execute_slurm(job, dirty=False, partition=None):
             if partition is not None:
                 cmd += ['-p', partition]
             cmd += [f.name]
-            p = Popen(cmd, stdout=PIPE)
+            # NB: `sbatch` exports our environment to the job, the output of the runs goes to the SLURM log as well
+            (cmd, popen_kwargs) = pinned_popen_args(cmd, None, run_env(timeout, echo=True))
+            p = Popen(cmd, stdout=PIPE, universal_newlines=True, **popen_kwargs)
             out, err = p.communicate()
             job['slurm_id'] = int(out.split(' ')[-1].rstrip())
             print ("with SLURM ID %d" % job['slurm_id'])
@@ -143,18 +523,63 @@ def job_execute_slurm(job, dirty=False, partition=None):
             pass
 
 
-def slurm_check_finished(job):
-    """Check if a SLUM job has finished"""
-    print ("Checking job %d"%job['slurm_id'])
-    out = check_output(['squeue'])
-    if out.find(" %d " % job['slurm_id']) != -1:
+def slurm_active_ids():
+    """Return the set of SLURM IDs of the user's jobs that are still queued or running (a single 'squeue' call)
+
+    Returns None when 'squeue' fails, e.g. when the SLURM controller is temporarily unavailable.
+    """
+    try:
+        out = check_output(['squeue', '--noheader', '--format=%i', '--user=%s' % getpass.getuser()],
+                           universal_newlines=True)
+    except (CalledProcessError, OSError) as e:
+        print ("%sCannot query the SLURM queue, trying again later: %s%s" % (C.WARN, e, C.END))
+        return None
+    ret = set()
+    for line in out.split():
+        ret.add(int(line.split('_')[0]))  # Tasks of job arrays are listed as '<ID>_<task>'
+    return ret
+
+
+def slurm_check_finished(job, active_ids=None):
+    """Check if a SLURM job has finished
+
+    Use 'active_ids' from `slurm_active_ids()` to check many jobs without calling 'squeue' for each of them.
+    """
+    if active_ids is None:
+        active_ids = slurm_active_ids()
+    if active_ids is None:  # The queue is unknown thus the job might still run
         return False
-    else:
-        return True
+    return job['slurm_id'] not in active_ids
+
+
+def slurm_gather_finished(suite, slurm_jobs, journal, dirty=False, references=None):
+    """Gather the results of the finished jobs in the list of '(cmd_idx, job_idx)' pairs 'slurm_jobs'.
+
+    Returns the list of the jobs still in the SLURM queue.
+    """
+    if len(slurm_jobs) == 0:
+        return []
+    active_ids = slurm_active_ids()
+    if active_ids is None:
+        return list(slurm_jobs)
+    ret = []
+    for cmd_idx, job_idx in slurm_jobs:
+        job = suite['cmd_list'][cmd_idx]['jobs'][job_idx]
+        if slurm_check_finished(job, active_ids):
+            job_gather_results(job, dirty=dirty, references=references)
+            journal.append(cmd_idx, job_idx, job)
+        else:
+            ret.append((cmd_idx, job_idx))
+    return ret
 
 
-def job_gather_results(job, dirty=False):
-    """Gather the results of the bash job and updates the job status. NB: the job must be finished!"""
+def job_gather_results(job, dirty=False, references=None):
+    """Gather the results of the bash job and updates the job status. NB: the job must be finished!
+
+    The result of run number 'i' is read from the output files of run 'i', which in a job array are written by task 'i'.
+    When 'references' is not None, the output of each run is validated against the `validation.References` and
+    a run whose output is invalid fails.
+    """
 
     job['results'] = []
     for i in range(job['nruns']):
@@ -168,9 +593,21 @@ def job_gather_results(job, dirty=False):
                     result['stdout'] = out.read()
                     result['stderr'] = err.read()
 
-                    # TODO: output validation check
                     result['success'] = True
 
+                    record = vutil.parse_record(result['stdout'])
+                    if isinstance(record, dict):
+                        result['record'] = record
+                    if references is not None:
+                        result['validation'] = references.validate(record if isinstance(record, dict) else {})
+                        if result['validation']['status'] == 'failed':
+                            print ("%sRun %d failed the validation against '%s':%s" % (
+                                C.FAIL, i, result['validation']['reference'], C.END))
+                            print ("%s\t%s%s" % (C.FAIL, '\n\t'.join(result['validation']['errors']), C.END))
+                            result['success'] = False
+                        elif result['validation']['status'] == 'missing':
+                            print ("%sRun %d has no output to validate%s" % (C.WARN, i, C.END))
+
                     if len(result['stderr']) > 0:
                         print ("%sSTDERR:%s" % (C.WARN, C.END))
                         print ("%s\t%s%s" % (C.FAIL, result['stderr'].replace('\n', '\n\t'), C.END))
@@ -178,17 +615,217 @@ def job_gather_results(job, dirty=False):
                 os.remove(stdout)
                 os.remove(stderr)
         except IOError:
-            print (C.WARN, "Could not find the stdout and/or the stderr file", C.END)
+            if job.get('array', False):
+                print (C.WARN, "Could not find the stdout and/or the stderr file of array task %d" % i, C.END)
+            else:
+                print (C.WARN, "Could not find the stdout and/or the stderr file", C.END)
+        # The resource usage is missing when the run was killed before it finished
+        try:
+            with open("%s.rusage" % base, 'r') as f:
+                result['rusage'] = json.load(f)
+            if not dirty:
+                os.remove("%s.rusage" % base)
+            if result['rusage'].pop('timeout', False):
+                print ("%sRun %d timed out after %.1f seconds%s" % (C.FAIL, i, result['rusage']['wall'], C.END))
+                result['timeout'] = True
+                result['success'] = False
+        except (IOError, ValueError):
+            pass
+        try:
+            with open("%s.perf" % base, 'r') as f:
+                result['perf'] = parse_perf_stat(f.read())
+            if not dirty:
+                os.remove("%s.perf" % base)
+        except IOError:
+            pass
         # Append result of the run
         job['results'].append(result)
 
     # Finally, let's update the job status
     if all(res['success'] for res in job['results']):
         job['status'] = 'finished'
+    elif any(res.get('timeout', False) for res in job['results']):
+        job['status'] = 'timeout'
     else:
         job['status'] = 'failed'
 
 
+def run_timeout(args, cmd):
+    """Returns the seconds before a run of 'cmd' is terminated or None
+
+    The timeout is the command's own 'timeout' (or else '--timeout') but at most '--timeout-factor' times the median
+    wall-clock time of the command's earlier successful runs.
+    """
+    timeout = cmd.get('timeout', args.timeout)
+    if args.timeout_factor is not None:
+        walls = sorted(vutil.extract_succeed_rusage(cmd, 'wall'))
+        if len(walls) > 0:
+            median = walls[len(walls) // 2]
+            if len(walls) % 2 == 0:
+                median = (median + walls[len(walls) // 2 - 1]) / 2.0
+            if timeout is None or args.timeout_factor * median < timeout:
+                timeout = args.timeout_factor * median
+    return timeout
+
+
+def execute_local_jobs(args, suite, local_jobs, journal, references=None):
+    """Execute the list of '(cmd_idx, job_idx)' pairs locally using 'args.jobs' concurrent jobs.
+
+    Each concurrent job runs on its own disjoint set of CPUs. The journal is written by the calling thread
+    whenever a job finishes. The output of the runs is validated against 'references' when not None.
+    """
+    cmd_list = suite['cmd_list']
+    workers = PythonWorkers() if args.python_worker else None
+    procs = LocalProcesses()
+
+    def execute(cmd, job, cpus=None):
+        timeout = run_timeout(args, cmd)
+        if workers is not None and worker_argv(cmd) is not None:
+            job_execute_worker(job, cmd, workers, cpus=cpus, timeout=timeout, max_output=args.max_output,
+                               keep_regex=output_keep_regex(args))
+        else:
+            job_execute_locally(job, verbose=args.live_output, dirty=args.dirty, cpus=cpus, timeout=timeout,
+                                procs=procs)
+
+    try:
+        if args.jobs <= 1:
+            for cmd_idx, job_idx in local_jobs:
+                cmd = cmd_list[cmd_idx]
+                job = cmd['jobs'][job_idx]
+                print ("Executing '%s'" % (cmd['label']))
+                execute(cmd, job)
+                job_gather_results(job, dirty=args.dirty, references=references)
+                journal.append(cmd_idx, job_idx, job)
+        else:
+            _execute_concurrently(args, cmd_list, local_jobs, journal, execute, references, procs)
+    finally:
+        if workers is not None:
+            workers.close()
+
+
+def _execute_concurrently(args, cmd_list, local_jobs, journal, execute, references=None, procs=None):
+    """Execute the local jobs using 'args.jobs' threads that each call 'execute(cmd, job, cpus)'
+
+    On Ctrl-C, the processes in the `LocalProcesses` 'procs' are killed since the threads cannot be interrupted.
+    """
+    free_slots = queue.Queue()
+    for slot in cpu_slots(args.jobs):
+        free_slots.put(slot)
+    suite_lock = threading.Lock()  # Protects the job dicts while they are serialized
+
+    def run_job(idx):
+        (cmd_idx, job_idx) = idx
+        cmd = cmd_list[cmd_idx]
+        job = cmd['jobs'][job_idx]
+        cpus = free_slots.get()
+        try:
+            print ("Executing '%s' on CPUs %s" % (cmd['label'], cpus))
+            execute(cmd, job, cpus)
+            with suite_lock:
+                job_gather_results(job, dirty=args.dirty, references=references)
+        finally:
+            free_slots.put(cpus)
+        return idx
+
+    pool = ThreadPool(free_slots.qsize())
+    try:
+        for cmd_idx, job_idx in pool.imap_unordered(run_job, local_jobs):
+            with suite_lock:
+                journal.append(cmd_idx, job_idx, cmd_list[cmd_idx]['jobs'][job_idx])
+        pool.close()
+    except KeyboardInterrupt:
+        if procs is not None:  # The runs are in their own process groups, thus they didn't get the Ctrl-C
+            procs.kill()
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def ordered_jobs(suite):
+    """Returns the '(cmd_idx, job_idx)' pairs of all jobs in 'suite' in the execution order of 'suite['order']'
+
+    The order is 'sequential' (all jobs of a command before the jobs of the next command), 'round-robin'
+    (the first job of each command, then the second job of each command, and so on), or 'random' (shuffled
+    using 'suite['order']['seed']'). The order of a suite never changes thus a resumed execution continues
+    where it left off.
+    """
+    ret = [(cmd_idx, job_idx) for cmd_idx, cmd in enumerate(suite['cmd_list']) for job_idx in range(len(cmd['jobs']))]
+    order = suite.get('order', {'mode': 'sequential'})
+    if order['mode'] == 'round-robin':
+        ret.sort(key=lambda idx: (idx[1], idx[0]))
+    elif order['mode'] == 'random':
+        random.Random(order['seed']).shuffle(ret)
+    return ret
+
+
+def execute_pending_jobs(args, suite, journal, references=None):
+    """Execute, submit, or gather the results of the pending jobs in 'suite'"""
+    local_jobs = []
+    slurm_jobs = []  # Jobs submitted by earlier invocations
+    submitted_jobs = []  # Jobs submitted by this invocation
+    for cmd_idx, job_idx in ordered_jobs(suite):
+        cmd = suite['cmd_list'][cmd_idx]
+        job = cmd['jobs'][job_idx]
+        if job['status'] == 'pending':
+            slurm_id = job.get('slurm_id', None)
+            if args.slurm and slurm_id is None: # We need to submit the job to SLURM
+                job_execute_slurm(job, partition=args.partition, timeout=run_timeout(args, cmd))
+                journal.append(cmd_idx, job_idx, job)
+                submitted_jobs.append((cmd_idx, job_idx))
+
+            elif slurm_id is not None:  # The job has already been submitted to SLURM
+                slurm_jobs.append((cmd_idx, job_idx))
+
+            else:  # The user wants local execution
+                local_jobs.append((cmd_idx, job_idx))
+    execute_local_jobs(args, suite, local_jobs, journal, references)
+
+    # Jobs submitted by earlier invocations are checked using a single query of the SLURM queue
+    slurm_jobs = slurm_gather_finished(suite, slurm_jobs, journal, dirty=args.dirty, references=references)
+    if args.wait:
+        slurm_jobs += submitted_jobs
+        interval = args.wait_interval
+        while len(slurm_jobs) > 0:
+            print ("Waiting for %d SLURM jobs" % len(slurm_jobs))
+            time.sleep(interval)
+            interval = min(interval * 2, 600)
+            slurm_jobs = slurm_gather_finished(suite, slurm_jobs, journal, dirty=args.dirty, references=references)
+
+
+def adaptive_converged(cmd, adaptive):
+    """Check whether the runs of 'cmd' satisfy the 'adaptive' settings of the suite
+
+    The runs satisfy the settings when the confidence interval of the parsed results, relative to their mean,
+    is narrower than 'adaptive['ci_width']' or when the command has executed 'adaptive['max_runs']' runs.
+    """
+    if sum(job['nruns'] for job in cmd['jobs']) >= adaptive['max_runs']:
+        return True
+    values = vutil.extract_succeed_results(cmd, adaptive['parse_regex'], float)
+    if len(values) == 0:  # Nothing to measure, more runs will not help
+        return True
+    if len(values) < 2:
+        return False
+    avg = vutil.mean(values)
+    return avg > 0 and 2 * vutil.confidence_interval(values) / avg <= adaptive['ci_width']
+
+
+def adaptive_schedule(args, suite, journal):
+    """Schedule one more run of each command that has finished all its jobs but haven't converged
+
+    Returns the number of new jobs.
+    """
+    count = 0
+    for cmd_idx, cmd in enumerate(suite['cmd_list']):
+        if any(job['status'] == 'pending' for job in cmd['jobs']):
+            continue
+        if not adaptive_converged(cmd, suite['adaptive']):
+            cmd['jobs'].append(bash_job(args, cmd, 1))
+            journal.append(cmd_idx, len(cmd['jobs']) - 1, cmd['jobs'][-1])
+            count += 1
+    return count
+
+
 def main():
     """Run the commands in the JSON file not already finished"""
 
@@ -221,6 +858,118 @@ def main():
         default=None,
         help="Assign a tag to the result."
     )
+    parser.add_argument(
+        '--jobs',
+        default=1,
+        type=int,
+        metavar='N',
+        help="Execute up to N jobs concurrently on the local machine. "
+             "The available CPUs are split evenly between the jobs."
+    )
+    parser.add_argument(
+        '--timeout',
+        default=None,
+        type=float,
+        metavar='SECONDS',
+        help="Terminate runs that take longer than SECONDS (SIGTERM to the process group of the run and, "
+             "%d seconds later, SIGKILL). A command's own 'timeout' overrules this value." % rusage.KILL_GRACE
+    )
+    parser.add_argument(
+        '--timeout-factor',
+        default=None,
+        type=float,
+        metavar='N',
+        help="Terminate runs that take longer than N times the median of the earlier runs of the same command."
+    )
+    parser.add_argument(
+        '--python-worker',
+        action="store_true",
+        help="Execute Python commands, such as 'python heat_equation.py --size=100*100*10', using a warm Python "
+             "process that has imported NumPy already. Each run is a fork of the warm process."
+    )
+    parser.add_argument(
+        '--perf-counters',
+        action="store_true",
+        help="Count hardware events of each run using `perf stat`, see --perf-events."
+    )
+    parser.add_argument(
+        '--perf-events',
+        default=PERF_EVENTS,
+        metavar='LIST',
+        help="The comma separated list of events that --perf-counters counts (default: %s)." % PERF_EVENTS
+    )
+    parser.add_argument(
+        '--live-output',
+        action="store_true",
+        help="Pass the output of the local runs through to the console while they run."
+    )
+    parser.add_argument(
+        '--max-output',
+        default=rusage.MAX_OUTPUT,
+        type=int,
+        metavar='BYTES',
+        help="The number of bytes of the stdout and stderr of each run to store in the suite. Of larger outputs, "
+             "the head, the tail, and the lines in between that match '--keep-regex' are stored."
+    )
+    parser.add_argument(
+        '--keep-regex',
+        default=None,
+        metavar='RegEx',
+        help="The lines beyond '--max-output' to store (default: the '--parse-regex'). "
+             "The JSON records of `benchpress.util.Benchmark` are always stored."
+    )
+    parser.add_argument(
+        '--order',
+        default=None,
+        choices=['sequential', 'round-robin', 'random'],
+        help="The execution order of the runs. 'sequential' executes all runs of a command before the next command. "
+             "'round-robin' executes the first run of each command, then the second run of each command, etc. "
+             "'random' executes the runs in a random order. The two latter give each run its own job thus the "
+             "order must be given when the jobs are created. The order is stored in the suite "
+             "(default: the stored order or 'sequential')."
+    )
+    parser.add_argument(
+        '--seed',
+        default=None,
+        type=int,
+        help="The seed of the 'random' order (default: a random seed, which is stored in the suite)."
+    )
+    adaptive_grp = parser.add_argument_group('Adaptive Repetition')
+    adaptive_grp.add_argument(
+        '--adaptive',
+        action="store_true",
+        help="Keep running each command, one run at a time, until the 95%% confidence interval of its results "
+             "is narrow enough. The runs of '--nruns' are the minimum. The settings are stored in the suite "
+             "thus a resumed execution continues in adaptive mode."
+    )
+    adaptive_grp.add_argument(
+        '--max-runs',
+        default=30,
+        type=int,
+        help="The maximum number of runs of each command."
+    )
+    adaptive_grp.add_argument(
+        '--ci-width',
+        default=0.05,
+        type=float,
+        metavar='FRACTION',
+        help="The target width of the confidence interval relative to the mean of the results."
+    )
+    adaptive_grp.add_argument(
+        "--parse-regex",
+        metavar="RegEx",
+        type=str,
+        default=vutil.ELAPSED_REGEX,
+        help="How to parse the result of each run. For each RegEx match, group one is recorded as a result."
+    )
+    parser.add_argument(
+        '--reference',
+        default=None,
+        metavar='FILE',
+        help="Validate the output of each run against the reference of its benchmark, size, and dtype in the JSON "
+             "file FILE. The output of the first run without a reference becomes the reference. Runs with invalid "
+             "output fail. The file is stored in the suite thus resumed executions validate as well."
+    )
     slurm_grp = parser.add_argument_group('SLURM Queuing System')
     slurm_grp.add_argument(
         '--slurm',
@@ -237,14 +986,26 @@ def main():
         action="store_true",
         help="Submit 'nruns' SLURM jobs instead of one job with 'nruns' number of runs."
     )
-    # TODO: implement --wait
-    """
+    slurm_grp.add_argument(
+        '--array',
+        action="store_true",
+        help="Submit one SLURM job array of 'nruns' tasks per command, where each task executes one run. "
+             "Cannot be combined with --multi-jobs or a non-sequential --order since SLURM decides the order "
+             "of the tasks."
+    )
     slurm_grp.add_argument(
         '--wait',
         action="store_true",
         help="Wait for all SLURM jobs to finished before returning."
     )
-    """
+    slurm_grp.add_argument(
+        '--wait-interval',
+        default=10.0,
+        type=float,
+        metavar='SECONDS',
+        help="When waiting, the initial time between checks of the SLURM queue. "
+             "The time doubles after each check, up to ten minutes."
+    )
     slurm_grp.add_argument(
         '--nice',
         type=int,
@@ -254,32 +1015,58 @@ def main():
         default=0
     )
     args = parser.parse_args()
+    if args.python_worker and args.perf_counters:
+        parser.error("--python-worker cannot be combined with --perf-counters")
+    if args.array and args.multi_jobs:
+        parser.error("--array cannot be combined with --multi-jobs")
+    if args.array and args.order not in (None, 'sequential'):
+        parser.error("--array cannot be combined with --order %s" % args.order)
+    if args.perf_counters and find_executable('perf') is None:
+        print ("%sWARNING: --perf-counters requires `perf`, which isn't in PATH%s" % (C.WARN, C.END))
 
     print ("Running benchmark; results are written to: %s" % args.suite.name)
+    # Ask `benchpress.util.Benchmark` for the JSON record of each run, which is stored as the result's 'record'
+    os.environ.setdefault(vutil.RECORD_ENV, '1')
     try:
         suite = json.load(args.suite)
+        # Results recorded by an earlier run that did not finish are in the journal
+        if journal_fold(suite, journal_path(args.suite.name)) > 0:
+            print ("Resuming from the journal '%s'" % journal_path(args.suite.name))
         if args.tag is not None:
             suite['tag'] = args.tag
+        if args.order is not None:
+            suite['order'] = {
+                'mode': args.order,
+                'seed': args.seed if args.seed is not None else random.randint(0, 2**31 - 1),
+            }
+        if args.adaptive:
+            suite['adaptive'] = {
+                'max_runs': args.max_runs,
+                'ci_width': args.ci_width,
+                'parse_regex': args.parse_regex,
+            }
+        if args.reference is not None:
+            suite['validation'] = {'reference': os.path.abspath(args.reference)}
+        references = None
+        if 'validation' in suite:
+            references = validation.References(suite['validation']['reference'])
+            # Ask `benchpress.util.Benchmark` for the digest of the output as well
+            os.environ.setdefault(validation.DIGEST_ENV, '1')
         cmd_list = suite['cmd_list']
         for cmd in cmd_list:
             if 'jobs' not in cmd:
                 cmd['jobs'] = create_jobs(args, cmd)
-            for job in cmd['jobs']:
-                if job['status'] == 'pending':
-                    slurm_id = job.get('slurm_id', None)
-                    if args.slurm and slurm_id is None: # We need to submit the job to SLURM
-                        job_execute_slurm(job, partition=args.partition)
-
-                    elif slurm_id is not None:  # The job has already been submitted to SLURM
-                        if slurm_check_finished(job):
-                            job_gather_results(job, dirty=args.dirty)
-
-                    else:  # The user wants local execution
-                        print ("Executing '%s'" % (cmd['label']))
-                        job_execute_locally(job, dirty=args.dirty)
-                        job_gather_results(job, dirty=args.dirty)
-                    # We always need to update the json
-                    write2json(args.suite, suite)
+        # From here on, job updates are appended to the journal instead of rewriting the suite file
+        compact_suite(args.suite, suite)
+        journal = Journal(journal_path(args.suite.name))
+        try:
+            while True:
+                execute_pending_jobs(args, suite, journal, references)
+                if 'adaptive' not in suite or adaptive_schedule(args, suite, journal) == 0:
+                    break
+        finally:
+            journal.close()
+            compact_suite(args.suite, suite)
         print ("%sFinished execution, result written in '%s'%s" % (C.WARN, args.suite.name, C.END))
     except KeyboardInterrupt:
         print ("%sSuspending the benchmark execution, "
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Execute a bash command and write its resource usage to a JSON file.
+
+Usage::
+
+    python rusage.py [--perf-events EVENTS --perf-output PERF_FILE] [--stdout FILE] [--stderr FILE]
+                     [--max-output BYTES] [--keep-regex REGEX] RUSAGE_FILE COMMAND
+
+The job scripts of `bp-run` execute each run through this script, which returns the exit code of `COMMAND`.
+When `--perf-events` is given, `COMMAND` runs within `perf stat`, which writes the counters in CSV to `PERF_FILE`.
+
+When `--stdout` or `--stderr` is given, the output of `COMMAND` is read through a pipe and written to the file
+when `COMMAND` exits. Of output larger than `--max-output` bytes, only the head, the tail, and the lines in between
+that match `--keep-regex` are kept. When the environment variable `BP_RUN_ECHO` is `1`, the output is also passed
+through to the stdout and stderr of this script while `COMMAND` runs.
+
+When the environment variable `BP_RUN_TIMEOUT` is set, `COMMAND` runs in its own process group, which is
+terminated (SIGTERM and, if still alive after a grace period, SIGKILL) after `BP_RUN_TIMEOUT` seconds.
+
+.. note:: This file must not import `benchpress` since the job scripts might execute it where `benchpress` is not
+          installed e.g. on a SLURM node.
+
+"""
+from __future__ import absolute_import
+import os
+import sys
+import json
+import re
+import time
+import select
+import signal
+import argparse
+
+# The wall-clock to use
+_clock = getattr(time, 'monotonic', time.time)
+
+# The environment variable that sets the timeout of each run in seconds
+TIMEOUT_ENV = 'BP_RUN_TIMEOUT'
+
+# The seconds between SIGTERM and SIGKILL when a run times out
+KILL_GRACE = 5.0
+
+# The environment variable that, when set to '1', passes the output of each run through to our stdout and stderr
+ECHO_ENV = 'BP_RUN_ECHO'
+
+# The default number of bytes of each output stream to keep
+MAX_OUTPUT = 1024 * 1024
+
+# The seconds to keep reading the output of a run after it exited, when a descendant keeps the pipes open
+DRAIN_GRACE = 1.0
+
+# The seconds between checks of whether a run, whose output is being read, has exited
+_POLL_INTERVAL = 0.05
+
+# The longest line in the dropped part of an output that `--keep-regex` is matched against
+_MAX_LINE = 64 * 1024
+
+
+class _Alarm(Exception):
+    pass
+
+
+def _raise_alarm(signum, frame):
+    raise _Alarm()
+
+
+def _wait4(pid, timeout):
+    """Call `os.wait4(pid, 0)` but return None if 'pid' is still running after 'timeout' seconds"""
+    old_handler = signal.signal(signal.SIGALRM, _raise_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    ret = None
+    try:
+        ret = os.wait4(pid, 0)
+    except _Alarm:
+        pass
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+    return ret
+
+
+def _kill(pid, sig):
+    """Send 'sig' to the process group of 'pid' or, if it has no group of its own, to 'pid'"""
+    try:
+        os.killpg(pid, sig)
+    except OSError:
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass
+
+
+class CappedOutput(object):
+    """Output buffer that keeps the head and the tail of the output plus the lines in between that match a regex
+
+    Parameters
+    ----------
+    max_bytes : int
+        The number of bytes to keep of the head and the tail together
+    keep_regex : str
+        Regex (of bytes) of the lines in the dropped part to keep or None
+    echo_fd : int
+        File descriptor to pass the output through to or None
+    """
+
+    def __init__(self, max_bytes=MAX_OUTPUT, keep_regex=None, echo_fd=None):
+        self.head = bytearray()
+        self.head_size = max_bytes // 2
+        self.tail = bytearray()
+        self.tail_size = max_bytes - self.head_size
+        self.keep_regex = None if keep_regex is None else re.compile(keep_regex.encode('utf-8'))
+        self.kept = []
+        self.dropped = 0
+        self.partial = b''  # The unfinished last line of the dropped part
+        self.echo_fd = echo_fd
+
+    def write(self, data):
+        if self.echo_fd is not None:
+            try:
+                os.write(self.echo_fd, data)
+            except OSError:  # E.g. the reader closed the pipe, which shouldn't affect the run
+                self.echo_fd = None
+        if len(self.head) < self.head_size:
+            n = self.head_size - len(self.head)
+            self.head += data[:n]
+            data = data[n:]
+        if len(data) == 0:
+            return
+        self.tail += data
+        excess = len(self.tail) - self.tail_size
+        if excess > 0:
+            self._drop(bytes(self.tail[:excess]))
+            del self.tail[:excess]
+
+    def _drop(self, data):
+        """Drop 'data' from the middle of the output but keep the lines that match `self.keep_regex`"""
+        self.dropped += len(data)
+        if self.keep_regex is None:
+            return
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()[-_MAX_LINE:]
+        for line in lines:
+            if self.keep_regex.search(line) is not None:
+                self.kept.append(line)
+
+    def getvalue(self):
+        """Returns the kept output as bytes"""
+        if self.dropped == 0:
+            return bytes(self.head + self.tail)
+        kept = list(self.kept)
+        if self.keep_regex is not None and self.keep_regex.search(self.partial) is not None:
+            kept.append(self.partial)
+        ret = bytes(self.head)
+        ret += b"\n[bp-run: dropped %d bytes, the %d lines that match the keep-regex follow]\n" % \
+               (self.dropped, len(kept))
+        ret += b"".join(line + b"\n" for line in kept)
+        ret += b"[bp-run: end of dropped bytes]\n"
+        return ret + bytes(self.tail)
+
+
+def _drain(readers, deadline=None, pid=None):
+    """Read the pipes in 'readers', which maps file descriptors to buffers, until they are all closed
+
+    The closed pipes are removed from 'readers'. When 'pid' is set, the child 'pid' is reaped as soon as it exits
+    and the pipes are read for at most `DRAIN_GRACE` seconds more since a backgrounded descendant might keep them
+    open. Returns a tuple of whether the pipes are closed, which is False if they are still open at 'deadline'
+    (a time according to `_clock()`) or when the grace period has passed, the `os.wait4()` result of 'pid' or None
+    when it is still running, and the time it was reaped.
+    """
+    ret = None
+    end = None
+    while len(readers) > 0:
+        if pid is not None and ret is None:
+            res = os.wait4(pid, os.WNOHANG)
+            if res[0] != 0:
+                ret = res
+                end = _clock()
+                deadline = end + DRAIN_GRACE if deadline is None else min(deadline, end + DRAIN_GRACE)
+        wait = None
+        if deadline is not None:
+            wait = deadline - _clock()
+            if wait <= 0:
+                return False, ret, end
+        if pid is not None and ret is None:
+            wait = _POLL_INTERVAL if wait is None else min(wait, _POLL_INTERVAL)
+        ready, _, _ = select.select(list(readers), [], [], wait)
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if len(data) > 0:
+                readers[fd].write(data)
+            else:
+                os.close(fd)
+                del readers[fd]
+    return True, ret, end
+
+
+def new_process_group(pid=0):
+    """Make 'pid' (default: the calling process) the leader of a new process group
+
+    Both the parent and the child call this function, thus the group exists no matter which runs first.
+    """
+    try:
+        os.setpgid(pid, pid)
+    except OSError:  # The child has already called exec() or exited
+        pass
+
+
+def execute(cmd, perf_events=None, perf_output=None, timeout=None, stdout=None, stderr=None):
+    """Execute the bash command 'cmd' and return its exit code and resource usage
+
+    Parameters
+    ----------
+    cmd : str
+        The bash command to execute
+    perf_events : str
+        Comma separated list of hardware events that `perf stat` should count or None
+    perf_output : str
+        The file `perf stat` writes the counters to (required when `perf_events` is set)
+    timeout : float
+        Seconds before the command is terminated or None
+    stdout : CappedOutput
+        The buffer to capture the stdout of the command in or None to let the command inherit our stdout
+    stderr : CappedOutput
+        The buffer to capture the stderr of the command in or None to let the command inherit our stderr
+
+    Returns
+    -------
+    exit_code : int
+        The exit code of the command (128 + the signal number when it was killed by a signal)
+    rusage : dict
+        The resource usage of the command and its descendants
+    """
+    argv = ['bash', '-c', cmd]
+    if perf_events is not None:
+        argv = ['perf', 'stat', '-x,', '-o', perf_output, '-e', perf_events, '--'] + argv
+    pipes = {}  # Maps the file descriptor of the command to the pipe (read end, write end)
+    for fd, buf in ((1, stdout), (2, stderr)):
+        if buf is not None:
+            pipes[fd] = os.pipe()
+    start = _clock()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            if timeout is not None:
+                new_process_group()
+            for fd, (read_end, write_end) in pipes.items():
+                os.dup2(write_end, fd)
+                os.close(read_end)
+                os.close(write_end)
+            os.execvp(argv[0], argv)
+        finally:
+            os._exit(127)
+    if timeout is not None:
+        new_process_group(pid)
+    readers = {}
+    for fd, (read_end, write_end) in pipes.items():
+        os.close(write_end)
+        readers[read_end] = stdout if fd == 1 else stderr
+    return wait(pid, start, timeout, readers)
+
+
+def wait(pid, start, timeout=None, readers=None):
+    """Wait for the child process 'pid' and return its exit code and resource usage
+
+    When 'timeout' is set, the child must be the leader of its own process group (see `new_process_group()`),
+    which is terminated after 'timeout' seconds. The resource usage of a terminated child includes
+    `'timeout': True`. While waiting, the pipes in 'readers' are read until the child closes them or, when a
+    descendant of the child keeps them open, until `DRAIN_GRACE` seconds after the child exited.
+
+    Parameters
+    ----------
+    pid : int
+        The process ID of the child
+    start : float
+        The time, according to `_clock()`, when the child was started
+    timeout : float
+        Seconds before the child is terminated or None
+    readers : dict
+        Maps the read end of the output pipes of the child to their `CappedOutput` buffer. The pipes are closed.
+
+    Returns
+    -------
+    exit_code : int
+        The exit code of the child (128 + the signal number when it was killed by a signal)
+    rusage : dict
+        The resource usage of the child and its descendants
+    """
+    readers = {} if readers is None else readers
+    timed_out = False
+    ret = None
+    end = None
+    deadline = None if timeout is None else start + timeout
+    try:
+        _, ret, end = _drain(readers, deadline, pid)
+        if ret is None:
+            ret = os.wait4(pid, 0) if timeout is None else _wait4(pid, max(deadline - _clock(), 0.001))
+        if ret is None:
+            timed_out = True
+            _kill(pid, signal.SIGTERM)
+            deadline = _clock() + KILL_GRACE
+            _, ret, end = _drain(readers, deadline, pid)
+            if ret is None:
+                ret = _wait4(pid, max(deadline - _clock(), 0.001))
+            if ret is None:
+                _kill(pid, signal.SIGKILL)
+                _drain(readers, _clock() + 1.0)  # Unless a descendant left the process group
+                ret = os.wait4(pid, 0)
+    except KeyboardInterrupt:  # With a timeout, the child is not in the foreground process group of the terminal
+        if ret is None:
+            _kill(pid, signal.SIGKILL)
+            os.wait4(pid, 0)
+        raise
+    finally:
+        for fd in readers:
+            os.close(fd)
+    _, status, ru = ret
+    if timeout is not None:
+        try:
+            os.killpg(pid, signal.SIGKILL)  # Descendants that outlived the child
+        except OSError:
+            pass
+    wall = (_clock() if end is None else end) - start
+
+    if os.WIFSIGNALED(status):
+        exit_code = 128 + os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+
+    maxrss = ru.ru_maxrss
+    if sys.platform == 'darwin':  # OSX reports bytes and not kilobytes
+        maxrss //= 1024
+
+    rusage = {
+        'wall': wall,
+        'utime': ru.ru_utime,
+        'stime': ru.ru_stime,
+        'maxrss': maxrss,
+        'nvcsw': ru.ru_nvcsw,
+        'nivcsw': ru.ru_nivcsw,
+        'minflt': ru.ru_minflt,
+        'majflt': ru.ru_majflt,
+    }
+    if timed_out:
+        rusage['timeout'] = True
+    return exit_code, rusage
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Execute a bash command and write its resource usage to a file.')
+    parser.add_argument('rusage_file', metavar='RUSAGE_FILE', help="The JSON file to write the resource usage to.")
+    parser.add_argument('cmd', metavar='COMMAND', help="The bash command to execute.")
+    parser.add_argument('--perf-events', metavar='EVENTS', help="Count EVENTS using `perf stat`.")
+    parser.add_argument('--perf-output', metavar='PERF_FILE', help="The CSV file to write the counters to.")
+    parser.add_argument('--stdout', metavar='FILE', help="Capture the stdout of COMMAND in FILE.")
+    parser.add_argument('--stderr', metavar='FILE', help="Capture the stderr of COMMAND in FILE.")
+    parser.add_argument('--max-output', metavar='BYTES', type=int, default=MAX_OUTPUT,
+                        help="The number of bytes to keep of each captured output.")
+    parser.add_argument('--keep-regex', metavar='REGEX',
+                        help="Keep the lines that match REGEX even when they are beyond --max-output.")
+    args = parser.parse_args()
+    if args.perf_events is not None and args.perf_output is None:
+        parser.error("--perf-events requires --perf-output")
+
+    timeout = os.environ.get(TIMEOUT_ENV)
+    timeout = float(timeout) if timeout else None
+    echo = os.environ.get(ECHO_ENV) == '1'
+    outputs = {}
+    for fd, filename in ((1, args.stdout), (2, args.stderr)):
+        if filename is not None:
+            outputs[filename] = CappedOutput(args.max_output, args.keep_regex, fd if echo else None)
+    (exit_code, rusage) = execute(args.cmd, args.perf_events, args.perf_output, timeout,
+                                  outputs.get(args.stdout), outputs.get(args.stderr))
+    for filename, buf in outputs.items():
+        with open(filename, 'wb') as f:
+            f.write(buf.getvalue())
+    with open(args.rusage_file, 'w') as f:
+        json.dump(rusage, f)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
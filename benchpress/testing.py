@@ -14,6 +14,7 @@ To run the test use::
 from __future__ import absolute_import
 import unittest
 import tempfile
+import os
 from os.path import join
 import sys
 import benchpress as bp
@@ -39,6 +40,57 @@ def create_test_suite(suite_path):
     bp.create_suite(cmd_list, suite_path)
 
 
+def run_benchmark(name, size, *options):
+    """Run the Python/NumPy benchmark `name` with `--size=size`, `--digest-output`, `--json-record`, and `options`
+    and return its JSON record. Raises `CalledProcessError` when the benchmark fails."""
+    from benchpress.suite_util import BP_ROOT
+    from benchpress.visualizer.util import parse_record
+    from subprocess import check_output, STDOUT
+    script = join(BP_ROOT, "benchmarks", name, "python_numpy", "%s.py" % name)
+    out = check_output([sys.executable, script, "--size=%s" % size, "--digest-output", "--json-record"] +
+                       list(options), stderr=STDOUT)
+    return parse_record(out.decode())
+
+
+def create_fake_slurm(bin_dir, squeue_failures=0):
+    """Write stand-ins for `sbatch` and `squeue` into `bin_dir`.
+
+    `sbatch` runs the job script (each task of a job array) right away and `squeue` lists each submitted job exactly once,
+    thus all jobs are finished at the second check of the queue. The first `squeue_failures` calls of `squeue` fail.
+    """
+    sbatch = """#!/bin/bash
+dir=$(dirname "$0")
+id=$(( $(cat "$dir/next_id" 2>/dev/null || echo 100) + 1 ))
+echo $id > "$dir/next_id"
+echo $id >> "$dir/queue"
+echo call >> "$dir/sbatch_calls"
+last_task=$(sed -n 's/^#SBATCH --array=0-\\([0-9]*\\)$/\\1/p' "${@: -1}")
+if [ -n "$last_task" ]; then
+    for task in $(seq 0 $last_task); do
+        SLURM_ARRAY_TASK_ID=$task bash "${@: -1}" > /dev/null 2>&1
+    done
+else
+    bash "${@: -1}" > /dev/null 2>&1
+fi
+echo "Submitted batch job $id"
+"""
+    squeue = """#!/bin/bash
+dir=$(dirname "$0")
+echo call >> "$dir/squeue_calls"
+if [ $(wc -l < "$dir/squeue_calls") -le %d ]; then
+    echo "slurm_load_jobs error: Socket timed out on send/recv operation" >&2
+    exit 1
+fi
+cat "$dir/queue" 2>/dev/null
+: > "$dir/queue"
+""" % squeue_failures
+    for name, script in [('sbatch', sbatch), ('squeue', squeue)]:
+        path = join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+
+
 class SuiteSchema(unittest.TestCase):
 
     def testSchema(self):
@@ -63,6 +115,751 @@ class SuiteSchema(unittest.TestCase):
             jsonschema.validate(suite, suite_schema)
 
 
+    def testParallelJobs(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        create_test_suite(suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--jobs", "2"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            for cmd in suite['cmd_list']:
+                for job in cmd['jobs']:
+                    self.assertNotEqual(job['status'], 'pending')
+
+        # Each job runs on its own slot of CPUs and 'OMP_NUM_THREADS' defaults to the size of the slot
+        suite_file = join(tmpdir, "pinning.json")
+        cmd = "echo omp=$OMP_NUM_THREADS cpus=$(%s -c 'import os; print(sorted(os.sched_getaffinity(0)))')"
+        bp.create_suite([bp.command(cmd % sys.executable, "Pinning")], suite_file)
+        sys.argv[:] = [old_argv[0], suite_file, "--jobs", "2", "--nruns", "2", "--multi-jobs"]
+        run.main()
+        sys.argv = old_argv
+        cpus = run.available_cpus()
+        size = len(cpus) // min(2, len(cpus))
+        slots = []
+        with open(suite_file, "r") as f:
+            for job in json.load(f)['cmd_list'][0]['jobs']:
+                self.assertEqual(job['status'], 'finished')
+                (omp, pinned) = job['results'][0]['stdout'].split(" ", 1)
+                self.assertEqual(omp, "omp=%d" % size)
+                pinned = json.loads(pinned[len("cpus="):])
+                self.assertEqual(len(pinned), size)
+                self.assertTrue(set(pinned) <= set(cpus))
+                slots.append(pinned)
+        if len(cpus) > 1:
+            self.assertFalse(set(slots[0]) & set(slots[1]))
+
+    def testKillLocalProcesses(self):
+        import time
+        from . import run
+        from subprocess import Popen, PIPE
+        (popen_cmd, popen_kwargs) = run.pinned_popen_args(['bash', '-c', 'sleep 30 & wait'], None, new_group=True)
+        proc = Popen(popen_cmd, stdout=PIPE, **popen_kwargs)
+        procs = run.LocalProcesses()
+        procs.add(proc)
+        start = time.time()
+        procs.kill()
+        self.assertIsNotNone(proc.poll())
+        proc.stdout.read()  # Returns when the backgrounded `sleep`, which has the pipe too, is gone
+        proc.stdout.close()
+        self.assertLess(time.time() - start, 15)
+
+    def testJsonRecord(self):
+        from . import run
+        from .visualizer import util as vutil
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        create_test_suite(suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--nruns", "1"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            bean = [cmd for cmd in suite['cmd_list'] if cmd['label'].startswith("Bean")][0]
+            record = bean['jobs'][0]['results'][0]['record']
+            self.assertEqual(record['size'], [10000, 10])
+            self.assertEqual(record['backend'], "numpy")
+            self.assertIn("elapsed-time: %f" % record['elapsed'], bean['jobs'][0]['results'][0]['stdout'])
+            self.assertEqual(vutil.extract_succeed_results(bean, vutil.ELAPSED_REGEX, float), [record['elapsed']])
+        self.assertIsNone(vutil.parse_record("no record\n"))
+        self.assertEqual(vutil.parse_record("x bp-record: {}\nbp-record: {\"elapsed\": 2}\n"), {"elapsed": 2})
+
+    def testPythonWorker(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        create_test_suite(suite_file)
+        with open(suite_file, "r") as f:
+            for cmd in json.load(f)['cmd_list']:
+                self.assertIsNotNone(run.worker_argv(cmd))
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--python-worker", "--warmup"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            for cmd in suite['cmd_list']:
+                for job in cmd['jobs']:
+                    self.assertEqual(job['status'], 'finished')
+                    for res in job['results']:
+                        self.assertIn('rusage', res)
+
+    def testTimeout(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        bp.create_suite([bp.command("echo elapsed-time: 1.0", "Fast"),
+                         bp.command("sleep 1 && sleep 1", "Slow", timeout=0.1),
+                         bp.command("sleep 2", "Slow-global")], suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--nruns", "1", "--timeout", "0.2"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            (fast, slow, slow_global) = suite['cmd_list']
+            self.assertEqual(fast['jobs'][0]['status'], 'finished')
+            for cmd in (slow, slow_global):
+                self.assertEqual(cmd['jobs'][0]['status'], 'timeout')
+                self.assertTrue(cmd['jobs'][0]['results'][0]['timeout'])
+            self.assertLess(slow['jobs'][0]['results'][0]['rusage']['wall'], 1.0)
+
+    def testCappedOutput(self):
+        from . import run
+        from .visualizer import util as vutil
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        cmd = "echo first; seq 10000; echo elapsed-time: 1.5; seq 10000; echo last; echo error >&2"
+        bp.create_suite([bp.command(cmd, "Verbose")], suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--nruns", "1", "--max-output", "1000"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            result = suite['cmd_list'][0]['jobs'][0]['results'][0]
+            self.assertTrue(result['success'])
+            self.assertLess(len(result['stdout']), 1200)
+            self.assertTrue(result['stdout'].startswith("first\n"))
+            self.assertTrue(result['stdout'].endswith("10000\nlast\n"))
+            self.assertIn("\nelapsed-time: 1.5\n", result['stdout'])
+            self.assertEqual(result['stderr'], "error\n")
+            values = vutil.extract_succeed_results(suite['cmd_list'][0], r'elapsed-time: ([\d.]+)', float)
+            self.assertEqual(values, [1.5])
+
+    def testCappedOutputWorker(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        script = join(tmpdir, "verbose.py")
+        with open(script, "w") as f:
+            f.write("import sys\n"
+                    "print('first')\n"
+                    "print('\\n'.join(str(i) for i in range(10000)))\n"
+                    "print('elapsed-time: 1.5')\n"
+                    "print('\\n'.join(str(i) for i in range(10000)))\n"
+                    "print('last')\n"
+                    "sys.stderr.write('error\\n')\n")
+        bp.create_suite([bp.command("%s %s" % (sys.executable, script), "Verbose")], suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--nruns", "1", "--max-output", "1000", "--python-worker"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            result = suite['cmd_list'][0]['jobs'][0]['results'][0]
+            self.assertTrue(result['success'])
+            self.assertLess(len(result['stdout']), 1200)
+            self.assertTrue(result['stdout'].startswith("first\n"))
+            self.assertTrue(result['stdout'].endswith("9999\nlast\n"))
+            self.assertIn("\nelapsed-time: 1.5\n", result['stdout'])
+            self.assertEqual(result['stderr'], "error\n")
+
+    def testBackgroundOutput(self):
+        import time
+        from . import run
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        bp.create_suite([bp.command("sleep 30 & echo hi", "Background")], suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--nruns", "1"]
+        start = time.time()
+        run.main()
+        sys.argv = old_argv
+        self.assertLess(time.time() - start, 15)
+        with open(suite_file, "r") as f:
+            result = json.load(f)['cmd_list'][0]['jobs'][0]['results'][0]
+            self.assertTrue(result['success'])
+            self.assertEqual(result['stdout'], "hi\n")
+            self.assertLess(result['rusage']['wall'], 1)
+
+    def testOrder(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        log = join(tmpdir, "log.txt")
+        for order, seed in (("round-robin", None), ("random", 7)):
+            suite_file = join(tmpdir, "%s.json" % order)
+            bp.create_suite([bp.command("echo A >> %s" % log, "A"),
+                             bp.command("echo B >> %s" % log, "B")], suite_file)
+            old_argv = sys.argv[:]
+            sys.argv[:] = [old_argv[0], suite_file, "--nruns", "3", "--order", order]
+            if seed is not None:
+                sys.argv += ["--seed", str(seed)]
+            run.main()
+            sys.argv = old_argv
+            with open(suite_file, "r") as f:
+                suite = json.load(f)
+                jsonschema.validate(suite, suite_schema)
+            expect = "".join(suite['cmd_list'][cmd_idx]['label'] for cmd_idx, _ in run.ordered_jobs(suite))
+            with open(log, "r") as f:
+                self.assertEqual(f.read().replace("\n", ""), expect)
+            os.remove(log)
+            if order == "round-robin":
+                self.assertEqual(expect, "ABABAB")
+
+    def testJournalResume(self):
+        from . import run
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        create_test_suite(suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file]
+        run.main()
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+
+        # Emulate a bp-run that died after journaling the first job but before the compaction
+        finished_job = suite['cmd_list'][0]['jobs'][0]
+        suite['cmd_list'][0]['jobs'][0] = dict(finished_job, status='pending')
+        with open(suite_file, "w") as f:
+            json.dump(suite, f)
+        journal = run.Journal(run.journal_path(suite_file))
+        journal.append(0, 0, finished_job)
+        journal.close()
+
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            self.assertEqual(suite['cmd_list'][0]['jobs'][0], finished_job)
+        self.assertFalse(os.path.exists(run.journal_path(suite_file)))
+
+    def testSlurmWait(self):
+        from . import run
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        create_test_suite(suite_file)
+        create_fake_slurm(tmpdir)
+
+        old_argv = sys.argv[:]
+        old_path = os.environ['PATH']
+        sys.argv[:] = [old_argv[0], suite_file, "--slurm", "--wait", "--wait-interval", "0.01"]
+        os.environ['PATH'] = "%s%s%s" % (tmpdir, os.pathsep, old_path)
+        try:
+            run.main()
+        finally:
+            sys.argv = old_argv
+            os.environ['PATH'] = old_path
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            for cmd in suite['cmd_list']:
+                for job in cmd['jobs']:
+                    self.assertEqual(job['status'], 'finished')
+        # All jobs are checked using a single `squeue` call per pass
+        with open(join(tmpdir, "squeue_calls"), "r") as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def testSlurmWaitRetry(self):
+        from . import run
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        create_test_suite(suite_file)
+        create_fake_slurm(tmpdir, squeue_failures=2)
+
+        old_argv = sys.argv[:]
+        old_path = os.environ['PATH']
+        sys.argv[:] = [old_argv[0], suite_file, "--slurm", "--wait", "--wait-interval", "0.01"]
+        os.environ['PATH'] = "%s%s%s" % (tmpdir, os.pathsep, old_path)
+        try:
+            run.main()
+        finally:
+            sys.argv = old_argv
+            os.environ['PATH'] = old_path
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            for cmd in suite['cmd_list']:
+                for job in cmd['jobs']:
+                    self.assertEqual(job['status'], 'finished')
+        # The failed `squeue` calls are retried at the next interval
+        with open(join(tmpdir, "squeue_calls"), "r") as f:
+            self.assertEqual(len(f.readlines()), 4)
+
+    def testSlurmArray(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        create_test_suite(suite_file)
+        create_fake_slurm(tmpdir)
+
+        old_argv = sys.argv[:]
+        old_path = os.environ['PATH']
+        sys.argv[:] = [old_argv[0], suite_file, "--slurm", "--array", "--nruns", "2",
+                       "--wait", "--wait-interval", "0.01"]
+        os.environ['PATH'] = "%s%s%s" % (tmpdir, os.pathsep, old_path)
+        try:
+            run.main()
+        finally:
+            sys.argv = old_argv
+            os.environ['PATH'] = old_path
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            for cmd in suite['cmd_list']:
+                self.assertEqual(len(cmd['jobs']), 1)
+                self.assertEqual(cmd['jobs'][0]['status'], 'finished')
+                self.assertEqual(len(cmd['jobs'][0]['results']), 2)
+        # One submission per command
+        with open(join(tmpdir, "sbatch_calls"), "r") as f:
+            self.assertEqual(len(f.readlines()), len(suite['cmd_list']))
+
+        # SLURM decides the order of the tasks of an array
+        for extra in (["--multi-jobs"], ["--order", "round-robin"]):
+            sys.argv[:] = [old_argv[0], suite_file, "--slurm", "--array"] + extra
+            try:
+                with self.assertRaises(SystemExit):
+                    run.main()
+            finally:
+                sys.argv = old_argv
+
+    def testAdaptive(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        bp.create_suite([bp.command("echo elapsed-time: 1.0", "Stable"),
+                         bp.command("echo elapsed-time: 1$RANDOM", "Noisy")], suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--nruns", "2", "--adaptive", "--max-runs", "4"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            (stable, noisy) = suite['cmd_list']
+            self.assertEqual(sum(job['nruns'] for job in stable['jobs']), 2)
+            self.assertEqual(sum(job['nruns'] for job in noisy['jobs']), 4)
+            self.assertTrue(all(job['status'] == 'finished' for job in noisy['jobs']))
+
+
+class PerfCounters(unittest.TestCase):
+
+    def testParse(self):
+        from . import run
+        csv = "# started on Mon May 22 10:00:00 2017\n" \
+              "\n" \
+              "2000,,cycles,1000,100.00,,\n" \
+              "3000,,instructions,1000,100.00,1.50,insn per cycle\n" \
+              "<not supported>,,LLC-loads,0,100.00,,\n" \
+              "1.25,msec,task-clock,1250000,100.00,0.90,CPUs utilized\n"
+        perf = run.parse_perf_stat(csv)
+        self.assertEqual(perf, {'cycles': 2000, 'instructions': 3000, 'task-clock': 1.25})
+
+        # Modifiers are stripped and the counts of the PMUs of a hybrid CPU are summed
+        csv = "2000,,cpu_core/cycles/,1000,100.00,,\n" \
+              "500,,cpu_atom/cycles/u,1000,100.00,,\n" \
+              "3000,,instructions:u,1000,100.00,1.50,insn per cycle\n" \
+              "10,,cpu_core/cache-misses/,1000,100.00,,\n" \
+              "<not counted>,,cpu_atom/cache-misses/,0,0.00,,\n"
+        perf = run.parse_perf_stat(csv)
+        self.assertEqual(perf, {'cycles': 2500, 'instructions': 3000, 'cache-misses': 10})
+        self.assertEqual(run.perf_event_name("cpu_atom/branch-misses/uk"), "branch-misses")
+        self.assertEqual(run.perf_event_name("cycles:ukpp"), "cycles")
+
+    def testCli(self):
+        from .visualizer import util
+        cmd = {'jobs': [{'results': [
+            {'success': True, 'perf': {'cycles': 100, 'instructions': 150,
+                                       'cache-references': 10, 'cache-misses': 1}},
+            {'success': True, 'perf': {'cycles': 100}},
+        ]}]}
+        self.assertEqual(util.extract_succeed_perf(cmd, util.instructions_per_cycle), [1.5])
+        self.assertEqual(util.extract_succeed_perf(cmd, util.cache_miss_rate), [0.1])
+
+
+class DataStore(unittest.TestCase):
+
+    def testRoundTrip(self):
+        from . import datastore
+        import numpy as np
+        tmpdir = tempfile.mkdtemp()
+        arrays = {'grid': np.arange(12, dtype=np.float64).reshape(3, 4).T, 'n': 42,
+                  'empty': np.zeros((0, 3), dtype=np.int32), 'a/b': np.ones(5, dtype=np.uint8)}
+        for compress in (False, True):
+            path = join(tmpdir, "store-%s" % compress)
+            digest = datastore.save(path, arrays, compress=compress, chunk_size=16)
+            self.assertTrue(datastore.is_store(path))
+            loaded = datastore.load(path)
+            self.assertEqual(sorted(loaded.keys()), sorted(arrays.keys()))
+            for key, value in arrays.items():
+                self.assertTrue(np.array_equal(loaded[key], value))
+                self.assertEqual(type(loaded[key]), type(value))
+                if isinstance(value, np.ndarray):
+                    self.assertEqual(loaded[key].dtype, value.dtype)
+            loaded['grid'][0, 0] = -1  # Copy-on-write
+            self.assertEqual(datastore.load(path)['grid'][0, 0], 0)
+
+            # Identical content isn't rewritten
+            mtime = os.path.getmtime(join(path, datastore.MANIFEST))
+            self.assertEqual(datastore.save(path, arrays, compress=compress), digest)
+            self.assertEqual(os.path.getmtime(join(path, datastore.MANIFEST)), mtime)
+            self.assertNotEqual(datastore.save(path, {'n': 43}), digest)
+            self.assertEqual(list(datastore.load(path).keys()), ['n'])
+
+        # Files and directories that aren't stores are never replaced
+        notes = join(tmpdir, "notes")
+        os.makedirs(notes)
+        open(join(notes, "notes.txt"), "w").close()
+        for path in (notes, join(notes, "notes.txt")):
+            with self.assertRaises(ValueError):
+                datastore.save(path, arrays)
+        self.assertEqual(os.listdir(notes), ["notes.txt"])
+
+    def testCache(self):
+        from . import datastore
+        import numpy as np
+        tmpdir = tempfile.mkdtemp()
+        cache = datastore.Cache(join(tmpdir, "cache"), 2500)
+        self.assertIsNone(cache.get(["a"]))
+        cache.put(["a"], {'x': np.zeros(100), 'lx': 10, 'none': None})
+        cached = cache.get(["a"])
+        self.assertEqual((cached['lx'], cached['none']), (10, None))
+        self.assertTrue(np.array_equal(cached['x'], np.zeros(100)))
+        for key, last_use in ((["b"], 1000), (["a"], 2000)):  # "b" is the least recently used when "c" is added
+            if cache.get(key) is None:
+                cache.put(key, {'x': np.zeros(100)})
+            os.utime(cache.path(key), (last_use, last_use))
+        cache.put(["c"], {'x': np.zeros(100)})
+        self.assertIsNotNone(cache.get(["a"]))
+        self.assertIsNone(cache.get(["b"]))
+        self.assertIsNotNone(cache.get(["c"]))
+
+    def testCachedInput(self):
+        from . import util
+        import numpy as np
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], "--size=10", "--input-cache", join(tempfile.mkdtemp(), "cache")]
+        B = util.Benchmark()
+        sys.argv = old_argv
+        calls = []
+
+        def generator():
+            calls.append(1)
+            return np.arange(10)
+        for _ in range(2):
+            self.assertTrue(np.array_equal(B.cached_input("input", generator), np.arange(10)))
+        self.assertEqual(len(calls), 1)
+        cached = B.cached_input("input", generator)
+        self.assertFalse(isinstance(cached.base, np.memmap))  # Read into memory
+        mapped = B.cached_input("input", generator, mmap_mode='c')
+        self.assertTrue(isinstance(mapped.base, np.memmap))
+        self.assertTrue(np.array_equal(mapped, np.arange(10)))
+        self.assertEqual(len(calls), 1)
+
+    def testArrays(self):
+        from . import util
+        import numpy as np
+        tmpdir = tempfile.mkdtemp()
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], "--size=4*5", "--dtype=float32"]
+        B = util.Benchmark()
+        sys.argv = old_argv
+        ary = np.arange(40, dtype=np.float64).reshape(8, 5)[::2].T  # Non-contiguous
+        fname = B.dump_arrays(join(tmpdir, "test"), {'input': ary})
+        self.assertEqual(fname, join(tmpdir, "test_4x5_float32"))
+        self.assertTrue(np.array_equal(B.load_array(fname), ary))
+        self.assertEqual(B.load_array(fname, dtype=np.float32).dtype, np.float32)
+        B.tofile(join(tmpdir, "legacy.npz"), {'res': ary})
+        self.assertTrue(np.array_equal(B.load_arrays(join(tmpdir, "legacy.npz"))['res'], ary))
+
+    def testBenchmark(self):
+        from .suite_util import BP_ROOT
+        from subprocess import check_output
+        tmpdir = tempfile.mkdtemp()
+        store = join(tmpdir, "heat")
+        script = join(BP_ROOT, "benchmarks", "heat_equation", "python_numpy", "heat_equation.py")
+        for extra in (["--outputfn", store], ["--inputfn", store, "--outputfn", store + "-2", "--compress-data"]):
+            check_output([sys.executable, script, "--size=20*20*5"] + extra)
+        from . import datastore
+        import numpy as np
+        self.assertEqual(datastore.load(store)['grid'].shape, (22, 22))
+        self.assertFalse(np.array_equal(datastore.load(store)['grid'], datastore.load(store + "-2")['grid']))
+
+
+class Validation(unittest.TestCase):
+
+    def testCompare(self):
+        from .validation import digest, compare
+        import numpy as np
+        ary = np.linspace(-1, 1, 1000)
+        ref = digest({'res': ary, 'count': np.arange(10)})
+        self.assertEqual(compare(digest({'res': ary, 'count': np.arange(10)}), ref), [])
+        # Within the float32 tolerance but not within the float64 tolerance of the norm, min, and max
+        self.assertEqual(compare(digest({'res': ary.astype(np.float32), 'count': np.arange(10)}), ref), [])
+        self.assertEqual(len(compare(digest({'res': ary * (1 + 1e-6), 'count': np.arange(10)}), ref)), 3)
+        self.assertEqual(len(compare(digest({'res': ary, 'count': np.arange(1, 11)}), ref)), 1)
+        self.assertEqual(len(compare(digest({'res': ary[:10]}), ref)), 2)
+
+    def testDigestChunks(self):
+        from . import validation
+        import hashlib
+        import numpy as np
+        arrays = {'grid': np.arange(60, dtype=np.float32).reshape(6, 10)[:, ::3].T,
+                  'nan': np.array([1.0, np.nan, np.inf, -2.0] * 5), 'cplx': np.arange(10) * 1j,
+                  'flags': np.arange(12).reshape(3, 4) % 2 == 0}
+        whole = validation.digest(arrays)
+        for key, ary in arrays.items():
+            self.assertEqual(whole[key]['sha256'], hashlib.sha256(ary.tobytes()).hexdigest())
+        old_chunk = validation.CHUNK_ELEMENTS
+        validation.CHUNK_ELEMENTS = 3
+        try:
+            chunked = validation.digest(arrays)
+        finally:
+            validation.CHUNK_ELEMENTS = old_chunk
+        self.assertEqual(chunked, whole)
+        self.assertEqual(whole['nan']['nonfinite'], 10)
+        self.assertEqual((whole['nan']['min'], whole['nan']['max'], whole['nan']['sum']), (-2.0, 1.0, -5.0))
+
+    def testReferenceKey(self):
+        from .validation import reference_key
+        record = {'script': "/x/heat_equation.py", 'size': [10, 10, 5], 'dtype': "float64", 'seed': 42}
+        self.assertEqual(reference_key(record), "heat_equation.py 10*10*5 float64 seed=42")
+        keys = set([reference_key(record), reference_key(dict(record, seed=1)),
+                    reference_key(dict(record, inputfn="heat_10x10x5_float64")),
+                    reference_key(dict(record, arguments={'--delta-interval': 10})),
+                    reference_key(dict(record, arguments={'--inplace': True, '--delta-interval': 10},
+                                       output_neutral=['--inplace']))])
+        self.assertEqual(len(keys), 4)
+        # Output-neutral options, such as the tiling, share the reference of the plain kernel
+        tiled = dict(record, arguments={'--tiled': True, '--tile-rows': 4}, output_neutral=['--tile-rows', '--tiled'])
+        self.assertEqual(reference_key(tiled), reference_key(record))
+
+    def testRun(self):
+        from . import run
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        reference = join(tmpdir, "reference.json")
+        for i in range(2):
+            suite_file = join(tmpdir, "res-%d.json" % i)
+            create_test_suite(suite_file)
+            old_argv = sys.argv[:]
+            sys.argv[:] = [old_argv[0], suite_file, "--nruns", "2", "--reference", reference]
+            run.main()
+            sys.argv = old_argv
+            with open(suite_file, "r") as f:
+                suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            bean = [cmd for cmd in suite['cmd_list'] if cmd['label'].startswith("Bean")][0]
+            status = [res['validation']['status'] for res in bean['jobs'][0]['results']]
+            self.assertEqual(status, ["new", "passed"] if i == 0 else ["failed", "failed"])
+            # Corrupt the references thus the second suite fails
+            with open(reference, "r") as f:
+                refs = json.load(f)
+            for ref in refs.values():
+                ref['res']['sha256'] = ""
+                ref['res']['sum'] += 1
+            with open(reference, "w") as f:
+                json.dump(refs, f)
+
+
+class Benchmarks(unittest.TestCase):
+
+    def testHeatEquationInplace(self):
+        from .validation import compare
+        from subprocess import CalledProcessError
+        records = [run_benchmark("heat_equation", "20*20*5000", *extra)
+                   for extra in ([], ["--inplace"], ["--inplace", "--delta-interval", "10"])]
+        self.assertLess(records[0]['iterations'], 5000)  # Converged before the max iterations
+        self.assertEqual(compare(records[1]['output'], records[0]['output']), [])
+        self.assertEqual(records[1]['iterations'], records[0]['iterations'])
+        # Checking the delta every K iterations runs up to K-1 iterations more
+        self.assertGreaterEqual(records[2]['iterations'] - records[0]['iterations'], 0)
+        self.assertLess(records[2]['iterations'] - records[0]['iterations'], 10)
+        with self.assertRaises(CalledProcessError):
+            run_benchmark("heat_equation", "20*20*10", "--inplace", "--delta-interval", "0")
+
+    @unittest.skipIf(sys.version_info < (3, 8), "requires multiprocessing.shared_memory")
+    def testHeatEquationProcesses(self):
+        records = [run_benchmark("heat_equation", "20*20*5000", *extra) for extra in ([], ["--processes", "3"])]
+        self.assertLess(records[0]['iterations'], 5000)  # Converged before the max iterations
+        self.assertEqual(records[1]['output'], records[0]['output'])
+        self.assertEqual(records[1]['iterations'], records[0]['iterations'])
+        self.assertEqual(records[1]['work'], records[0]['work'])
+        self.assertEqual(records[1]['metrics']['processes'], 3)
+
+    def testNbodyTiled(self):
+        records = [run_benchmark("nbody", "50*3", *extra) for extra in ([], ["--tiled", "--tile-rows", "7"])]
+        self.assertEqual(records[1]['output'], records[0]['output'])
+        self.assertEqual(records[1]['metrics']['tile_rows'], 7)
+
+    def testTiledValidation(self):
+        from .validation import References
+        refs = References(join(tempfile.mkdtemp(), "references.json"))
+        plain = run_benchmark("heat_equation", "20*20*10")
+        tiled = run_benchmark("heat_equation", "20*20*10", "--tiled", "--tile-rows", "4")
+        self.assertEqual(tiled['arguments'], {'--tiled': True, '--tile-rows': 4})
+        self.assertEqual(refs.validate(plain)['status'], 'new')
+        self.assertEqual(refs.validate(tiled)['status'], 'passed')
+        # A wrong tiled kernel fails against the reference of the plain kernel
+        tiled['output']['grid'].update(sha256="0" * 64, sum=tiled['output']['grid']['sum'] + 1)
+        self.assertEqual(refs.validate(tiled)['status'], 'failed')
+
+    def testNbodyBarnesHut(self):
+        (exact, approx) = [run_benchmark("nbody_barnes_hut", "500*2*%d" % theta)['metrics'] for theta in (0, 50)]
+        self.assertEqual(exact['interactions_per_body'], 499)
+        self.assertLess(exact['force_error_max'], 1e-10)
+        self.assertLess(approx['interactions_per_body'], exact['interactions_per_body'])
+        self.assertGreater(approx['force_error_rms'], exact['force_error_rms'])
+        self.assertLess(approx['force_error_rms'], 0.05)
+
+
+class UtilBenchmark(unittest.TestCase):
+
+    def testIterationStats(self):
+        from .util import iteration_stats
+        samples = [50, 20] + [10] * 98
+        stats = iteration_stats(samples)
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['min'], 10e-9)
+        self.assertEqual(stats['median'], 10e-9)
+        self.assertEqual(stats['warmup_iterations'], 2)
+        self.assertAlmostEqual(stats['warmup_excess'], 50e-9)
+
+    def testWork(self):
+        from . import util
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], "--size=10"]
+        B = util.Benchmark()
+        sys.argv = old_argv
+        B.work(flops=100, nbytes=50)
+        B.work(flops=10, elements=2, per_iteration=True)
+        B.start()
+        B.do_while(lambda: None, 3)
+        B.stop()
+        record = B.record()
+        self.assertEqual(record['work'], {'flops': 130, 'bytes': 50, 'elements': 6, 'intensity': 2.6})
+        self.assertAlmostEqual(record['throughput']['gflops'], 130 / 1e9 / record['elapsed'])
+
+    def testTiledStencil(self):
+        from . import util
+        import numpy as np
+        grid = np.arange(60, dtype=np.float64).reshape(12, 5) ** 2
+        expect = grid.copy()
+        expect[1:-1] = (grid[:-2] + grid[1:-1] + grid[2:]) / 3
+
+        def tile(start, stop):
+            new = (grid[start:stop] + grid[start + 1:stop + 1] + grid[start + 2:stop + 2]) / 3
+
+            def write():
+                grid[start + 1:stop + 1] = new
+            return write
+        util.tiled_stencil(tile, 10, 3)
+        self.assertTrue(np.array_equal(grid, expect))
+        self.assertEqual(util.tile_rows(1024, 4, cache_bytes=64 * 1024), 8)
+        self.assertEqual(util.tile_rows(1024 ** 2, 4, cache_bytes=64 * 1024), 1)
+
+    def testRegion(self):
+        import time
+        from . import util
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], "--size=10"]
+        B = util.Benchmark()
+        sys.argv = old_argv
+
+        @B.region("decorated")
+        def func(x):
+            return x + 1
+
+        @B.region("recursive")
+        def fib(n):
+            return n if n < 2 else fib(n - 1) + fib(n - 2)
+        start = time.time()
+        for i in range(3):
+            with B.region("outer"):
+                with B.region("outer", flush=True):  # Nested within itself
+                    self.assertEqual(func(i), i + 1)
+                    self.assertEqual(fib(10), 55)
+        elapsed = time.time() - start
+        regions = B.record()['regions']
+        self.assertEqual(regions['decorated']['calls'], 3)
+        self.assertEqual(regions['outer']['calls'], 3)  # Only the outermost entries count
+        self.assertEqual(regions['recursive']['calls'], 3)
+        self.assertGreaterEqual(regions['outer']['elapsed'], regions['decorated']['elapsed'])
+        self.assertGreaterEqual(regions['outer']['elapsed'], regions['recursive']['elapsed'])
+        self.assertLessEqual(regions['outer']['elapsed'], elapsed)
+        self.assertLessEqual(regions['recursive']['elapsed'], elapsed)
+
+    def testSingleton(self):
+        from . import util
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], "--size=10"]
+        B = util.get_benchmark()
+        sys.argv = old_argv
+        self.assertIs(util.get_benchmark(), B)
+        self.assertEqual(util.is_bohrium(), B.bohrium)
+        util.flush()
+
+    def testIterationTiming(self):
+        from . import run
+        from .suite_util import BP_ROOT
+        from . import suite_schema
+        tmpdir = tempfile.mkdtemp()
+        suite_file = join(tmpdir, "res.json")
+        script = join(BP_ROOT, "benchmarks", "heat_equation", "python_numpy", "heat_equation.py")
+        bp.create_suite([bp.command("python %s --size=50*50*20 --iteration-timing" % script, "Heat")], suite_file)
+
+        old_argv = sys.argv[:]
+        sys.argv[:] = [old_argv[0], suite_file, "--nruns", "1"]
+        run.main()
+        sys.argv = old_argv
+        with open(suite_file, "r") as f:
+            suite = json.load(f)
+            jsonschema.validate(suite, suite_schema)
+            result = suite['cmd_list'][0]['jobs'][0]['results'][0]
+            self.assertIn("iteration-time - count: 20", result['stdout'])
+            stats = result['record']['iteration_times']
+            self.assertEqual(stats['count'], 20)
+            self.assertLessEqual(stats['min'], stats['median'])
+            self.assertLessEqual(stats['median'], stats['p99'])
+            self.assertLessEqual(stats['count'] * stats['min'], result['record']['elapsed'])
+
+
 class BP(unittest.TestCase):
 
     def setUp(self):
@@ -90,6 +887,42 @@ class BP(unittest.TestCase):
         sys.argv = [old_argv[0], self.suite_file, "--csv"]
         cli.main()
 
+    def testCliRusage(self):
+        from .visualizer import cli
+        old_argv = sys.argv
+        sys.argv = [old_argv[0], self.suite_file, "--rusage"]
+        cli.main()
+        sys.argv = old_argv
+
+    def testCliMetric(self):
+        from .visualizer import cli
+        from .visualizer import util as vutil
+        output_file = join(self.tmpdir, "metric.txt")
+        old_argv = sys.argv
+        sys.argv = [old_argv[0], self.suite_file, "--metric", "gflops", "-o", output_file]
+        cli.main()
+        sys.argv = old_argv
+        with open(output_file, "r") as f:
+            output = f.read()
+        args = vutil.default_argparse("test").parse_args([self.suite_file, "--metric", "gflops"])
+        with open(self.suite_file, "r") as f:
+            suite = json.load(f)
+        bean = [cmd for cmd in suite['cmd_list'] if cmd['label'].startswith("Bean")][0]
+        gflops = vutil.extract_succeed_values(bean, args)
+        self.assertEqual(len(gflops), 3)
+        self.assertGreater(min(gflops), 0)
+        self.assertIn(" %.4f" % vutil.mean(gflops), output)
+        self.assertEqual(vutil.value_label(args), "GFLOP/s")
+
+    def testRusage(self):
+        with open(self.suite_file, "r") as f:
+            suite = json.load(f)
+        for cmd in suite['cmd_list']:
+            for job in cmd['jobs']:
+                for res in job['results']:
+                    self.assertGreater(res['rusage']['maxrss'], 0)
+                    self.assertGreaterEqual(res['rusage']['wall'], 0)
+
     def testJSON(self):
         from . import suite_schema
         with open(self.suite_file, "r") as f:
@@ -3,9 +3,15 @@ import argparse
 import pprint
 import time
 import sys
+import os
+import json
+import functools
 import numpy as np
 import atexit
 import gzip
+from benchpress import datastore
+from benchpress import validation
+from benchpress.visualizer.util import RECORD_PREFIX, RECORD_ENV
 
 gfx_handle = None
 
@@ -31,6 +37,43 @@ class VisualArgs:
 
 _visual_args = None  # When None, no visualization
 
+_benchmark = None  # The process-wide Benchmark, see `get_benchmark()`
+
+# High-resolution monotonic timer in nanoseconds
+if hasattr(time, "perf_counter_ns"):
+    _timer_ns = time.perf_counter_ns
+else:
+    _timer_clock = getattr(time, "perf_counter", time.time)
+
+    def _timer_ns():
+        return int(_timer_clock() * 1e9)
+
+# Leading iterations slower than WARMUP_FACTOR times the steady-state median are warm-up iterations
+WARMUP_FACTOR = 1.5
+
+
+def iteration_stats(samples_ns):
+    """Return the statistics of the per-iteration times `samples_ns` (in nanoseconds) as a dict of seconds
+
+    The steady-state time is the median of the last half of the iterations. The warm-up transient is the
+    leading iterations that are slower than `WARMUP_FACTOR` times the steady-state time, e.g. because of
+    JIT compilation, and the time they spent in excess of the steady-state time.
+    """
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1e9
+    steady = float(np.median(samples[len(samples) // 2:]))
+    slow = samples > steady * WARMUP_FACTOR
+    nwarmup = len(samples) if slow.all() else int(np.argmin(slow))
+    return {
+        "count": len(samples),
+        "min": float(samples.min()),
+        "median": float(np.median(samples)),
+        "p95": float(np.percentile(samples, 95)),
+        "p99": float(np.percentile(samples, 99)),
+        "steady": steady,
+        "warmup_iterations": nwarmup,
+        "warmup_excess": float((samples[:nwarmup] - steady).sum()),
+    }
+
 
 def numpy_flush():
     return
@@ -143,14 +186,14 @@ try:
     from bohrium import visualization
 
     toarray = bh.array
-    flush = bh.flush
+    bh_flush = bh.flush
     rand = bh.random.random_sample
     randint = bh.random.random_integers
     randseed = bh.random.seed
     bh_module_exist = True
 except ImportError:
     toarray = numpy_array
-    flush = numpy_flush
+    bh_flush = numpy_flush
     rand = np.random.random_sample
     randint = np.random.random_integers
     randseed = np.random.seed
@@ -174,21 +217,103 @@ def t_or_f(arg):
         return arg
 
 
+def _json_default(obj):
+    """Convert NumPy scalars and arrays, such as user metrics, into JSON serializable objects"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+# The key of a cached input that is an array and not a dict
+_CACHED_ARRAY = "__array__"
+
+
+def _to_bohrium(arrays, bhary_keys):
+    """Convert the arrays of `bhary_keys` in the dict `arrays` into Bohrium arrays when running through Bohrium"""
+    if bh_is_loaded_as_np:
+        for k in bhary_keys:
+            arrays[k] = bh.array(arrays[k], bohrium=True)
+    return arrays
+
+
+def _load_store(path):
+    """Load the data store `path` (see `benchpress.datastore`) with the Bohrium arrays as Bohrium arrays"""
+    return _to_bohrium(datastore.load(path), datastore.bohrium_keys(path))
+
+
+class Region(object):
+    """Times a named region of a benchmark, see `Benchmark.region()`
+
+    Use it as a context manager (`with B.region("name"):`) or as a function decorator (`B.region("name")(func)`).
+    The time and the number of calls accumulate in `stats`, which is `[nanoseconds, calls, depth, start]` and
+    shared by all regions of the same name. A region nested within itself (e.g. a recursive function) only counts
+    when its outermost entry exits thus its time isn't counted twice.
+    """
+
+    def __init__(self, stats, flush=None):
+        self.stats = stats
+        self.flush = flush
+
+    def __enter__(self):
+        if self.flush is not None:
+            self.flush()
+        if self.stats[2] == 0:
+            self.stats[3] = _timer_ns()
+        self.stats[2] += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.flush is not None:
+            self.flush()
+        self.stats[2] -= 1
+        if self.stats[2] == 0:
+            self.stats[0] += _timer_ns() - self.stats[3]
+            self.stats[1] += 1
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
 class Benchmark:
     """
     Helper class to aid running Python/NumPy programs with and without npbackend.
 
     Use it to sample elapsed time using: start()/stop()
     Pretty-prints results using pprint().
+    With --json-record, pprint() also prints the results as a JSON record, which `bp-run` stores in the suite.
+    Use region() to time the phases of the benchmark individually.
     start()/stop() will send flush signals to npbackend, ensuring that only
     the statements in-between start() and stop() are measured.
+
+    Parameters
+    ----------
+    add_arguments : function
+        Called with an `argparse` argument group to add the options of the benchmark script, which are
+        then available in `args` like the Benchpress options. Mark the options that don't change the output,
+        such as `--tiled`, using `output_neutral()`.
     """
 
-    def __init__(self):
-        global _visual_args
+    def __init__(self, add_arguments=None):
+        global _visual_args, _benchmark
 
         self.__elapsed = 0.0  # The quantity measured
         self.__script = sys.argv[0]  # The script being run
+        self.__start = 0  # The timer value at start()
+        self.__iterations = None  # The number of iterations executed by do_while()
+        self.__iteration_ns = None  # The time of each iteration of do_while() in nanoseconds
+        self.__metrics = {}  # The user metrics of the JSON record
+        self.__regions = {}  # Maps region names to the `Region.stats` `[nanoseconds, calls, depth, start]`
+        self.__output = {}  # The digests of the saved arrays, see `benchpress.validation`
+        self.__work = {}  # The work model of the timed region, see `work()`
+        self.__work_per_iteration = {}  # The work model of each iteration of do_while()
+        self.__max_iterations = None  # The maximum number of iterations of do_while()
+        self.__printed = False  # Whether pprint() has printed the JSON record
+        self.__region_objs = {}  # Maps `(name, flush)` to the `Region` object
 
         # Construct argument parser
         p = argparse.ArgumentParser(description='Benchmark runner for npbackend.')
@@ -208,17 +333,38 @@ class Benchmark:
                        )
         p.add_argument('--inputfn',
                        default=None,
-                       help="Input file to use as data.",
+                       help="Input data store or npz archive to use as data.",
                        metavar="FILE",
                        type=str,
                        )
         p.add_argument('--outputfn',
                        default=None,
-                       help="Output file to store results in (.npz extension will "
-                            "be appended to the file name if it is not already there).",
+                       help="Output data store (a directory of .npy files) to store results in or, "
+                            "when FILE ends with '.npz', a npz archive.",
                        metavar="FILE",
                        type=str,
                        )
+        p.add_argument('--input-cache',
+                       default=os.environ.get("BP_INPUT_CACHE"),
+                       metavar="DIR",
+                       help="Cache the generated inputs in DIR (default: $BP_INPUT_CACHE or no caching)."
+                       )
+        p.add_argument('--input-cache-size',
+                       default=float(os.environ.get("BP_INPUT_CACHE_SIZE", 4096)),
+                       type=float,
+                       metavar="MiB",
+                       help="Evict the least recently used inputs when the cache exceeds MiB "
+                            "(default: $BP_INPUT_CACHE_SIZE or %(default)s)."
+                       )
+        p.add_argument('--dumpinput',
+                       default=False,
+                       action='store_true',
+                       help="Dump the input arrays to a data store named after the benchmark, size, and dtype."
+                       )
+        p.add_argument('--compress-data',
+                       action='store_true',
+                       help="Compress the output data stores in chunks, e.g. for archival."
+                       )
         p.add_argument('--bohrium',
                        choices=[True, False],
                        default=False,
@@ -269,8 +415,45 @@ class Benchmark:
                        action='store_true',
                        help="Disable Bohrium's optimized `do_while`."
                        )
+        p.add_argument('--flush-regions',
+                       action='store_true',
+                       help="Flush at the boundaries of all timing regions thus the time of the queued "
+                            "instructions is attributed to the region that queued them."
+                       )
+        p.add_argument('--iteration-timing',
+                       action='store_true',
+                       help="Time each iteration of `do_while`, which then runs as a Python loop "
+                            "also with Bohrium."
+                       )
+        p.add_argument('--json-record',
+                       default=os.environ.get(RECORD_ENV) == '1',
+                       action='store_true',
+                       help="Print the results as a JSON record as well (default when %s=1)." % RECORD_ENV
+                       )
+        p.add_argument('--digest-output',
+                       default=os.environ.get(validation.DIGEST_ENV) == '1',
+                       action='store_true',
+                       help="Add a digest of the output to the JSON record, which `bp-run --reference` validates. "
+                            "Without --outputfn, the output is digested but not saved (default when %s=1)."
+                            % validation.DIGEST_ENV
+                       )
+
+        script_actions = []
+        if add_arguments is not None:
+            group = p.add_argument_group("%s options" % os.path.basename(self.__script))
+            add_arguments(group)
+            script_actions = group._group_actions
 
         args, unknown = p.parse_known_args()  # Parse the arguments
+        # The script options that differ from their defaults, which the JSON record includes as 'arguments'
+        self.__script_args = {}
+        self.__neutral_args = []  # The ones of them that don't change the output, see `output_neutral()`
+        for action in script_actions:
+            value = getattr(args, action.dest)
+            if value != action.default:
+                self.__script_args[action.option_strings[-1]] = value
+                if getattr(action, 'output_neutral', False):
+                    self.__neutral_args.append(action.option_strings[-1])
 
         #
         # Conveniently expose options to the user
@@ -280,6 +463,9 @@ class Benchmark:
         self.dtype = eval("np.%s" % args.dtype)
         self.inputfn = args.inputfn
         self.outputfn = args.outputfn
+        if args.digest_output and self.outputfn is None:
+            self.outputfn = os.devnull
+        self.dumpinput = args.dumpinput
         self.seed = int(args.seed)
         randseed(self.seed)
 
@@ -293,50 +479,241 @@ class Benchmark:
 
         self.no_extmethods = args.no_extmethods
         self.verbose = args.verbose
+        self.json_record = args.json_record
         self.visualize = args.visualize
         if self.visualize:
             _visual_args = VisualArgs(args)
 
+        # The first Benchmark of the process is the process-wide Benchmark
+        if _benchmark is None:
+            _benchmark = self
+
     def start(self):
-        flush()
-        self.__elapsed = time.time()
+        bh_flush()
+        self.__start = _timer_ns()
 
     def stop(self):
-        flush()
-        self.__elapsed = time.time() - self.__elapsed
+        bh_flush()
+        self.__elapsed = (_timer_ns() - self.__start) / 1e9
+
+    def tofile(self, fname, arrays):
+        """Save the dict `arrays` to `fname`
+
+        The arrays are saved as a data store (see `benchpress.datastore`), which is compressed when --compress-data
+        is used, or as a npz archive when `fname` ends with '.npz'. The arrays are streamed to disk in chunks and
+        Bohrium arrays are copied to NumPy only once. With --digest-output, the digest of the arrays goes into the
+        JSON record and nothing is saved when `fname` is `os.devnull`.
+        """
+        assert (isinstance(arrays, dict))
+        (nobh_data, scalars, bhary_keys) = datastore.prepare(arrays)
+        nobh_data.update(scalars)
+        if self.args.digest_output:
+            self.__output.update(validation.digest(nobh_data))
+            if self.json_record and self.__printed:  # The last record printed is the record of the run
+                print(RECORD_PREFIX + json.dumps(self.record(), default=_json_default))
+        if fname == os.devnull:
+            return
+        if not fname.endswith(".npz"):
+            datastore.save(fname, nobh_data, compress=self.args.compress_data, bhary_keys=bhary_keys)
+        else:
+            np.savez_compressed(fname, _bhary_keys=sorted(bhary_keys), **nobh_data)
+
+    def dump_arrays(self, prefix, arrays):
+        """Save the dict `arrays`, such as the input of a benchmark, to a file named after `prefix`, size, and dtype
+
+        Returns the file name, which --inputfn accepts.
+        """
+        fname = "%s_%s_%s" % (prefix, "x".join(str(s) for s in self.size), self.args.dtype)
+        self.tofile(fname, arrays)
+        return fname
+
+    def load_arrays(self, fname=None):
+        """Load the dict of arrays of the data store or npz archive `fname` (default: --inputfn)
+
+        The arrays of an uncompressed data store are memory-mapped (copy-on-write) thus loading is near instant.
+        """
+        if fname is None:
+            fname = self.inputfn
+        if datastore.is_store(fname):
+            return _load_store(fname)
+        nobh_data = np.load(fname)
+        bhary_keys = nobh_data["_bhary_keys"].tolist() if "_bhary_keys" in nobh_data.files else []
+        ret = {k: nobh_data[k] for k in nobh_data.files if k != "_bhary_keys"}
+        return _to_bohrium(ret, bhary_keys)
+
+    def load_array(self, fname=None, key="input", dtype=None):
+        """Load the array `key` of the data store or npz archive `fname` (default: --inputfn), see `load_arrays()`
+
+        When `dtype` is set, the array is converted to `dtype`.
+        """
+        ret = self.load_arrays(fname)[key]
+        if dtype is not None and ret.dtype != dtype:
+            ret = ret.astype(dtype)
+        return ret
 
     def save_data(self, data_dict):
-        """Save `data_dict` as a npz archive when --outputfn is used"""
+        """Save `data_dict` when --outputfn is used, see `tofile()`"""
         assert (isinstance(data_dict, dict))
         if self.outputfn is not None:
-            # Clean `data_dict` for Bohrium arrays
-            nobh_data = {"_bhary_keys": []}
-            for k in data_dict.keys():
-                if hasattr(data_dict[k], "copy2numpy"):
-                    nobh_data[k] = data_dict[k].copy2numpy()
-                    nobh_data["_bhary_keys"].append(k)
-                else:
-                    nobh_data[k] = data_dict[k]
-            np.savez_compressed(self.outputfn, **nobh_data)
+            self.tofile(self.outputfn, data_dict)
 
     def load_data(self):
-        """Load the npz archive specified by --inputfn or None is not set"""
+        """Load the data store or npz archive specified by --inputfn or None is not set, see `load_arrays()`"""
         if self.inputfn is None:
             return None
-        else:
-            nobh_data = np.load(self.inputfn)
-            bhary_keys = nobh_data["_bhary_keys"].tolist()
-            ret = {}
-            for k in nobh_data.keys():
-                if k == "_bhary_keys":
-                    continue
-                # Convert numpy arrays into bohrium arrays
-                if bh_is_loaded_as_np and k in bhary_keys:
-                    a = nobh_data[k]
-                    ret[k] = bh.array(a, bohrium=True)
-                else:
-                    ret[k] = nobh_data[k]
+        return self.load_arrays()
+
+    def cached_input(self, name, generator, version=1, mmap_mode=None):
+        """Return the input that `generator()` generates, which is cached when --input-cache is used
+
+        The cache key is the script, `name`, size, dtype, seed, and `version`, thus bump `version` whenever
+        the generator changes. NB: on a cache hit, `generator()` isn't called thus it mustn't be used for its
+        side effects such as drawing from the random generator that the benchmark uses afterwards.
+        By default, a cached input is read into memory like a generated one thus the timed region doesn't pay
+        for page faults that only cache hits have.
+
+        Parameters
+        ----------
+        name : str
+            The name of the input
+        generator : function
+            Function that takes no arguments and returns an array or a dict of arrays and Python scalars
+        version : int
+            The version of the generator
+        mmap_mode : str
+            The memory-map mode of a cached input (see `datastore.load()`), e.g. 'c' for a copy-on-write
+            memory-map, or None to read it into memory
+
+        Returns
+        -------
+        input : array or dict
+            The return value of `generator()` or, on a cache hit, the cached copy of it
+        """
+        if self.args.input_cache is None:
+            return generator()
+        cache = datastore.Cache(self.args.input_cache, int(self.args.input_cache_size * 1024 * 1024))
+        key = [os.path.basename(self.__script), name, self.size, self.args.dtype, self.seed, version]
+        cached = cache.get(key, mmap_mode)
+        if cached is None:
+            ret = generator()
+            cache.put(key, ret if isinstance(ret, dict) else {_CACHED_ARRAY: ret})
             return ret
+        ret = _to_bohrium(cached, datastore.bohrium_keys(cache.path(key)))
+        return ret[_CACHED_ARRAY] if _CACHED_ARRAY in ret else ret
+
+    def region(self, name, flush=None):
+        """Return a `Region` that accumulates the time and number of calls of the region `name`
+
+        Parameters
+        ----------
+        name : str
+            The name of the region, regions with the same name accumulate together
+        flush : bool
+            Flush at the boundaries of the region (default: --flush-regions)
+
+        Returns
+        -------
+        region : Region
+            Context manager and function decorator
+
+        Example
+        -------
+        >>> with B.region("runAABB"):
+        ...     raydst = runAABB(scenegrid, rayudirs, rayorigin, rayinverse)
+        """
+        if flush is None:
+            flush = self.args.flush_regions
+        try:
+            return self.__region_objs[(name, flush)]
+        except KeyError:
+            ret = Region(self.__regions.setdefault(name, [0, 0, 0, 0]), self.flush if flush else None)
+            self.__region_objs[(name, flush)] = ret
+            return ret
+
+    def metric(self, name, value):
+        """Add the user metric `name` to the JSON record"""
+        self.__metrics[name] = value
+
+    def set_iterations(self, iterations):
+        """Set the number of iterations executed by the timed region, like `do_while()` does, for benchmarks that
+        execute their iterations without `do_while()`"""
+        self.__iterations = int(iterations)
+
+    def work(self, flops=None, nbytes=None, elements=None, per_iteration=False):
+        """Declare the work of the timed region, which the JSON record and pprint() report as throughput
+
+        Calls accumulate thus a benchmark can declare the work of each phase separately. The work of
+        `per_iteration=True` calls is multiplied by the number of iterations executed by `do_while()`, or by its
+        maximum number of iterations when Bohrium's `do_while()` executes the loop and the count is unknown.
+
+        Parameters
+        ----------
+        flops : int
+            The number of floating-point operations
+        nbytes : int
+            The number of bytes that must move to and from memory, e.g. reading the inputs and writing the
+            outputs once, which makes the arithmetic intensity of the JSON record comparable to a roofline
+        elements : int
+            The number of elements processed, e.g. grid points times iterations
+        """
+        work = self.__work_per_iteration if per_iteration else self.__work
+        for key, value in (("flops", flops), ("bytes", nbytes), ("elements", elements)):
+            if value is not None:
+                work[key] = work.get(key, 0) + value
+
+    def total_work(self):
+        """Return the total work declared by `work()` as a dict of 'flops', 'bytes', and 'elements'"""
+        ret = dict(self.__work)
+        iterations = self.__iterations if self.__iterations is not None else self.__max_iterations
+        if iterations is not None:
+            for key, value in self.__work_per_iteration.items():
+                ret[key] = ret.get(key, 0) + value * iterations
+        return ret
+
+    def throughput(self):
+        """Return the throughput of the work declared by `work()` as a dict of 'gflops' (GFLOP/s), 'gbytes' (GB/s),
+        and 'elements' (elements/s)"""
+        ret = {}
+        work = self.total_work()
+        if self.__elapsed > 0:
+            for key, name, scale in (("flops", "gflops", 1e9), ("bytes", "gbytes", 1e9), ("elements", "elements", 1)):
+                if key in work:
+                    ret[name] = work[key] / scale / self.__elapsed
+        return ret
+
+    def record(self):
+        """Return the results as a dict, which pprint() prints as a JSON record when --json-record is used"""
+        ret = {
+            "script": self.__script,
+            "size": self.size,
+            "dtype": self.args.dtype,
+            "backend": "bohrium" if self.bohrium else "numpy",
+            "seed": self.seed,
+            "elapsed": self.__elapsed,
+            "metrics": self.__metrics,
+        }
+        if len(self.__script_args) > 0:
+            ret["arguments"] = self.__script_args
+        if len(self.__neutral_args) > 0:
+            ret["output_neutral"] = sorted(self.__neutral_args)
+        if self.inputfn is not None:
+            ret["inputfn"] = os.path.basename(self.inputfn.rstrip(os.sep))
+        if self.__iterations is not None:
+            ret["iterations"] = self.__iterations
+        if self.__iteration_ns is not None and len(self.__iteration_ns) > 0:
+            ret["iteration_times"] = iteration_stats(self.__iteration_ns)
+        if len(self.__regions) > 0:
+            ret["regions"] = {name: {"elapsed": ns / 1e9, "calls": calls}
+                              for name, (ns, calls, _, _) in self.__regions.items()}
+        if len(self.__output) > 0:
+            ret["output"] = self.__output
+        work = self.total_work()
+        if len(work) > 0:
+            ret["work"] = work
+            if work.get("bytes", 0) > 0 and "flops" in work:  # The arithmetic intensity (roofline)
+                ret["work"]["intensity"] = work["flops"] / float(work["bytes"])
+            ret["throughput"] = self.throughput()
+        return ret
 
     def pprint(self):
         print("%s - bohrium: %s, size: %s, elapsed-time: %f" % (
@@ -345,6 +722,25 @@ class Benchmark:
             '*'.join([str(s) for s in self.size]),
             self.__elapsed
         ))
+        if self.__iteration_ns is not None and len(self.__iteration_ns) > 0:
+            stats = iteration_stats(self.__iteration_ns)
+            print("iteration-time - count: %d, min: %f, median: %f, p95: %f, p99: %f, "
+                  "warm-up: %d iterations (%f excess)" % (
+                      stats["count"], stats["min"], stats["median"], stats["p95"], stats["p99"],
+                      stats["warmup_iterations"], stats["warmup_excess"]
+                  ))
+        for name in sorted(self.__regions):
+            (ns, calls, _, _) = self.__regions[name]
+            print("region - %s: %f, calls: %d" % (name, ns / 1e9, calls))
+        if len(self.__metrics) > 0:
+            print("metrics - %s" % ", ".join("%s: %s" % (k, self.__metrics[k]) for k in sorted(self.__metrics)))
+        throughput = self.throughput()
+        if len(throughput) > 0:
+            print("throughput - %s" % ", ".join("%s: %g" % (label, throughput[name]) for name, label in (
+                ("gflops", "GFLOP/s"), ("gbytes", "GB/s"), ("elements", "elements/s")) if name in throughput))
+        if self.json_record:
+            print(RECORD_PREFIX + json.dumps(self.record(), default=_json_default))
+            self.__printed = True
 
     def random_array(self, shape, dtype=None):
         if dtype is None:
@@ -370,7 +766,8 @@ class Benchmark:
     def do_while(self, func, niters, *args, **kwargs):
         """Implements `bohrium.do_while()` for regular NumPy"""
 
-        if self.bohrium and not self.visualize and not self.args.no_do_while:
+        if self.bohrium and not self.visualize and not self.args.no_do_while and not self.args.iteration_timing:
+            self.__max_iterations = niters
             return bh.do_while(func, niters, *args, **kwargs)
 
         import sys
@@ -389,17 +786,181 @@ class Benchmark:
 
         func.__globals__['get_grid'] = lambda args: get_grid(args)
 
+        # The per-iteration times are written into a preallocated buffer, thus the loop doesn't allocate
+        samples = None
+        if self.args.iteration_timing:
+            samples = np.empty(1024 if niters is None else niters, dtype=np.int64)
+
         if niters is None:
             niters = sys.maxsize
         while i < niters:
+            if samples is not None:
+                tic = _timer_ns()
             cond = func(*args, **kwargs)
             if cond is not None and not cond:
                 break
             i += 1
             self.flush()
+            if samples is not None:
+                if i > len(samples):  # Only when `niters` is unknown
+                    samples = np.concatenate((samples, np.empty_like(samples)))
+                samples[i - 1] = _timer_ns() - tic
+        self.__iterations = i
+        if samples is not None:
+            self.__iteration_ns = samples[:i]
         return i
 
 
+def get_benchmark():
+    """Return the process-wide Benchmark, which is the first Benchmark created or, if none, a new Benchmark
+
+    Use this function, `flush()`, or `is_bohrium()` instead of creating a new Benchmark, which parses the
+    command line and reseeds the random generator, e.g. within the time-step loop of a benchmark.
+    """
+    if _benchmark is None:
+        Benchmark()
+    return _benchmark
+
+
+def is_bohrium():
+    """Return whether the numpy module is overruled by Bohrium"""
+    return bh_is_loaded_as_np
+
+
+def flush():
+    """Executes the queued instructions when running through Bohrium, see `Benchmark.flush()`"""
+    if bh_is_loaded_as_np:
+        get_benchmark().flush()
+
+
+# The cache size assumed by `tile_rows()` when the size of the caches is unknown
+DEFAULT_CACHE_SIZE = 1024 * 1024
+
+
+def cache_sizes():
+    """Return a dict that maps cache levels (e.g. 2 and 3) to the size in bytes of the data cache of the first CPU"""
+    ret = {}
+    base = "/sys/devices/system/cpu/cpu0/cache"
+    try:
+        names = os.listdir(base)
+    except OSError:
+        names = []
+    for name in names:
+        if not name.startswith("index"):
+            continue
+        info = {}
+        try:
+            for key in ("level", "type", "size"):
+                with open(os.path.join(base, name, key)) as f:
+                    info[key] = f.read().strip()
+            units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+            size = int(info['size'].rstrip("KMG")) * units.get(info['size'][-1], 1)
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+        if info['type'] != "Instruction":
+            ret[int(info['level'])] = max(ret.get(int(info['level']), 0), size)
+    if len(ret) == 0:  # E.g. not Linux, try the glibc extensions of `sysconf()`
+        for level in (2, 3):
+            try:
+                size = os.sysconf("SC_LEVEL%d_CACHE_SIZE" % level)
+            except (ValueError, OSError, AttributeError):
+                continue
+            if size > 0:
+                ret[level] = size
+    return ret
+
+
+def tile_rows(row_bytes, arrays=1, cache_bytes=None):
+    """Return the number of rows of a tile such that `arrays` arrays of the tile fit in half of the cache
+
+    Parameters
+    ----------
+    row_bytes : int
+        The number of bytes in a row of each array
+    arrays : int
+        The number of tile-sized arrays in use at once, e.g. the inputs, outputs, and temporaries of a stencil
+    cache_bytes : int
+        The cache size (default: the L2 cache or else the L3 cache or else `DEFAULT_CACHE_SIZE`)
+
+    Returns
+    -------
+    rows : int
+        The number of rows of a tile, at least one
+    """
+    if cache_bytes is None:
+        sizes = cache_sizes()
+        cache_bytes = sizes.get(2, sizes.get(3, DEFAULT_CACHE_SIZE))
+    return max(1, cache_bytes // 2 // max(1, row_bytes * arrays))
+
+
+def tiled_stencil(update, nrows, rows_per_tile):
+    """Apply a stencil with a halo of one row to `nrows` rows, `rows_per_tile` rows at a time
+
+    `update(start, stop)` must compute the new values of the rows `start:stop` from the old values of the rows
+    `start-1:stop+1` and return a function that writes the new values. The new values of a tile are written when
+    the next tile has been computed thus every tile reads old values only, like a stencil of the whole grid.
+    """
+    pending = None
+    for start in range(0, nrows, rows_per_tile):
+        write = update(start, min(start + rows_per_tile, nrows))
+        if pending is not None:
+            pending()
+        pending = write
+    if pending is not None:
+        pending()
+
+
+def bandwidth_gain(untiled, tiled, repeat=3):
+    """Return the best time of `untiled()` relative to the best time of `tiled()` over `repeat` calls each
+
+    When both functions move the same bytes, e.g. an iteration of a stencil with and without tiling, the ratio is
+    the gain in memory bandwidth of the tiled function.
+    """
+    best = []
+    for func in (untiled, tiled):
+        times = []
+        for _ in range(repeat):
+            bh_flush()
+            tic = _timer_ns()
+            func()
+            bh_flush()
+            times.append(_timer_ns() - tic)
+        best.append(max(min(times), 1))
+    return best[0] / float(best[1])
+
+
+def output_neutral(action):
+    """Mark the script option `action`, which `add_argument()` returns, as one that doesn't change the output
+
+    E.g. an option that selects an optimized kernel. The reference key of a run (see
+    `validation.reference_key()`) leaves such options out thus the run is validated against the plain kernel.
+    Returns `action`.
+    """
+    action.output_neutral = True
+    return action
+
+
+def add_tiling_arguments(group):
+    """Add the options of tiled kernels, `--tiled` and `--tile-rows`, to the `argparse` argument `group`
+
+    Pass it to `Benchmark` (or call it from the `add_arguments` function of the benchmark).
+    The options are `output_neutral()`.
+    """
+    output_neutral(group.add_argument('--tiled',
+                                      action='store_true',
+                                      help="Process the arrays in tiles of rows that fit in the cache. The stencils "
+                                           "report the bandwidth gain over the untiled grid as the "
+                                           "'tiled_bandwidth_gain' metric."
+                                      ))
+    output_neutral(group.add_argument('--tile-rows',
+                                      default=None,
+                                      type=int,
+                                      metavar='N',
+                                      help="The number of rows of each tile (default: derived from the L2 or L3 "
+                                           "cache size)."
+                                      ))
+
+
 def main():
     B = Benchmark()
     B.start()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of the output of benchmark runs against stored references.
+
+With `--digest-output` (default when `BP_OUTPUT_DIGEST=1`), `benchpress.util.Benchmark` computes a compact digest
+of each array it saves through `tofile()` or `save_data()` and adds it to the JSON record as 'output'. `bp-run
+--reference FILE` compares the digests of each run against the references in FILE, which maps the benchmark,
+size, dtype, seed, input, and output-changing script options of the run to a digest, see `reference_key()`. The
+digest of the first run without a reference becomes its reference.
+
+The digest of an array is its dtype, shape, SHA-256 checksum, and, for numeric arrays, statistics. Arrays that are
+bit-identical to the reference always pass. Otherwise, integer and boolean arrays fail whereas floating-point
+arrays pass when their statistics are within the relative tolerance of the less precise dtype of the two, see
+`TOLERANCES`.
+"""
+from __future__ import absolute_import
+import os
+import math
+import json
+import hashlib
+import threading
+
+# The environment variable that, when set to '1', makes `benchpress.util.Benchmark` digest its output
+DIGEST_ENV = "BP_OUTPUT_DIGEST"
+
+# The relative tolerance of the statistics of floating-point arrays by dtype kind and item size
+TOLERANCES = {
+    'f2': 1e-2,
+    'f4': 1e-4,
+    'f8': 1e-8,
+    'c8': 1e-4,
+    'c16': 1e-8,
+}
+
+# The relative tolerance of floating-point dtypes not in `TOLERANCES`, such as `float128`
+DEFAULT_TOLERANCE = 1e-8
+
+# The number of elements `digest()` processes at a time, which bounds the memory it uses besides the arrays
+CHUNK_ELEMENTS = 1024 * 1024
+
+
+def _chunks(ary):
+    """Yield the elements of `ary` in C order as 1-d arrays of about `CHUNK_ELEMENTS` elements
+
+    The chunks of a C-contiguous array are views, other arrays are copied one chunk of rows at a time.
+    """
+    import numpy as np
+    chunk_elements = CHUNK_ELEMENTS
+    if ary.ndim == 0 or ary.flags['C_CONTIGUOUS']:
+        flat = ary.reshape(-1)
+        for i in range(0, len(flat), chunk_elements):
+            yield flat[i:i + chunk_elements]
+    else:
+        rows = max(1, chunk_elements // max(1, ary[0].size))
+        for i in range(0, len(ary), rows):
+            yield np.ascontiguousarray(ary[i:i + rows]).reshape(-1)
+
+
+def digest(arrays):
+    """Return the digest of each array in the dict `arrays`
+
+    Parameters
+    ----------
+    arrays : dict
+        Maps keys to NumPy arrays or scalars
+
+    Returns
+    -------
+    digests : dict
+        Maps keys to dicts with the 'dtype', 'shape', and 'sha256' of the array and, for numeric arrays, the number
+        of NaN and infinite elements ('nonfinite') and the 'sum', 'norm' (L2), 'min', and 'max' of the finite
+        elements. The sum of complex arrays is a [real, imag] pair and they have no min and max.
+    """
+    import numpy as np
+    ret = {}
+    for key, ary in arrays.items():
+        ary = np.asarray(ary)
+        ret[key] = stats = {'dtype': ary.dtype.str, 'shape': list(ary.shape)}
+        numeric = ary.dtype.kind in 'biufc'
+        # The checksum of the bytes in C order and the statistics are computed one chunk at a time thus no
+        # complete copy of `ary` is made
+        h = hashlib.sha256()
+        (nonfinite, total, squares, low, high) = (0, 0, 0.0, None, None)
+        for chunk in _chunks(ary):
+            h.update(chunk.view(np.uint8))
+            if not numeric:
+                continue
+            if chunk.dtype.kind in 'fc':
+                finite = np.isfinite(chunk)
+                count = int(np.count_nonzero(finite))
+                if count < chunk.size:
+                    nonfinite += chunk.size - count
+                    chunk = chunk[finite]
+            if chunk.dtype.kind == 'c':
+                total += np.sum(chunk, dtype=np.complex128)
+                squares += float(np.sum(np.abs(chunk, dtype=np.float64) ** 2))
+            else:
+                chunk = chunk.astype(np.float64)
+                total += float(np.sum(chunk))
+                squares += float(np.dot(chunk, chunk))
+                if chunk.size > 0:
+                    (cmin, cmax) = (float(chunk.min()), float(chunk.max()))
+                    low = cmin if low is None else min(low, cmin)
+                    high = cmax if high is None else max(high, cmax)
+        stats['sha256'] = h.hexdigest()
+        if not numeric:
+            continue
+        stats['nonfinite'] = nonfinite
+        stats['norm'] = float(np.sqrt(squares))
+        if ary.dtype.kind == 'c':
+            total = complex(total)
+            stats['sum'] = [total.real, total.imag]
+        else:
+            stats['sum'] = float(total)
+            if low is not None:
+                stats['min'] = low
+                stats['max'] = high
+    return ret
+
+
+def tolerance(dtype_str):
+    """Return the relative tolerance of the dtype `dtype_str` (e.g. '<f8') or None when it must match exactly"""
+    (kind, itemsize) = (dtype_str[1], dtype_str[2:])
+    if kind not in 'fc':
+        return None
+    return TOLERANCES.get(kind + itemsize, DEFAULT_TOLERANCE)
+
+
+def _close(value, ref, tol):
+    """Return whether `value` is within the absolute tolerance `tol` of `ref`"""
+    if isinstance(ref, list):
+        return all(_close(v, r, tol) for v, r in zip(value, ref))
+    return abs(value - ref) <= tol
+
+
+def compare(output, reference):
+    """Compare the digests `output` with the digests `reference`, see `digest()`
+
+    The statistics of a floating-point array are within tolerance when their absolute difference to the reference is
+    at most `rtol * scale` where `rtol` is the tolerance of the less precise dtype. The scale of the norm is the
+    norm, of the min and max the larger of the value and the root mean square, and of the sum the norm times the
+    square root of the number of elements, which bounds the sum.
+
+    Returns
+    -------
+    errors : list of str
+        The differences from `reference`, which is empty when `output` is valid
+    """
+    ret = []
+    for key in sorted(reference):
+        ref = reference[key]
+        if key not in output:
+            ret.append("'%s' is missing" % key)
+            continue
+        out = output[key]
+        if out['shape'] != ref['shape']:
+            ret.append("'%s' has shape %s, expected %s" % (key, out['shape'], ref['shape']))
+            continue
+        if out['sha256'] == ref['sha256']:
+            continue
+        tols = [tolerance(out['dtype']), tolerance(ref['dtype'])]
+        if None in tols or 'norm' not in ref or 'norm' not in out:
+            ret.append("'%s' differs from the reference" % key)
+            continue
+        if out['nonfinite'] != ref['nonfinite']:
+            ret.append("'%s' has %d NaN or infinite elements, expected %d" % (key, out['nonfinite'], ref['nonfinite']))
+            continue
+        rtol = max(tols)
+        count = 1
+        for dim in ref['shape']:
+            count *= dim
+        count = max(count - ref['nonfinite'], 1)
+        rms = ref['norm'] / math.sqrt(count)
+        scales = {
+            'norm': ref['norm'],
+            'sum': ref['norm'] * math.sqrt(count),
+            'min': max(abs(ref.get('min', 0.0)), rms),
+            'max': max(abs(ref.get('max', 0.0)), rms),
+        }
+        for stat in ('norm', 'sum', 'min', 'max'):
+            if stat in ref and not _close(out.get(stat, float('nan')), ref[stat], rtol * scales[stat]):
+                ret.append("'%s' has %s %s, expected %s (relative tolerance %g)" % (
+                    key, stat, out.get(stat), ref[stat], rtol))
+    return ret
+
+
+def reference_key(record):
+    """Return the reference key of the JSON record of a run
+
+    The key is the benchmark script, size, dtype, seed, input file (--inputfn), and the script options that
+    differ from their defaults, e.g. 'heat_equation.py 100*100*10 float64 seed=42 --delta-interval=10'.
+    The options in the record's 'output_neutral' list, such as `--tiled`, are left out thus an optimized kernel
+    is validated against the output of the plain kernel.
+    """
+    size = "*".join(str(s) for s in record.get('size', []))
+    ret = "%s %s %s seed=%s" % (os.path.basename(record.get('script', '')), size, record.get('dtype'),
+                                record.get('seed'))
+    if record.get('inputfn') is not None:
+        ret += " inputfn=%s" % record['inputfn']
+    neutral = set(record.get('output_neutral', []))
+    for option, value in sorted(record.get('arguments', {}).items()):
+        if option not in neutral:
+            ret += " %s=%s" % (option, value)
+    return ret
+
+
+class References(object):
+    """The reference digests in the JSON file `path`, which is created when missing
+
+    `validate()` is thread-safe and writes new references to `path` immediately.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._refs = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._refs = json.load(f)
+
+    def validate(self, record):
+        """Validate the output of the JSON record of a run
+
+        Returns
+        -------
+        validation : dict
+            The 'status', which is 'passed', 'failed', 'new' (the output became the reference), or 'missing'
+            (no output digest in the record), the 'reference' key, and the 'errors' of a failed validation
+        """
+        key = reference_key(record)
+        ret = {'reference': key}
+        output = record.get('output')
+        if not output:
+            ret['status'] = 'missing'
+            return ret
+        with self._lock:
+            reference = self._refs.get(key)
+            if reference is None:
+                self._refs[key] = output
+                self._write()
+                ret['status'] = 'new'
+                return ret
+        errors = compare(output, reference)
+        ret['status'] = 'failed' if len(errors) > 0 else 'passed'
+        if len(errors) > 0:
+            ret['errors'] = errors
+        return ret
+
+    def _write(self):
+        tmp = "%s.tmp" % self.path
+        with open(tmp, 'w') as f:
+            json.dump(self._refs, f, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
@@ -45,7 +45,7 @@ def one_bar_per_cmd(args):
     values = []
     std = []
     for cmd in cmd_list:
-        res = util.extract_succeed_results(cmd, args.parse_regex, args.py_type)
+        res = util.extract_succeed_values(cmd, args)
         if len(res) == 0:
             res = [0]
         values.append(util.mean(res))
@@ -69,8 +69,7 @@ def one_bar_per_cmd(args):
     ax.set_xticks(ind*width+width/2.)
     ax.set_xticklabels(labels, rotation=args.xticklabel_rotation)
 
-    if args.ylabel is not None:
-        ax.set_ylabel(args.ylabel)
+    ax.set_ylabel(util.value_label(args))
 
     # Now make some labels
     value_labels(ax, ax.patches)
@@ -128,8 +127,8 @@ def main():
     )
     parser.add_argument(
         '--ylabel',
-        default="Elapsed time in seconds",
-        help="Label on the y-axis"
+        default=None,
+        help="Label on the y-axis (default: the elapsed time or the '--metric')"
     )
     parser.add_argument(
         '--xticklabel-rotation',
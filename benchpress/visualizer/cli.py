@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import json
-import re
 from benchpress.visualizer import util
 
 
@@ -18,13 +17,12 @@ def visualize(args):
             for job in cmd['jobs']:
                 if 'results' in job:
                     for res in job['results']:
-                        match_list = re.findall(args.parse_regex, res['stdout'])
-                        if res['success'] and len(match_list) > 0:
-                            for match in match_list:
-                                values.append(args.py_type(match))
+                        parsed = util.parse_values(res, args) if res['success'] else []
+                        if len(parsed) > 0:
+                            values.extend(parsed)
                         else:
                             values.append("N/A")
-        succeed_values = util.extract_succeed_results(cmd, args.parse_regex, args.py_type)
+        succeed_values = util.extract_succeed_values(cmd, args)
         mean = util.mean(succeed_values)
         std = util.standard_deviation(succeed_values)
         if args.csv:
@@ -35,6 +33,20 @@ def visualize(args):
             if len(succeed_values) > 0:
                 ret += " %.4f" % mean
                 ret += " (%.4f)" % std
+        if args.rusage:
+            maxrss = util.mean(util.extract_succeed_rusage(cmd, 'maxrss')) / 1024.0
+            cpu = util.mean(util.extract_succeed_rusage(cmd, util.cpu_utilization))
+            if args.csv:
+                ret += "%s %.1f%s %.2f" % (sep, maxrss, sep, cpu)
+            else:
+                ret += " maxrss: %.1f MiB, cpu: %.2f" % (maxrss, cpu)
+        if args.perf:
+            ipc = util.mean(util.extract_succeed_perf(cmd, util.instructions_per_cycle))
+            miss = util.mean(util.extract_succeed_perf(cmd, util.cache_miss_rate)) * 100
+            if args.csv:
+                ret += "%s %.2f%s %.1f" % (sep, ipc, sep, miss)
+            else:
+                ret += " ipc: %.2f, cache-miss: %.1f%%" % (ipc, miss)
         ret += "\n"
     return ret
 
@@ -53,6 +65,18 @@ def main():
         metavar="sep",
         help="Use the CSV format using 'sep' as the separator."
     )
+    parser.add_argument(
+        "--rusage",
+        action="store_true",
+        help="Also print the mean peak memory usage (MiB) and the mean CPU utilization "
+             "(CPU time / wall-clock time) of each command."
+    )
+    parser.add_argument(
+        "--perf",
+        action="store_true",
+        help="Also print the mean instructions per cycle and the mean cache-miss rate (%%) of each command "
+             "(requires a suite executed with `bp-run --perf-counters`)."
+    )
     args = parser.parse_args()
     if args.output is not None:
         args.output.write(visualize(args))
@@ -37,6 +37,7 @@ def line_per_cmd(args):
             y.append(mean)
             err.append(std)
         lines.append(ax.errorbar(x, y, fmt='-o', yerr=err))
+    ax.set_ylabel(util.value_label(args))
 
     if args.ymin is not None:
         plt.ylim(ymin=float(args.ymin))
@@ -109,8 +110,8 @@ def main():
     )
     parser.add_argument(
         '--ylabel',
-        default="Elapsed time in seconds",
-        help="Label on the y-axis"
+        default=None,
+        help="Label on the y-axis (default: the elapsed time or the '--metric')"
     )
     parser.add_argument(
         '--plot-size',
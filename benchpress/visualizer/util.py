@@ -6,6 +6,23 @@ import math
 import json
 
 
+# The regex that parses the elapsed time printed by `benchpress.util.Benchmark.pprint()`
+ELAPSED_REGEX = r'elapsed-time: ([\d.]+)'
+
+# The prefix of the line with the JSON record of a run printed by `benchpress.util.Benchmark.pprint()`
+RECORD_PREFIX = "bp-record: "
+
+# The environment variable that, when set to '1', makes `benchpress.util.Benchmark` print the JSON record
+RECORD_ENV = "BP_JSON_RECORD"
+
+# The axis labels of the throughput metrics in the JSON record (see `benchpress.util.Benchmark.work()`)
+METRIC_LABELS = {
+    'gflops': "GFLOP/s",
+    'gbytes': "GB/s",
+    'elements': "Elements/s",
+}
+
+
 class Color:
     HEAD = '\033[95m'
     BLUE = '\033[94m'
@@ -135,6 +152,86 @@ def standard_deviation(values):
     return math.sqrt(mean([abs(x - x_avg)**2 for x in values]))
 
 
+# Two-sided 95% critical values of Student's t-distribution with 1 to 30 degrees of freedom
+_T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def confidence_interval(values):
+    """Calculate the half-width of the 95% confidence interval of the mean.
+
+    Parameters
+    ----------
+    values : list
+        Sampled values
+
+    Returns
+    -------
+    out : float
+        The half-width of the confidence interval, which is zero when fewer than two values are given
+    """
+    count = len(values)
+    if count < 2:
+        return 0.0
+    x_avg = mean(values)
+    sample_std = math.sqrt(sum([(x - x_avg)**2 for x in values]) / (count - 1))
+    t = _T_95[count - 2] if count - 1 <= len(_T_95) else 1.96
+    return t * sample_std / math.sqrt(count)
+
+
+def parse_record(stdout):
+    """Parse the JSON record that `benchpress.util.Benchmark` printed in `stdout`
+
+    Parameters
+    ----------
+    stdout : str
+        The output of a run
+
+    Returns
+    -------
+    record : dict
+        The last record in `stdout` or None when `stdout` has no (valid) record
+    """
+    idx = stdout.rfind(RECORD_PREFIX)
+    while idx > 0 and stdout[idx - 1] != '\n':  # The record must start a line
+        idx = stdout.rfind(RECORD_PREFIX, 0, idx)
+    if idx == -1:
+        return None
+    end = stdout.find('\n', idx)
+    try:
+        return json.loads(stdout[idx + len(RECORD_PREFIX):end if end != -1 else len(stdout)])
+    except ValueError:
+        return None
+
+
+def parse_result(res, regex, py_type=int, dict_key='stdout'):
+    """Parse the values of a result
+
+    When `regex` is `ELAPSED_REGEX` and the result has a JSON record, the elapsed time is read from the record
+    instead of searching through the output.
+
+    Parameters
+    ----------
+    res : dict
+        The Benchpress result to parse
+    regex : str
+        The regex that extract the values
+    py_type : type
+        The Python type of the extracted values
+    dict_key : str
+        The dictionary key to extract from
+
+    Returns
+    -------
+    values : list
+        List of extracted values
+    """
+    if regex == ELAPSED_REGEX and dict_key == 'stdout' and 'elapsed' in res.get('record', {}):
+        return [py_type(res['record']['elapsed'])]
+    return [py_type(match) for match in re.findall(regex, res[dict_key])]
+
+
 def extract_succeed_results(cmd, regex, py_type=int, dict_key='stdout'):
     """Extract the values of the succeed results
     
@@ -143,7 +240,7 @@ def extract_succeed_results(cmd, regex, py_type=int, dict_key='stdout'):
     cmd : dict
         The Benchpress command to extract from
     regex : str
-        The regex that extract a value from each result
+        The regex that extract a value from each result (see `parse_result()`)
     py_type : type
         The Python type of the extracted 
     dict_key : str
@@ -157,13 +254,131 @@ def extract_succeed_results(cmd, regex, py_type=int, dict_key='stdout'):
     ret = []
     for job in cmd.get('jobs', []):
         for res in job.get('results', []):
-            match_list = re.findall(regex, res[dict_key])
-            if res['success'] and len(match_list) > 0:
-                for match in match_list:
-                    ret.append(py_type(match))
+            if not res['success']:  # Failed runs might not have any output
+                continue
+            ret.extend(parse_result(res, regex, py_type, dict_key))
+    return ret
+
+
+def parse_values(res, args):
+    """Parse the values of a result as specified by the visualizer arguments `args` (see `default_argparse()`)
+
+    The values are the throughput metric `args.metric` of the JSON record or else the matches of `args.parse_regex`.
+    """
+    if getattr(args, 'metric', None) is not None:
+        value = res.get('record', {}).get('throughput', {}).get(args.metric)
+        return [] if value is None else [args.py_type(value)]
+    return parse_result(res, args.parse_regex, args.py_type)
+
+
+def extract_succeed_values(cmd, args):
+    """Extract the values of the succeed results as specified by the visualizer arguments `args`, see `parse_values()`
+    """
+    ret = []
+    for job in cmd.get('jobs', []):
+        for res in job.get('results', []):
+            if res['success']:
+                ret.extend(parse_values(res, args))
+    return ret
+
+
+def value_label(args, default="Elapsed time in seconds"):
+    """Return the axis label of the values specified by the visualizer arguments `args`"""
+    if getattr(args, 'ylabel', None) is not None:
+        return args.ylabel
+    return METRIC_LABELS.get(getattr(args, 'metric', None), default)
+
+
+def _extract_succeed_struct(cmd, result_key, value_key):
+    """Extract values from the dict `result_key` of the succeed results, see `extract_succeed_rusage()`"""
+    if not callable(value_key):
+        key = value_key
+        value_key = lambda struct: struct[key]
+    ret = []
+    for job in cmd.get('jobs', []):
+        for res in job.get('results', []):
+            if res['success'] and result_key in res:
+                try:
+                    ret.append(value_key(res[result_key]))
+                except (KeyError, ZeroDivisionError):
+                    pass
     return ret
 
 
+def extract_succeed_rusage(cmd, rusage_key):
+    """Extract a resource usage field of the succeed results
+
+    Parameters
+    ----------
+    cmd : dict
+        The Benchpress command to extract from
+    rusage_key : str or function
+        The resource usage field to extract such as 'maxrss' or a function that takes the
+        resource usage dict of a result and returns the value to extract
+
+    Returns
+    -------
+    values : list
+        List of extracted values (results without resource usage are skipped)
+    """
+    return _extract_succeed_struct(cmd, 'rusage', rusage_key)
+
+
+def extract_succeed_record(cmd, record_key):
+    """Extract a field of the JSON record of the succeed results
+
+    Parameters
+    ----------
+    cmd : dict
+        The Benchpress command to extract from
+    record_key : str or function
+        The record field to extract such as 'elapsed' or a function that takes the record dict of a result
+        and returns the value to extract
+
+    Returns
+    -------
+    values : list
+        List of extracted values (results without a record are skipped)
+    """
+    return _extract_succeed_struct(cmd, 'record', record_key)
+
+
+def extract_succeed_perf(cmd, perf_key):
+    """Extract a hardware counter of the succeed results
+
+    Parameters
+    ----------
+    cmd : dict
+        The Benchpress command to extract from
+    perf_key : str or function
+        The event to extract such as 'cycles' or a function that takes the counter dict of a result
+        and returns the value to extract
+
+    Returns
+    -------
+    values : list
+        List of extracted values (results without the counter are skipped)
+    """
+    return _extract_succeed_struct(cmd, 'perf', perf_key)
+
+
+def cpu_utilization(rusage):
+    """Return the CPU time of a resource usage dict relative to its wall-clock time (1.0 equals one busy core)"""
+    if rusage['wall'] <= 0:
+        return 0.0
+    return (rusage['utime'] + rusage['stime']) / rusage['wall']
+
+
+def instructions_per_cycle(perf):
+    """Return the instructions per cycle of a hardware counter dict"""
+    return perf['instructions'] / float(perf['cycles'])
+
+
+def cache_miss_rate(perf):
+    """Return the fraction of cache references that missed of a hardware counter dict"""
+    return perf['cache-misses'] / float(perf['cache-references'])
+
+
 def default_argparse(description, multiple_result_files=False):
     """Get the default argparse object
     
@@ -212,9 +427,16 @@ def default_argparse(description, multiple_result_files=False):
         "--parse-regex",
         metavar="RegEx",
         type=str,
-        default='elapsed-time: ([\d.]+)',
+        default=ELAPSED_REGEX,
         help="How to parse the result of each run. For each RegEx match, group one is recorded as a result."
     )
+    parser.add_argument(
+        "--metric",
+        choices=sorted(METRIC_LABELS.keys()),
+        default=None,
+        help="Use the throughput of each run instead of '--parse-regex': GFLOP/s ('gflops'), GB/s ('gbytes'), or "
+             "elements/s ('elements'). Requires benchmarks that declare their work (see `Benchmark.work()`)."
+    )
     parser.add_argument(
         "--py-type",
         choices=['float', 'int', 'str'],
@@ -312,7 +534,7 @@ def means_series_map(args):
         cmd_list = suite['cmd_list']
         cmd_list = filter_cmd_list(cmd_list, args.labels_to_include, args.labels_to_exclude)
         for cmd in cmd_list:
-            succeed_values = extract_succeed_results(cmd, args.parse_regex, args.py_type)
+            succeed_values = extract_succeed_values(cmd, args)
             avg = mean(succeed_values)
             std = standard_deviation(succeed_values)
             if cmd['label'] not in means:
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+A warm Python process that executes Python benchmark scripts.
+
+Usage::
+
+    python worker.py
+
+`bp-run --python-worker` starts a worker for each Python interpreter and environment. The worker imports NumPy
+(and Benchpress when available) once and then reads requests from stdin, one JSON object per line::
+
+    {"argv": ["heat_equation.py", "--size=100*100*10"], "outfile": "/path/to/run-0", "timeout": null,
+     "max_output": 1048576, "keep_regex": "^bp-record: "}
+
+For each request, the worker forks a child that executes the script as `__main__` with `argv` as `sys.argv`.
+Thus, every run starts from the same freshly imported state. Like `rusage.py`, the worker reads the stdout and
+stderr of the child through pipes, keeps 'max_output' bytes of each plus the lines that match 'keep_regex', and
+writes them to 'outfile.out' and 'outfile.err'. When the child exits, the worker writes the resource usage of the
+child to 'outfile.rusage' and replies `{"exit_code": <exit code>}` on stdout. When 'outfile' is null, the output
+is discarded. When 'timeout' is set, the child is terminated after 'timeout' seconds like in `rusage.py`.
+
+.. note:: Like `rusage.py`, this file must not import `benchpress` unconditionally.
+
+"""
+from __future__ import absolute_import
+import os
+import sys
+import json
+import runpy
+import atexit
+import traceback
+
+import rusage
+
+
+def _redirect(fd, path):
+    """Redirect the file descriptor 'fd' to the file 'path'"""
+    flags = os.O_RDONLY if fd == 0 else os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    new_fd = os.open(path, flags, 0o644)
+    os.dup2(new_fd, fd)
+    os.close(new_fd)
+
+
+def run_script(argv, pipes, timeout=None):
+    """Execute the Python script 'argv[0]' as `__main__` and exit the process. NB: never returns!
+
+    The stdout and stderr go to 'pipes', which maps them to a pipe (read end, write end), or else to `os.devnull`.
+    """
+    if timeout is not None:
+        rusage.new_process_group()
+    _redirect(0, os.devnull)
+    for fd in (1, 2):
+        if fd in pipes:
+            (read_end, write_end) = pipes[fd]
+            os.dup2(write_end, fd)
+            os.close(read_end)
+            os.close(write_end)
+        else:
+            _redirect(fd, os.devnull)
+    sys.argv = list(argv)
+    sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+    exit_code = 0
+    try:
+        runpy.run_path(argv[0], run_name='__main__')
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            exit_code = e.code or 0
+        else:
+            sys.stderr.write("%s\n" % e.code)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    try:
+        atexit._run_exitfuncs()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def main():
+    # The replies go to the original stdout, anything else written to stdout goes to stderr
+    reply = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    # The imports we want to amortize over all runs
+    try:
+        import numpy
+        from benchpress import util
+    except ImportError:
+        pass
+
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        timeout = request.get('timeout')
+        outfile = request['outfile']
+        pipes = {}  # Maps the file descriptor of the child to the pipe (read end, write end)
+        outputs = {}  # Maps the extension of the output files to their buffer
+        if outfile is not None:
+            for fd, ext in ((1, 'out'), (2, 'err')):
+                pipes[fd] = os.pipe()
+                outputs[ext] = rusage.CappedOutput(request.get('max_output', rusage.MAX_OUTPUT),
+                                                   request.get('keep_regex'))
+        start = rusage._clock()
+        pid = os.fork()
+        if pid == 0:
+            run_script(request['argv'], pipes, timeout)
+        if timeout is not None:
+            rusage.new_process_group(pid)
+        readers = {}
+        for fd, (read_end, write_end) in pipes.items():
+            os.close(write_end)
+            readers[read_end] = outputs['out' if fd == 1 else 'err']
+        (exit_code, usage) = rusage.wait(pid, start, timeout, readers)
+        if outfile is not None:
+            for ext, buf in outputs.items():
+                with open("%s.%s" % (outfile, ext), 'wb') as f:
+                    f.write(buf.getvalue())
+            with open("%s.rusage" % outfile, 'w') as f:
+                json.dump(usage, f)
+        reply.write(json.dumps({'exit_code': exit_code}) + "\n")
+        reply.flush()
+
+
+if __name__ == "__main__":
+    main()